@@ -0,0 +1,108 @@
+from PyQt5.QtWidgets import (QComboBox, QDialog, QDialogButtonBox, QFormLayout, QLabel, QSpinBox, QVBoxLayout,
+                             QWidget)
+
+from encoders import ENCODERS, EncoderConfig
+
+
+class EncoderDialog(QDialog):
+    """
+    A dialog to choose the encoder used to save a video and the values of its options, see encoders.py
+    Backends that are not available (e.g. ffmpeg is not installed) are shown but cannot be selected.
+    It also lets the user write the time spent in each stage of the export next to the video (see Profiler.export())
+    """
+    # The formats in which the timings can be written {label => extension added to the video's name, or None}
+    TRACE_FORMATS = {"None": None, "JSON": ".json", "CSV": ".csv"}
+
+    def __init__(self, parent, encoder=None, trace_extension=None):
+        """
+        :param parent: the parent widget
+        :param encoder: the EncoderConfig initially shown, None for the default one
+        :param trace_extension: the format of the timings initially selected (a value of TRACE_FORMATS)
+        """
+        super().__init__(parent)
+        self.setWindowTitle("Encoder")
+        encoder = encoder or EncoderConfig()
+        # The values of the options of every backend, kept when switching from one backend to another
+        self.values = {name: dict(encoder.options) if name == encoder.backend else EncoderConfig(name).options
+                       for name in ENCODERS}
+        # The widget of each option of the current backend {name => QComboBox or QSpinBox}
+        self.option_widgets = {}
+
+        layout = QVBoxLayout()
+        self.backend_combo = QComboBox()
+        for name, backend in ENCODERS.items():
+            self.backend_combo.addItem(name)
+            if not backend.available():
+                # Shown so that the user knows it exists, but disabled
+                self.backend_combo.model().item(self.backend_combo.count() - 1).setEnabled(False)
+        self.backend_combo.setCurrentText(encoder.backend)
+        self.backend_combo.currentTextChanged.connect(self.show_options)
+        layout.addWidget(self.backend_combo)
+
+        # The options of the current backend, rebuilt when the backend changes
+        self.options_widget = QWidget()
+        self.options_layout = QFormLayout(self.options_widget)
+        layout.addWidget(self.options_widget)
+
+        trace_layout = QFormLayout()
+        self.trace_combo = QComboBox()
+        self.trace_combo.addItems(self.TRACE_FORMATS)
+        self.trace_combo.setCurrentText(
+            next(label for label, extension in self.TRACE_FORMATS.items() if extension == trace_extension))
+        self.trace_combo.setToolTip("Also write the time spent in each stage of the export, "
+                                    "into a file named after the video")
+        trace_layout.addRow(QLabel("Export timings"), self.trace_combo)
+        layout.addLayout(trace_layout)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+        self.setLayout(layout)
+
+        self.current_backend = encoder.backend
+        self.show_options(encoder.backend)
+
+    def show_options(self, backend):
+        """
+        Shows a widget for every option of a backend
+        """
+        self.keep_values()
+        self.current_backend = backend
+        while self.options_layout.rowCount() > 0:
+            self.options_layout.removeRow(0)
+        self.option_widgets = {}
+        for option in ENCODERS[backend].options:
+            value = self.values[backend][option.name]
+            if option.choices is not None:
+                widget = QComboBox()
+                widget.addItems(option.choices)
+                widget.setCurrentText(value)
+            else:
+                widget = QSpinBox()
+                widget.setRange(option.min_val, option.max_val)
+                widget.setValue(value)
+            widget.setToolTip(option.description)
+            self.option_widgets[option.name] = widget
+            self.options_layout.addRow(QLabel(option.name), widget)
+
+    def keep_values(self):
+        """
+        Reads the values of the options currently shown
+        """
+        for name, widget in self.option_widgets.items():
+            self.values[self.current_backend][name] = \
+                widget.currentText() if isinstance(widget, QComboBox) else widget.value()
+
+    def config(self):
+        """
+        :return: the EncoderConfig chosen by the user
+        """
+        self.keep_values()
+        return EncoderConfig(self.current_backend, self.values[self.current_backend])
+
+    def trace_extension(self):
+        """
+        :return: the extension of the file of timings chosen by the user, None not to write any
+        """
+        return self.TRACE_FORMATS[self.trace_combo.currentText()]
@@ -0,0 +1,39 @@
+import threading
+import traceback
+from PyQt5 import QtCore
+
+from frame_index import FrameIndex
+
+
+class IndexBuilder(QtCore.QObject):
+    """
+    Loads the index of a video, or builds it if there is none yet, in a separate thread in order not to block the UI
+    Building reads the whole file, which may take a while on long videos: the player remains usable in the meantime
+    and only seeks faster once the index is known
+    """
+    # The path of the video and its FrameIndex, None if it could not be built
+    finished = QtCore.pyqtSignal(str, object)
+
+    def __init__(self, source_filename):
+        """
+        :param source_filename: path of the video to index
+        """
+        super().__init__()
+        self.source_filename = source_filename
+        self.stop_event = threading.Event()
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        index = None
+        try:
+            index = FrameIndex.load_or_build(self.source_filename, self.stop_event)
+        except:
+            # Let's make sure we get some trace if anything goes wrong in this thread
+            traceback.print_exc()
+        self.finished.emit(self.source_filename, index)
+
+    def stop(self):
+        """
+        Stops building the index as soon as possible, e.g. when another video is opened - can be called from any thread
+        """
+        self.stop_event.set()
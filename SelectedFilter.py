@@ -1,6 +1,7 @@
 class SelectedFilter:
     """
-    A simple container for a filter and its attributes.
+    A simple container for a filter and its attributes in the UI.
+    The values of the filter's parameters are in the current FilterChain, in the entry with the same uid.
 
     Attributes
     ----------
@@ -8,13 +9,13 @@ class SelectedFilter:
         the filter itself
     widget : QWidget
         a widget associated to the filter, typically a frame that contains the sliders, labels, etc.
-    index : int
-        the index of the filter in the list of currently selected filters
-    vals : array of objects {name => value}
-        the current values of the filter's parameters
+    uid : int
+        the uid of the filter's entry in the FilterChain
+    timing_label : QLabel or None
+        the label in the widget showing the time spent in the filter
     """
-    def __init__(self, filter, widget, index, vals):
+    def __init__(self, filter, widget, uid, timing_label=None):
         self.filter = filter
         self.widget = widget
-        self.index = index
-        self.vals = vals
+        self.uid = uid
+        self.timing_label = timing_label
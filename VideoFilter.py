@@ -1,12 +1,26 @@
 import sys, os
+import time
+# When the app was launched, to report how long it takes to start (see VideoPlayer.__init__())
+LAUNCH_TIME = time.perf_counter()
 import cv2
 import multiprocessing
 
+from encoders import EncoderConfig
+from EncoderDialog import EncoderDialog
+from filter_chain import FilterChain
+from frame_cache import FrameCache
+from frame_format import open_video, video_format
+from frame_index import seek
+from IndexBuilder import IndexBuilder
 from VideoSaver import VideoSaver
+from frame_prefetcher import FramePrefetcher
+from playback_clock import PlaybackClock
+from profiler import Profiler, format_summary
+from preview_renderer import PreviewRenderer
 
 # There is a collision between OpneCV's Qt libraries and the ones on my system - may happen on other systems too!
 # Use only the headless parst of OpenCV so that OpenCV's Qt libraries are not imported
-ci_build_and_not_headless = False
+ci_and_not_headless = False
 try:
     from cv2.version import ci_build, headless
     ci_and_not_headless = ci_build and not headless
@@ -19,17 +33,43 @@ if sys.platform.startswith("linux") and ci_and_not_headless:
 
 from filter_loader import FilterLoader
 from SelectedFilter import SelectedFilter
-from PyQt5 import QtGui
 from PyQt5.QtCore import Qt, QUrl, QTimer, QThread
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import (QApplication, QHBoxLayout, QMainWindow,
                              QPushButton, QVBoxLayout, QWidget, QFrame, QLabel, QDialog, QComboBox, QDialogButtonBox,
-                             QScrollArea, QSlider, QSizePolicy, QFileDialog)
+                             QScrollArea, QSlider, QSizePolicy, QFileDialog, QCheckBox)
 
 
 class VideoPlayer(QMainWindow):
     # Sliders use ints and the filters for parameters are floats, transform them into large ints using this factor
     SLIDER_FACTOR = 100000
+    # Size of the video widget
+    PREVIEW_SIZE = (800, 600)
+    # Number of processes used to apply the filters when saving a video - 1 to filter in the saving thread
+    EXPORT_WORKERS = max(1, multiprocessing.cpu_count() - 1)
+    # Maximum number of decoded frames waiting to be filtered when saving with several processes
+    EXPORT_QUEUE_SIZE = 32
+    # When more than 1, saving splits the video into this number of segments rendered separately and joined at the end
+    EXPORT_SEGMENTS = 1
+    # Number of consecutive frames filtered together when saving, so that the filters that support it process a whole
+    # block of frames at once (see Filter.apply_batch()) - 1 to filter the frames one by one
+    EXPORT_BATCH_SIZE = 8
+    # Number of frames decoded in advance by the background decoding thread while playing
+    PREFETCH_DEPTH = 8
+    # The chain of filters is saved in this file when the app is closed, and restored at startup
+    LAST_CHAIN_FILE = os.path.join(os.path.expanduser("~"), ".video_filter_last_chain.json")
+    # Maximum size (in bytes) of the intermediate results kept while paused to re-render the frame faster
+    PREVIEW_CACHE_SIZE = 256 * 1024 * 1024
+    # Number of threads applying the filters that support it in strips of the frame in the preview (see TilePool),
+    # 1 to filter the whole frame at once
+    PREVIEW_TILE_THREADS = multiprocessing.cpu_count()
+    # How often (in milliseconds) the time spent in each stage of the preview is refreshed on screen
+    TIMINGS_REFRESH = 500
+    # Maximum size (in bytes) of the decoded frames kept on disk when "Cache frames" is checked, see frame_cache.py
+    FRAME_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+    # The format of the time spent in each stage initially selected when saving a video: the timings are written
+    # into the target's name + this extension (.json or .csv, see Profiler.export()) - None not to record anything
+    EXPORT_TRACE_EXTENSION = None
 
     def __init__(self):
         super().__init__()
@@ -37,29 +77,71 @@ class VideoPlayer(QMainWindow):
 
         # A timer used to play every frame
         self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
         self.timer.timeout.connect(self.read_frame)
+        # The presentation clock used in real-time mode - will be initialized in play()
+        self.clock = None
 
         # The path to the source video - is initialized by the Open Video button
         self.source_video_path = None
-        # initialize the field for video capture - will be used in play()
-        self.cap = None
+        # The background decoder of the video being played - will be initialized in play()
+        self.prefetcher = None
         self.fps = None
         # The combobox that holds the filters in the dialog - used to retrieve the selected filter
         self.filter_combo = None
         # The current frame being shown in the video - used when pausing
         self.cur_frame = None
+        # The index of the current frame in the video
+        self.cur_index = -1
+        # The keyframes of the video, used to seek faster - None until it is loaded or built in the background
+        self.frame_index = None
+        # Builds the index of the opened video - a new one (and a new thread) for every video
+        self.index_builder = None
+        self.index_thread = None
+        # A capture only used to decode single frames while paused,
+        # and the index of the frame that its next read() returns
+        self.seek_cap = None
+        self.seek_position = 0
+        # The decoded frames of the video kept in a memory-mapped file, None if "Cache frames" is not checked
+        self.frame_cache = None
+        # The frames to save, set with the In/Out buttons: first one and the one after the last - None for all
+        self.export_start = None
+        self.export_end = None
         # A thread used to save videos
         self.saving_thread = QThread()
         # Will be used to save videos
         self.saver = None
-
-        # We need to lock things to avoid concurrent modification / reading of filters while playing the video
-        self.lock = multiprocessing.Manager().Lock()
-
-        # Load all defined filters
-        self.all_filters = FilterLoader.load_filters(["filters"])
-        # array of current filters: [SelectedFilter]
+        # The encoder used to save videos, chosen when saving and kept with the last chain
+        self.encoder = EncoderConfig()
+        # The format of the timings written when saving a video, chosen with the encoder (see EncoderDialog)
+        self.trace_extension = self.EXPORT_TRACE_EXTENSION
+
+        # Find all defined filters: they are only imported when they are first added to the chain
+        start = time.perf_counter()
+        self.all_filters = FilterLoader.discover("filters")
+        discovery_time = time.perf_counter() - start
+        # array of current filters in the UI: [SelectedFilter]
         self.selected_filters = []
+        # The current filters and their values. Modifications replace the snapshot with a new one, so that
+        # rendering can read it at any time without locking
+        self.chain = FilterChain()
+        # The time spent in every stage of the preview: decoding, filters, resizing and conversion to a QImage
+        self.profiler = Profiler()
+        # Applies the chain to the frames shown in the video widget in its own thread
+        self.render_thread = QThread()
+        self.renderer = PreviewRenderer(self.PREVIEW_SIZE, self.PREVIEW_CACHE_SIZE, self.profiler,
+                                        self.PREVIEW_TILE_THREADS)
+        self.renderer.moveToThread(self.render_thread)
+        self.renderer.rendered.connect(self.display_frame)
+        self.renderer.failed.connect(self.skip_frame)
+        self.render_thread.start()
+        # The number of the last request sent to the renderer, and of the last one displayed
+        self.last_request = 0
+        self.displayed_request = 0
+        # Refreshes the timings on screen - not at every frame, which would be pointless and slow down playback
+        self.timings_timer = QTimer()
+        self.timings_timer.timeout.connect(self.update_timings)
+        self.timings_timer.start(self.TIMINGS_REFRESH)
 
         # Initialize all components
         main_widget = QWidget(self)
@@ -87,7 +169,13 @@ class VideoPlayer(QMainWindow):
 
         # Now the video part
         self.video_frame = QLabel()
-        self.video_frame.setFixedSize(800, 600)
+        self.video_frame.setFixedSize(*self.PREVIEW_SIZE)
+
+        # The timeline under the video, one step per frame
+        self.timeline = QSlider(Qt.Horizontal)
+        self.timeline.setEnabled(False)
+        self.timeline.valueChanged[int].connect(self.timeline_changed)
+        self.timeline.sliderReleased.connect(self.timeline_released)
 
         # All buttons under the video
         buttons_layout = QHBoxLayout()
@@ -104,18 +192,97 @@ class VideoPlayer(QMainWindow):
         pause_button.clicked.connect(self.pause)
         buttons_layout.addWidget(pause_button)
 
+        # The range of frames to save
+        in_button = QPushButton("In", self)
+        in_button.clicked.connect(self.set_export_start)
+        buttons_layout.addWidget(in_button)
+
+        out_button = QPushButton("Out", self)
+        out_button.clicked.connect(self.set_export_end)
+        buttons_layout.addWidget(out_button)
+
         save_button = QPushButton("Save Video", self)
         save_button.clicked.connect(self.save_video)
         buttons_layout.addWidget(save_button)
 
+        # In real-time mode, late frames are dropped so that playback follows the clock
+        self.realtime_checkbox = QCheckBox("Real-time", self)
+        self.realtime_checkbox.setChecked(True)
+        self.realtime_checkbox.toggled.connect(self.reset_clock)
+        buttons_layout.addWidget(self.realtime_checkbox)
+
+        # In fast preview mode, frames are resized before being filtered instead of after
+        self.fast_preview_checkbox = QCheckBox("Fast preview", self)
+        self.fast_preview_checkbox.setChecked(True)
+        self.fast_preview_checkbox.toggled.connect(self.refresh_if_paused)
+        buttons_layout.addWidget(self.fast_preview_checkbox)
+
+        # Frames are decoded once and then read from a file, e.g. when playing the same part of the video many times
+        self.frame_cache_checkbox = QCheckBox("Cache frames", self)
+        self.frame_cache_checkbox.toggled.connect(self.toggle_frame_cache)
+        buttons_layout.addWidget(self.frame_cache_checkbox)
+
+        # The range of frames to save, see set_export_start()
+        self.range_label = QLabel()
+        self.update_range_label()
+        # Playback statistics under the buttons
+        self.playback_label = QLabel()
+        # Time spent in the stages that are not filters
+        self.timings_label = QLabel()
+
         video_layout.addWidget(self.video_frame)
+        video_layout.addWidget(self.timeline)
         video_layout.addLayout(buttons_layout)
+        video_layout.addWidget(self.range_label)
+        video_layout.addWidget(self.playback_label)
+        video_layout.addWidget(self.timings_label)
 
         # Set both layouts to the main layout
         main_layout.addLayout(video_layout)
         main_layout.addLayout(filters_layout)
         self.setCentralWidget(main_widget)
 
+        self.restore_last_chain()
+        print("Started in %.0f ms - found %d filters in %.0f ms, %d of them imported"
+              % ((time.perf_counter() - LAUNCH_TIME) * 1000, len(self.all_filters), discovery_time * 1000,
+                 sum(1 for f in self.all_filters.values() if f.loaded)))
+
+    def restore_last_chain(self):
+        """
+        Restores the filters that were selected when the app was last closed, and the encoder last used
+        """
+        if not os.path.exists(self.LAST_CHAIN_FILE):
+            return
+        try:
+            chain = FilterChain.load(self.LAST_CHAIN_FILE, self.all_filters)
+            self.encoder = EncoderConfig.load(self.LAST_CHAIN_FILE)
+        except (OSError, ValueError, ImportError) as e:
+            print("Could not restore the last filters: " + str(e))
+            return
+        self.chain = chain
+        for entry in chain:
+            self.add_filter_widget(entry)
+
+    def closeEvent(self, event):
+        """
+        Saves the current filters so that they are restored at the next startup
+        """
+        try:
+            self.chain.save(self.LAST_CHAIN_FILE, self.encoder)
+        except OSError as e:
+            print("Could not save the current filters: " + str(e))
+        self.render_thread.quit()
+        self.render_thread.wait()
+        self.renderer.close()
+        self.stop_indexing()
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+        if self.seek_cap is not None:
+            self.seek_cap.release()
+        if self.frame_cache is not None:
+            self.frame_cache.close()
+        super().closeEvent(event)
+
     def open_video(self):
         """
         Opens an "Open file" dialog to open the source video.
@@ -128,11 +295,190 @@ class VideoPlayer(QMainWindow):
             "Videos (*.mp4 *.avi *.m4v *.mkv *.mpg *.mpeg);;All Files (*)",
             options=QFileDialog.Options())
         if filename:
-            self.source_video_path = filename
+            self.set_source(filename)
+
+    def set_source(self, filename):
+        """
+        Makes a video the source: it is shown from its first frame, and its index is loaded or built in the background
+        :param filename: path of the video
+        """
+        self.timer.stop()
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        if self.seek_cap is not None:
+            self.seek_cap.release()
+        self.stop_indexing()
+        self.source_video_path = filename
+        self.frame_index = None
+        self.export_start = None
+        self.export_end = None
+        self.update_range_label()
+        self.seek_cap = open_video(filename)
+        self.seek_position = 0
+        self.fps = self.seek_cap.get(cv2.CAP_PROP_FPS)
+        self.open_frame_cache()
+        # The container's frame count may only be an estimate, the index tells the exact one once it is built
+        self.set_frame_count(int(self.seek_cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.cur_index = -1
+        self.seek(0)
+
+        self.index_builder = IndexBuilder(filename)
+        self.index_thread = QThread()
+        self.index_builder.moveToThread(self.index_thread)
+        self.index_thread.started.connect(self.index_builder.run)
+        self.index_builder.finished.connect(self.index_thread.quit)
+        self.index_builder.finished.connect(self.index_ready)
+        self.index_thread.start()
+
+    def open_frame_cache(self):
+        """
+        Opens the frame cache of the current video if "Cache frames" is checked, closes it otherwise
+        """
+        if self.frame_cache is not None:
+            self.frame_cache.close()
+            self.frame_cache = None
+        if self.seek_cap is None or not self.frame_cache_checkbox.isChecked():
+            return
+        try:
+            self.frame_cache = FrameCache.open(self.source_video_path,
+                                               int(self.seek_cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                               int(self.seek_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                                               self.FRAME_CACHE_SIZE, video_format(self.seek_cap))
+        except OSError as e:
+            print("Could not open the frame cache: " + str(e))
+
+    def toggle_frame_cache(self):
+        """
+        Called when "Cache frames" is checked or unchecked
+        """
+        playing = self.timer.isActive()
+        # The decoding thread must not use the cache while it is replaced
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        self.open_frame_cache()
+        if playing:
+            self.start_playback(self.cur_index + 1)
+
+    def stop_indexing(self):
+        """
+        Stops building the index of the previous video if it is still running
+        """
+        if self.index_thread is not None:
+            self.index_builder.stop()
+            self.index_thread.quit()
+            self.index_thread.wait()
+            self.index_thread = None
+            self.index_builder = None
+
+    def index_ready(self, filename, frame_index):
+        """
+        Called when the index of a video has been loaded or built, see IndexBuilder
+        """
+        if filename != self.source_video_path or frame_index is None:
+            # Another video was opened in the meantime, or the video cannot be indexed: OpenCV seeks on its own
+            return
+        self.frame_index = frame_index
+        self.set_frame_count(frame_index.frame_count)
+        print("Indexed " + str(frame_index.frame_count) + " frames, " + str(len(frame_index.keyframes)) + " keyframes")
+
+    def set_frame_count(self, frame_count):
+        """
+        Sets the range of the timeline
+        """
+        self.timeline.blockSignals(True)
+        self.timeline.setRange(0, max(0, frame_count - 1))
+        self.timeline.blockSignals(False)
+        self.timeline.setEnabled(frame_count > 0)
+
+    def set_timeline(self, index):
+        """
+        Moves the timeline to a frame without seeking
+        """
+        if not self.timeline.isSliderDown():
+            self.timeline.blockSignals(True)
+            self.timeline.setValue(index)
+            self.timeline.blockSignals(False)
+
+    def timeline_changed(self, index):
+        """
+        Called when the timeline is moved by the user
+        While playing, the video only seeks once the timeline is released, while paused it follows the timeline
+        """
+        if not self.timeline.isSliderDown() or not self.timer.isActive():
+            self.seek(index)
+
+    def timeline_released(self):
+        if self.timer.isActive():
+            self.seek(self.timeline.value())
+
+    def seek(self, index):
+        """
+        Shows a frame of the video - playback then continues from there
+        :param index: the index of the frame
+        """
+        if self.source_video_path is None:
+            return
+        if self.timer.isActive():
+            self.cur_index = index - 1
+            self.start_playback(index)
+            return
+        # Paused: decode this frame only, playback restarts from there when resumed (see pause())
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        frame = None if self.frame_cache is None else self.frame_cache.get(index)
+        if frame is None:
+            start = time.perf_counter()
+            seek(self.seek_cap, index, self.frame_index, self.seek_position)
+            ret, frame = self.seek_cap.read()
+            if not ret:
+                # Beyond the end of the video: the position of the capture is unknown
+                self.seek_position = None
+                return
+            self.profiler.record("seek", time.perf_counter() - start)
+            self.seek_position = index + 1
+            if self.frame_cache is not None:
+                frame = self.frame_cache.put(index, frame)
+        self.cur_index, self.cur_frame = index, frame
+        self.set_timeline(index)
+        self.show_curframe()
+
+    def set_export_start(self):
+        """
+        The current frame becomes the first one to save
+        """
+        if self.cur_index < 0:
+            return
+        self.export_start = self.cur_index
+        if self.export_end is not None and self.export_end <= self.export_start:
+            self.export_end = None
+        self.update_range_label()
+
+    def set_export_end(self):
+        """
+        The current frame becomes the last one to save
+        """
+        if self.cur_index < 0:
+            return
+        self.export_end = self.cur_index + 1
+        if self.export_start is not None and self.export_start >= self.export_end:
+            self.export_start = None
+        self.update_range_label()
+
+    def update_range_label(self):
+        if self.export_start is None and self.export_end is None:
+            self.range_label.setText("Saving: whole video")
+        else:
+            self.range_label.setText(
+                "Saving: frames " + str(self.export_start or 0) + " to " +
+                ("the end" if self.export_end is None else str(self.export_end - 1)))
 
     def save_video(self):
         """
-        Opens a "Save file" dialog to determine the target file path.
+        Opens a "Save file" dialog to determine the target file path, then the encoder dialog to choose the encoder
+        (and whether the timings of the export are written next to the video).
         Saves the video while applying all the filters
         """
         if self.source_video_path is None:
@@ -141,75 +487,166 @@ class VideoPlayer(QMainWindow):
             self,
             "Save File",
             "",
-            "Videos (*.avi)")
+            "Videos (*.avi *.mp4 *.mkv)")
         if filename:
+            encoder_dialog = EncoderDialog(self, self.encoder, self.trace_extension)
+            if not encoder_dialog.exec():
+                return
+            self.encoder = encoder_dialog.config()
+            self.trace_extension = encoder_dialog.trace_extension()
+            trace_filename = None if self.trace_extension is None else filename + self.trace_extension
             # load all the filters and their values
-            fs, vals = self.get_current_filter_info()
-            self.saver = VideoSaver(self.source_video_path, filename, fs, vals)
+            self.saver = VideoSaver(self.source_video_path, filename, self.chain,
+                                    self.EXPORT_WORKERS, self.EXPORT_QUEUE_SIZE, self.EXPORT_SEGMENTS,
+                                    trace_filename, self.export_start or 0, self.export_end, self.encoder,
+                                    self.EXPORT_BATCH_SIZE)
             self.saver.moveToThread(self.saving_thread)
             self.saving_thread.started.connect(self.saver.run)
             #saver.finished.connect(self.saving_thread.quit)
             #saver.progress.connect(self.report_progress) TODO report the progress of saving the file
             self.saving_thread.start()
 
-    def get_current_filter_info(self):
-        """
-        Retrieves the currently selected filters and their parameters
-        :return: fs [Filter], vals [{name => value}]
-        """
-        fs = []
-        vals = []
-        with self.lock:
-            for sf in self.selected_filters:
-                fs.append(sf.filter)
-                vals.append(sf.vals)
-        return fs, vals
-
     def read_frame(self):
         """
-        Reads a single frame of the video if there is a next one and calls show_curframe()
+        Takes the next decoded frame of the video if there is one and calls show_curframe()
         Sets self.cur_frame accordingly
         """
-        if not self.cap or not self.cap.isOpened():
+        if self.prefetcher is None:
             self.timer.stop()
             return
-        ret, frame = self.cap.read()
-        if not ret:
-            self.timer.stop()
+        if not self.realtime_checkbox.isChecked() and self.displayed_request != self.last_request:
+            # Every frame is shown: wait until the previous one has been rendered
+            return
+        if self.realtime_checkbox.isChecked():
+            # Frames that should already have been shown are not even decoded
+            due_index = self.clock.due_index()
+            self.prefetcher.skip_to(due_index)
+            item = self.prefetcher.read(due_index)
+        else:
+            item = self.prefetcher.read()
+        if item is None:
+            if self.prefetcher.finished:
+                self.timer.stop()
+            else:
+                # Decoding is late (or it is too early for the next frame): keep the current frame
+                self.update_playback_label()
             return
-        self.cur_frame = frame
+        self.cur_index, self.cur_frame = item
+        self.set_timeline(self.cur_index)
         self.show_curframe()
+        self.update_playback_label()
+
+    def reset_clock(self):
+        """
+        Restarts the presentation clock from the current frame, e.g. when switching to real-time mode
+        """
+        if self.prefetcher is None:
+            return
+        self.clock = PlaybackClock(self.fps, self.cur_index + 1)
+        if not self.timer.isActive():
+            self.clock.pause()
+
+    def refresh_if_paused(self):
+        """
+        Shows the current frame again if the video is not running, e.g. after the preview mode changed
+        """
+        if not self.timer.isActive():
+            self.show_curframe()
+
+    def update_playback_label(self):
+        """
+        Shows the playback statistics under the video
+        """
+        if self.prefetcher is not None:
+            self.playback_label.setText(
+                "Effective fps: " + str(round(self.clock.effective_fps(), 1)) +
+                " - dropped frames: " + str(self.prefetcher.dropped) +
+                " - buffer underruns: " + str(self.prefetcher.underruns) +
+                " - skipped renders: " + str(self.renderer.skipped) +
+                " - cached frames: " + str(self.prefetcher.cached))
+
+    def update_timings(self):
+        """
+        Shows the time spent in each filter in its frame, and the time spent in the other stages under the video
+        """
+        # Read from the rendering thread: the pipeline is replaced but never modified, so this is safe
+        pipeline = self.renderer.preview.pipeline
+        for selected_filter in self.selected_filters:
+            stage = None if pipeline is None else pipeline.stage_of(selected_filter.uid)
+            if stage is None:
+                selected_filter.timing_label.setText("-")
+                continue
+            text = format_summary(self.profiler.summary(pipeline.keys[stage]))
+            if len(pipeline.stages[stage].uids) > 1:
+                # The time of merged filters cannot be told apart
+                text += " (merged: " + pipeline.stages[stage].name() + ")"
+            selected_filter.timing_label.setText(text)
+        self.timings_label.setText(" - ".join(
+            name + ": " + format_summary(self.profiler.summary(name))
+            for name in ("decode", "seek", "resize", "qimage")))
 
     def show_curframe(self):
         """
-        Filters and shows the current frame in the video widget
+        Asks for the current frame to be filtered and shown in the video widget, see display_frame()
         Assumes self.cur_frame is correctly set to the current frame
         """
         if self.cur_frame is None:
             return
-        fs, vals = self.get_current_filter_info()
-        frame = self.cur_frame
-        # Apply current filters with their values
-        for i in range(len(fs)):
-            frame = fs[i].apply_filter(frame, vals[i])
-        # Size it to screen size
-        frame = cv2.resize(frame, (800, 600))
-        # Prepare the image to be rendered in a QObject
-        image = QtGui.QImage(frame.data, frame.shape[1], frame.shape[0], QtGui.QImage.Format_RGB888).rgbSwapped()
-        # Render the image on the widget
+        # While paused, the same frame is rendered again whenever a slider moves: cache the intermediate results
+        frame_id = None if self.timer.isActive() or self.cur_index < 0 else (self.source_video_path, self.cur_index)
+        # Apply current filters with their values and size it to screen size, in the rendering thread
+        self.last_request = self.renderer.request(
+            self.cur_frame, self.chain, self.fast_preview_checkbox.isChecked(), frame_id)
+
+    def display_frame(self, image, request):
+        """
+        Called when the renderer has filtered a frame: shows it in the video widget
+        :param image: the filtered frame (QImage)
+        :param request: the number of the request, see PreviewRenderer.request()
+        """
         self.video_frame.setPixmap(QPixmap.fromImage(image))
+        self.displayed_request = request
+        if self.timer.isActive():
+            self.clock.frame_shown()
+
+    def skip_frame(self, request):
+        """
+        Called when the renderer could not filter a frame (the error is printed): the previous image stays on screen,
+        and playback goes on with the next frame
+        :param request: the number of the request, see PreviewRenderer.request()
+        """
+        self.displayed_request = request
 
     def play(self):
         """
         User clicked on play button, prepare the video decoding and start the timer to show the frames
+        Plays from the current position of the timeline, or from the start once the end has been reached
         """
         # Set the media player to play the video
         if self.source_video_path is None:
             self.open_video()
         if self.source_video_path is None:
             return
-        self.cap = cv2.VideoCapture(self.source_video_path)
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        if self.seek_cap is None:
+            # The path was set without opening the video
+            self.set_source(self.source_video_path)
+        if self.prefetcher is not None and self.prefetcher.finished or self.cur_index >= self.timeline.maximum():
+            self.cur_index = -1
+        self.start_playback(self.cur_index + 1)
+
+    def start_playback(self, index):
+        """
+        Starts decoding the video from a frame and showing the frames
+        :param index: the index of the first frame to show
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+        self.prefetcher = FramePrefetcher(self.source_video_path, self.PREFETCH_DEPTH, self.profiler,
+                                          index, self.frame_index, self.frame_cache)
+        self.prefetcher.start()
+        self.fps = self.prefetcher.fps
+        self.clock = PlaybackClock(self.fps, index)
+        self.update_playback_label()
         self.timer.start(round(1000 / self.fps))
 
     def pause(self):
@@ -220,7 +657,13 @@ class VideoPlayer(QMainWindow):
             return
         if self.timer.isActive():
             self.timer.stop()
+            self.clock.pause()
+        elif self.prefetcher is None:
+            # The video was not played yet or a frame was shown with seek(): continue from the current frame
+            if self.seek_cap is not None:
+                self.start_playback(self.cur_index + 1)
         else:
+            self.clock.resume()
             self.timer.start(round(1000 / self.fps))
 
     def display_add_filter_dialog(self):
@@ -258,71 +701,78 @@ class VideoPlayer(QMainWindow):
             # Add window dialog accepted, add the filter to the currently selected filters
             # Get the actual filter that has been selected
             f = filter_list[filter_combo.currentIndex()]
-            # Create a new frame to be added to the filters list
-            filter_frame = QFrame()
-            filter_frame.setFrameStyle(QFrame.Sunken)
-            filter_frame.setFrameShape(QFrame.Box)
-
-            # Create a new entry in the selected_filters array with the selected filter information
-            with self.lock:
-                vs = {}
-                for param in f.get_config():
-                    vs[param.name] = param.default_val
-                selected_filter = SelectedFilter(f, filter_frame, len(self.selected_filters), vs)
-                self.selected_filters.append(selected_filter)
-
-            # The overall layout of the frame itself
-            filter_layout = QVBoxLayout()
-            # The top part containing the filter name and possibly several buttons - only one for now
-            top_layout = QHBoxLayout()
-            filter_label = QLabel(f.get_filter_name())
-            top_layout.addWidget(filter_label)
-            # Delete button for this filter
-            delete_button = QPushButton("X")
-            # Associate the delete button to the selected filter so that we can retrieve it later
-            delete_button.selected_filter = selected_filter
-            top_layout.addWidget(delete_button)
-            delete_button.clicked.connect(self.delete_filter)
-            top_layout.addStretch(1)
-            filter_layout.addLayout(top_layout)
-            # Now create a slider fer every parameter
-            for param in f.get_config():
-                # Every parameter actually has a whole layout to get its name and slider displayed horizontally
-                filter_param_layout = QHBoxLayout()
-                filter_param_label = QLabel(param.name)
-                filter_param_layout.addWidget(filter_param_label)
-                filter_param_slider = QSlider(Qt.Horizontal)
-                # Save the SelectedFilter for future reference - especially the position in the list
-                filter_param_slider.selected_filter = selected_filter
-                # Save the slider's parameter name
-                # TODO make sure that all parameters for every single filter have different names
-                filter_param_slider.param_name = param.name
-                # Set the slider's range depending on the parameter's min and max values - scaled to SLIDER_FACTOR
-                filter_param_slider.setRange(
-                    round(param.min_val * self.SLIDER_FACTOR),
-                    round(param.max_val * self.SLIDER_FACTOR))
-                # Set the slider value to the default
-                filter_param_slider.setValue(round(param.default_val * self.SLIDER_FACTOR))
-                filter_param_slider.valueChanged[int].connect(self.slider_changed)
-                filter_param_layout.addWidget(filter_param_slider)
-                filter_layout.addLayout(filter_param_layout)
-            filter_frame.setLayout(filter_layout)
-            # Insert the widget at the correct position in the list of widgets
-            self.filters_list_layout.insertWidget(selected_filter.index, filter_frame)
+            # Add the filter with its default values to the chain, and show it
+            self.chain, entry = self.chain.add(f)
+            self.add_filter_widget(entry)
             # Make sure to refresh the video frame with the current filter if it is not currently running
             if not self.timer.isActive():
                 self.show_curframe()
 
+    def add_filter_widget(self, entry):
+        """
+        Adds a filter of the chain to the filters list, with a slider for each of its parameters
+        :param entry: the ChainEntry of the filter
+        """
+        f = entry.filter
+        # Create a new frame to be added to the filters list
+        filter_frame = QFrame()
+        filter_frame.setFrameStyle(QFrame.Sunken)
+        filter_frame.setFrameShape(QFrame.Box)
+
+        # Shows the time spent in the filter, see update_timings()
+        timing_label = QLabel("-")
+        # Add the filter to the selected_filters array
+        selected_filter = SelectedFilter(f, filter_frame, entry.uid, timing_label)
+        self.selected_filters.append(selected_filter)
+
+        # The overall layout of the frame itself
+        filter_layout = QVBoxLayout()
+        # The top part containing the filter name and possibly several buttons - only one for now
+        top_layout = QHBoxLayout()
+        filter_label = QLabel(f.get_filter_name())
+        top_layout.addWidget(filter_label)
+        # Delete button for this filter
+        delete_button = QPushButton("X")
+        # Associate the delete button to the selected filter so that we can retrieve it later
+        delete_button.selected_filter = selected_filter
+        top_layout.addWidget(delete_button)
+        delete_button.clicked.connect(self.delete_filter)
+        top_layout.addStretch(1)
+        filter_layout.addLayout(top_layout)
+        filter_layout.addWidget(timing_label)
+        # Now create a slider fer every parameter
+        for param in f.get_config():
+            # Every parameter actually has a whole layout to get its name and slider displayed horizontally
+            filter_param_layout = QHBoxLayout()
+            filter_param_label = QLabel(param.name)
+            filter_param_layout.addWidget(filter_param_label)
+            filter_param_slider = QSlider(Qt.Horizontal)
+            # Save the SelectedFilter for future reference - especially its uid in the chain
+            filter_param_slider.selected_filter = selected_filter
+            # Save the slider's parameter name
+            # TODO make sure that all parameters for every single filter have different names
+            filter_param_slider.param_name = param.name
+            # Set the slider's range depending on the parameter's min and max values - scaled to SLIDER_FACTOR
+            filter_param_slider.setRange(
+                round(param.min_val * self.SLIDER_FACTOR),
+                round(param.max_val * self.SLIDER_FACTOR))
+            # Set the slider value to the filter's current value
+            filter_param_slider.setValue(round(entry.vals[param.name] * self.SLIDER_FACTOR))
+            filter_param_slider.valueChanged[int].connect(self.slider_changed)
+            filter_param_layout.addWidget(filter_param_slider)
+            filter_layout.addLayout(filter_param_layout)
+        filter_frame.setLayout(filter_layout)
+        # Insert the widget at the correct position in the list of widgets
+        self.filters_list_layout.insertWidget(len(self.selected_filters) - 1, filter_frame)
+
     def slider_changed(self, val):
         """
         Called when a slider's value is changed by the user
         :param val: the new value
         """
         slider = self.sender()
-        # Make sure we are not modifying values while they are being read to show the video frames
-        with self.lock:
-            # Update the value for the corresponding filter + param name
-            self.selected_filters[slider.selected_filter.index].vals[slider.param_name] = val / self.SLIDER_FACTOR
+        # Publish a new snapshot with the value for the corresponding filter + param name
+        self.chain = self.chain.with_value(slider.selected_filter.uid, slider.param_name, val / self.SLIDER_FACTOR)
         # Refresh the current frame if the video is not running
         if not self.timer.isActive():
             self.show_curframe()
@@ -333,21 +783,18 @@ class VideoPlayer(QMainWindow):
         Destroys the corresponding filter both in the UI and in self.selected_filters
         """
         selected_filter = self.sender().selected_filter
-        idx = selected_filter.index
-        with self.lock:
-            self.selected_filters.__delitem__(idx)
-            # Delete the widget from the layout so that it will never be shown again
-            selected_filter.widget.setParent(None)
-            # Decrement the index of all selected filters after this one
-            for i in range(idx, len(self.selected_filters)):
-                self.selected_filters[i].index -= 1
+        self.chain = self.chain.remove(selected_filter.uid)
+        self.selected_filters.remove(selected_filter)
+        # Delete the widget from the layout so that it will never be shown again
+        selected_filter.widget.setParent(None)
         # Refresh the current frame if the video is not running
         if not self.timer.isActive():
             self.show_curframe()
 
 
-# Instantiate the frame and launch the app
-app = QApplication(sys.argv)
-player = VideoPlayer()
-player.show()
-sys.exit(app.exec_())
+if __name__ == "__main__":
+    # Instantiate the frame and launch the app
+    app = QApplication(sys.argv)
+    player = VideoPlayer()
+    player.show()
+    sys.exit(app.exec_())
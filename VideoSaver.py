@@ -1,7 +1,10 @@
 import traceback
-import cv2
 from PyQt5 import QtCore
 
+from profiler import Profiler, format_summary
+from render_pipeline import ProgressPrinter
+from video_export import render_video
+
 
 class VideoSaver(QtCore.QObject):
     """
@@ -10,47 +13,58 @@ class VideoSaver(QtCore.QObject):
     finished = QtCore.pyqtSignal()
     progress = QtCore.pyqtSignal(int)
 
-    def __init__(self, source_filename, target_filename, fs, vals):
+    def __init__(self, source_filename, target_filename, chain, workers=1, queue_size=32, segments=1,
+                 trace_filename=None, start_frame=0, end_frame=None, encoder=None, batch_size=1):
+        """
+        :param source_filename: path of the source video
+        :param target_filename: path of the video to write
+        :param chain: the filters to apply with their parameters (FilterChain)
+        :param workers: number of processes applying the filters, 1 filters frames in this thread
+        :param queue_size: maximum number of decoded frames waiting to be filtered when using several workers
+        :param segments: when more than 1, the video is split into this number of frame ranges rendered by
+                         separate processes (workers at a time) and joined at the end - see segment_export.py
+        :param trace_filename: if set, the time spent in every stage (decoding, filters, encoding) is recorded and
+                               written into this JSON or CSV file at the end of the export (see Profiler.export())
+        :param start_frame: index of the first frame to save
+        :param end_frame: index of the frame after the last one to save, None to save until the end of the video
+        :param encoder: the EncoderConfig to use (see encoders.py), None for OpenCV's MJPG writer
+        :param batch_size: number of consecutive frames filtered together, see video_export.render_video()
+        """
         super().__init__()
         self.source_filename = source_filename
         self.target_filename = target_filename
-        self.fs = fs
-        self.vals = vals
+        self.chain = chain
+        self.workers = workers
+        self.queue_size = queue_size
+        self.segments = segments
+        self.trace_filename = trace_filename
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.encoder = encoder
+        self.batch_size = batch_size
 
     @QtCore.pyqtSlot()
     def run(self):
         print("Saving video...")
         try:
-            # Prepare the reader for the source file
-            cap = cv2.VideoCapture(self.source_filename)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            # Prepare the writer for the target file
-            out = cv2.VideoWriter(
-                self.target_filename,
-                cv2.VideoWriter_fourcc(*"MJPG"), # cv2.VideoWriter_fourcc(*"H264"), # cv2.VideoWriter_fourcc(*"avc1"),
-                fps,
-                (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
-            # Write every frame while applying the filters
-            i = 0
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if ret:
-                    for i in range(len(self.fs)):
-                        frame = self.fs[i].apply_filter(frame, self.vals[i])
-                    out.write(frame)
-                else:
-                    break
-                self.progress.emit(i)
-                i += 1
-                if i % int(fps * 10) == 0:
-                    print(str(round(i // fps)) + " seconds saved")
+            printer = ProgressPrinter(self.source_filename, None,
+                                      None if self.end_frame is None else self.end_frame - self.start_frame)
+
+            def progress(frame_count):
+                printer(frame_count)
+                self.progress.emit(frame_count)
 
-            # Finish the reading / writing
-            cap.release()
-            out.release()
+            profiler = None if self.trace_filename is None else Profiler(keep_trace=True)
+            render_video(self.source_filename, self.target_filename, self.chain,
+                         self.workers, self.queue_size, self.segments, progress, profiler,
+                         self.start_frame, self.end_frame, self.encoder, self.batch_size)
             print("Saving ended successfully")
+            if profiler is not None:
+                for name, summary in profiler.summary().items():
+                    print(name + ": " + format_summary(summary))
+                profiler.export(self.trace_filename)
+                print("Trace written to " + self.trace_filename)
         except:
             # Let's make sure we get some trace if anything goes wrong in this thread
             traceback.print_exc()
         self.finished.emit()
-
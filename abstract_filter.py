@@ -1,7 +1,95 @@
+import numpy as np
+
+from frame_format import BGR, GRAY
+
+# Key added to the parameters by Filter.scale_params() with the (smallest) ratio between the size of the frames
+# that are filtered and the size of the original video, for filters that use hardcoded sizes in pixels
+RESOLUTION_SCALE = "_resolution_scale"
+
+
 class Filter:
     """
     A template class representing an image filter
+
+    The static methods describe the filter. To filter frames, the pipeline creates an instance of the filter
+    for each stream of frames (one per preview, per export or per filtering process), which goes through:
+    - creation: the expensive setup that does not depend on the parameters (e.g. loading a classifier),
+    - configure(params): before the first frame and whenever the parameters change,
+    - process(frame): for every frame, in order,
+    - close(): when the instance is not needed anymore.
+    An instance is only ever used by a single thread, except by tile-safe filters (see get_halo()).
+    Simple filters only implement the static apply_filter(), which the default process() calls.
+    When saving, the pipeline may also give blocks of consecutive frames to process_batch() (see apply_batch()).
+
+    Frames are either BGR (height x width x 3) or GRAY (height x width), see frame_format.py. The pipeline only
+    gives a filter frames in one of its formats, converting them when needed.
     """
+    # The formats of the frames that process() accepts, the first one is the format into which the pipeline converts
+    # frames in other formats - filters that only handle color frames keep the default
+    formats = (BGR,)
+    # The format of the frames returned by process(), None for the format of the frame it received
+    output_format = None
+    # True for filters that are exactly a conversion into grayscale (cv2.COLOR_BGR2GRAY) with a GRAY output_format:
+    # they can be merged with point-wise filters, see get_lut()
+    to_gray = False
+    # True for filters whose apply_filter() accepts an out parameter: an image with the shape of the result (the shape
+    # of the frame in the output format) in which the result must be written. Those filters must never modify the frame.
+    supports_out = False
+    # True for filters whose instances keep a state from one frame to the next, e.g. to track objects between
+    # detections: they must see all frames in order - unless is_stateful() says otherwise for their parameters
+    stateful = False
+    # True for filters that implement apply_batch() on a whole block of frames at once (e.g. vectorized with numpy),
+    # process_batch() calls it instead of filtering the frames one by one
+    supports_batch = False
+
+    def __init__(self):
+        # The current parameters, see configure()
+        self.params = None
+
+    def configure(self, params):
+        """
+        Sets the parameters used by process() - override to prepare anything that depends on them
+        :param params: dictionary of parameters in the form [name => value]
+        """
+        self.params = params
+
+    def process(self, frame, out=None):
+        """
+        Applies the filter with the current parameters to the next frame of the stream
+        :param frame: an image
+        :param out: see apply_filter()
+        :return: the filtered image/frame (out if it was given)
+        """
+        if out is None:
+            return self.apply_filter(frame, self.params)
+        return self.apply_filter(frame, self.params, out)
+
+    def process_batch(self, frames, out=None):
+        """
+        Applies the filter with the current parameters to the next frames of the stream
+        :param frames: consecutive frames, see apply_batch()
+        :param out: see apply_batch()
+        :return: the filtered frames as a single array (out if it was given)
+        """
+        if self.supports_batch:
+            if out is None:
+                return self.apply_batch(frames, self.params)
+            return self.apply_batch(frames, self.params, out)
+        # One by one, in order, as stateful filters need
+        return _apply_each(self.process, frames, out)
+
+    def close(self):
+        """
+        Releases whatever the instance holds
+        """
+        pass
+
+    @classmethod
+    def load(cls):
+        """
+        :return: the class of the filter - the same method as filter_loader.LazyFilter, which imports its module then
+        """
+        return cls
 
     @staticmethod
     def get_filter_name():
@@ -11,15 +99,31 @@ class Filter:
         pass
 
     @staticmethod
-    def apply_filter(frame, params):
+    def apply_filter(frame, params, out=None):
         """
         This function applies the current filter to the frame and returns the filtered frame
         :param frame: an image
         :param params: dictionary of parameters in the form [name => value]
-        :return: the filtered image/frame
+        :param out: only for filters with supports_out, an optional pre-allocated image (with the shape of the result)
+                    in which the result is written, to avoid allocating a new image for every frame
+        :return: the filtered image/frame (out if it was given)
         """
         pass
 
+    @classmethod
+    def apply_batch(cls, frames, params, out=None):
+        """
+        Applies the filter to a block of frames at once - filters with supports_batch override it with a static method
+        processing the whole block in a few calls, the default applies apply_filter() to each frame
+        :param frames: the frames as a single contiguous array, N x height x width x 3 for BGR frames
+                       or N x height x width for GRAY ones
+        :param params: dictionary of parameters in the form [name => value]
+        :param out: only for filters with supports_out, an optional pre-allocated array (with the shape of the result)
+                    in which the results are written
+        :return: the filtered frames as a single array (out if it was given)
+        """
+        return _apply_each(lambda frame, dst=None: cls.apply_filter(frame, params, dst), frames, out)
+
     @staticmethod
     def get_config():
         """
@@ -28,20 +132,98 @@ class Filter:
         """
         pass
 
+    @staticmethod
+    def get_lut(params):
+        """
+        Point-wise filters, whose output value only depends on the input value of the same pixel and channel,
+        return the equivalent lookup table: consecutive point-wise filters are then merged into a single
+        cv2.LUT() pass by the pipeline, and the table is only rebuilt when the parameters change
+        :param params: dictionary of parameters in the form [name => value]
+        :return: a numpy uint8 array of 256 entries (the same for all channels) or 256x3 (one column per channel),
+                 None if the filter is not point-wise - only tables that are the same for all channels are
+                 applied to GRAY frames
+        """
+        return None
+
+    @classmethod
+    def is_stateful(cls, params):
+        """
+        Stateful filters override it when some parameters do not carry anything from one frame to the next, e.g. a
+        detection run on every frame: the frames can then be filtered out of order, by several processes or segments
+        :param params: dictionary of parameters in the form [name => value]
+        :return: True if the instances must see all frames in order with these parameters
+        """
+        return cls.stateful
+
+    @staticmethod
+    def get_halo(params):
+        """
+        Filters that can be applied to horizontal strips of a frame in parallel (see TilePool) return the number
+        of rows above and below a strip that are needed to compute it exactly, e.g. half the height of a blur kernel:
+        the output pixels must only depend on the input pixels within that distance, the output must have the size
+        of the input, and process() must be callable from several threads at once on the same instance.
+        :param params: dictionary of parameters in the form [name => value]
+        :return: the number of rows (0 for point-wise filters), None if the filter must see the whole frame
+        """
+        return None
+
+    @classmethod
+    def scale_params(cls, params, scale_x, scale_y):
+        """
+        Adapts the parameters to frames that have been resized compared to the original video,
+        so that filtering a resized frame looks like resizing the filtered original frame.
+        By default, parameters are scaled according to their scale_axis.
+        :param params: dictionary of parameters in the form [name => value]
+        :param scale_x: horizontal ratio between the size of the resized frame and the original one
+        :param scale_y: vertical ratio between the size of the resized frame and the original one
+        :return: a new dictionary of parameters
+        """
+        scaled = dict(params)
+        for param in cls.get_config():
+            if param.scale_axis == "x":
+                scaled[param.name] = params[param.name] * scale_x
+            elif param.scale_axis == "y":
+                scaled[param.name] = params[param.name] * scale_y
+            elif param.scale_axis == "xy":
+                scaled[param.name] = params[param.name] * min(scale_x, scale_y)
+        scaled[RESOLUTION_SCALE] = min(scale_x, scale_y)
+        return scaled
+
+
+def _apply_each(apply, frames, out=None):
+    """
+    Applies a single frame function to each frame of a block
+    :param apply: called with a frame, and with the frame's slice of out when out is given
+    :return: the results as a single array (out if it was given)
+    """
+    if out is not None:
+        for i, frame in enumerate(frames):
+            apply(frame, out[i])
+        return out
+    for i, frame in enumerate(frames):
+        result = apply(frame)
+        if out is None:
+            out = np.empty((len(frames),) + result.shape, result.dtype)
+        out[i] = result
+    return out
+
 
 class FilterParameter:
     """
     A class representing a parameter used for a filter
     """
-    def __init__(self, name, min_val, max_val, default_val):
+    def __init__(self, name, min_val, max_val, default_val, scale_axis=None):
         """
         Initialize the parameter
         :param name: name of the parameter
         :param min_val: minimum value (float)
         :param max_val: maximum value (float)
         :param default_val: default value (float)
+        :param scale_axis: for sizes in pixels, the axis along which the value scales with the frame size:
+                           "x" (horizontal), "y" (vertical), "xy" (both), None if it does not depend on the size
         """
         self.name = name
         self.min_val = min_val
         self.max_val = max_val
         self.default_val = default_val
+        self.scale_axis = scale_axis
@@ -0,0 +1,266 @@
+import struct
+
+# Maximum size of each RIFF chunk of the joined file, OpenDML files are split into several RIFF chunks of about 1GB
+MAX_RIFF_SIZE = 1 << 30
+# Number of RIFF chunks that the super index can reference (each one is about MAX_RIFF_SIZE bytes)
+MAX_RIFF_CHUNKS = 1024
+
+AVIF_HASINDEX = 0x10
+AVIF_ISINTERLEAVED = 0x100
+AVIIF_KEYFRAME = 0x10
+AVI_INDEX_OF_INDEXES = 0x00
+AVI_INDEX_OF_CHUNKS = 0x01
+
+
+class AviInfo:
+    """
+    The information read from an AVI file that is needed to join it with others
+
+    Attributes
+    ----------
+    micro_sec_per_frame : int
+    width : int
+    height : int
+    handler : bytes
+        the codec FourCC of the video stream
+    scale, rate : int
+        the frame rate of the video stream is rate / scale
+    strf : bytes
+        the raw stream format (BITMAPINFOHEADER) of the video stream
+    frames : list of (offset, size)
+        the position and size of the data of every frame in the file
+    """
+    def __init__(self):
+        self.micro_sec_per_frame = 0
+        self.width = 0
+        self.height = 0
+        self.handler = b"\0\0\0\0"
+        self.scale = 1
+        self.rate = 1
+        self.strf = b""
+        self.frames = []
+
+
+def _chunks(f, start, end):
+    """
+    Iterates over the chunks contained between the offsets start and end of the file
+    :return: tuples (fourcc, list_type or None, data offset, data size)
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        fourcc, size = struct.unpack("<4sI", header)
+        if fourcc in (b"RIFF", b"LIST"):
+            list_type = f.read(4)
+            yield fourcc, list_type, pos + 12, size - 4
+        else:
+            yield fourcc, None, pos + 8, size
+        # Chunks are word-aligned
+        pos += 8 + size + (size & 1)
+
+
+def _read_movi(f, start, end, info):
+    for fourcc, list_type, offset, size in _chunks(f, start, end):
+        if list_type == b"rec ":
+            _read_movi(f, offset, offset + size, info)
+        elif fourcc[:2] == b"00" and fourcc[2:] in (b"dc", b"db"):
+            info.frames.append((offset, size))
+
+
+def _read_hdrl(f, start, end, info):
+    for fourcc, list_type, offset, size in _chunks(f, start, end):
+        f.seek(offset)
+        if fourcc == b"avih":
+            avih = struct.unpack("<10I", f.read(40))
+            info.micro_sec_per_frame = avih[0]
+            info.width = avih[8]
+            info.height = avih[9]
+        elif list_type == b"strl" and not info.strf:
+            # Only the first stream is kept, our segments only contain video anyway
+            for sub_fourcc, _, sub_offset, sub_size in _chunks(f, offset, offset + size):
+                f.seek(sub_offset)
+                if sub_fourcc == b"strh":
+                    strh = struct.unpack("<4s4sIHHIII", f.read(28))
+                    info.handler = strh[1]
+                    info.scale = strh[6]
+                    info.rate = strh[7]
+                elif sub_fourcc == b"strf":
+                    info.strf = f.read(sub_size)
+
+
+def read_avi(filename):
+    """
+    Reads the headers of an AVI file and the position of every video frame (including OpenDML files)
+    :param filename: the path of the AVI file
+    :return: an AviInfo
+    """
+    info = AviInfo()
+    with open(filename, "rb") as f:
+        f.seek(0, 2)
+        file_size = f.tell()
+        for fourcc, list_type, offset, size in _chunks(f, 0, file_size):
+            if fourcc != b"RIFF" or list_type not in (b"AVI ", b"AVIX"):
+                raise ValueError(filename + " is not an AVI file")
+            for sub_fourcc, sub_type, sub_offset, sub_size in _chunks(f, offset, min(offset + size, file_size)):
+                if sub_type == b"hdrl":
+                    _read_hdrl(f, sub_offset, sub_offset + sub_size, info)
+                elif sub_type == b"movi":
+                    _read_movi(f, sub_offset, min(sub_offset + sub_size, file_size), info)
+    if not info.strf:
+        raise ValueError(filename + " does not contain a video stream")
+    return info
+
+
+class _RiffChunk:
+    """
+    Book-keeping for one RIFF chunk of the file being written
+    """
+    def __init__(self, start, movi_start):
+        self.start = start
+        self.movi_start = movi_start
+        # (offset of the frame data, size) for every frame in this RIFF chunk
+        self.frames = []
+        self.index_offset = 0
+        self.index_size = 0
+
+
+def _write_chunk_header(f, fourcc, size, list_type=None):
+    if list_type is None:
+        f.write(struct.pack("<4sI", fourcc, size))
+    else:
+        f.write(struct.pack("<4sI4s", fourcc, size + 4, list_type))
+
+
+def _patch_size(f, pos, end):
+    """
+    Sets the size of the chunk starting at pos so that it ends at end
+    """
+    f.seek(pos + 4)
+    f.write(struct.pack("<I", end - pos - 8))
+    f.seek(end)
+
+
+def join_avi(filenames, target_filename, max_riff_size=MAX_RIFF_SIZE):
+    """
+    Joins several AVI files into a single one without re-encoding anything: frames are copied as they are.
+    All files must have the same video format - this is meant for segments produced by the same writer,
+    with intra-frame codecs such as MJPG since every frame is marked as a key frame.
+    The result is an OpenDML (AVI 2.0) file so that it is not limited to 4GB.
+    :param filenames: the paths of the AVI files to join, in order
+    :param target_filename: the path of the joined AVI file
+    :param max_riff_size: the maximum size of each RIFF chunk of the result
+    :return: the number of frames in the joined file
+    """
+    infos = [read_avi(filename) for filename in filenames]
+    if not infos:
+        raise ValueError("No file to join")
+    first = infos[0]
+    for filename, info in zip(filenames, infos):
+        if (info.width, info.height, info.handler, info.scale, info.rate) != \
+                (first.width, first.height, first.handler, first.scale, first.rate):
+            raise ValueError(filename + " does not have the same video format as " + filenames[0])
+    total_frames = sum(len(info.frames) for info in infos)
+    max_frame_size = max([size for info in infos for _, size in info.frames], default=0)
+
+    with open(target_filename, "wb") as out:
+        # The headers are written first with placeholders, they are patched once all frames are written
+        _write_chunk_header(out, b"RIFF", 0, b"AVI ")
+        hdrl_pos = out.tell()
+        _write_chunk_header(out, b"LIST", 0, b"hdrl")
+        avih_pos = out.tell()
+        out.write(b"\0" * (8 + 56))
+        strl_pos = out.tell()
+        _write_chunk_header(out, b"LIST", 0, b"strl")
+        strh_pos = out.tell()
+        out.write(b"\0" * (8 + 56))
+        _write_chunk_header(out, b"strf", len(first.strf))
+        out.write(first.strf)
+        if len(first.strf) & 1:
+            out.write(b"\0")
+        indx_pos = out.tell()
+        out.write(b"\0" * (8 + 24 + 16 * MAX_RIFF_CHUNKS))
+        _patch_size(out, strl_pos, out.tell())
+        odml_pos = out.tell()
+        _write_chunk_header(out, b"LIST", 0, b"odml")
+        _write_chunk_header(out, b"dmlh", 248)
+        dmlh_pos = out.tell()
+        out.write(b"\0" * 248)
+        _patch_size(out, hdrl_pos, out.tell())
+        _patch_size(out, odml_pos, out.tell())
+
+        riffs = []
+
+        def start_movi(riff_start):
+            movi_pos = out.tell()
+            _write_chunk_header(out, b"LIST", 0, b"movi")
+            riffs.append(_RiffChunk(riff_start, movi_pos))
+
+        def end_movi():
+            riff = riffs[-1]
+            # Standard index of the chunks of this RIFF chunk, referenced by the super index
+            riff.index_offset = out.tell()
+            base = riff.movi_start
+            entries = b"".join(struct.pack("<II", offset - base, size) for offset, size in riff.frames)
+            _write_chunk_header(out, b"ix00", 24 + len(entries))
+            out.write(struct.pack("<HBBI4sQI", 2, 0, AVI_INDEX_OF_CHUNKS, len(riff.frames), b"00dc", base, 0))
+            out.write(entries)
+            riff.index_size = out.tell() - riff.index_offset
+            _patch_size(out, riff.movi_start, out.tell())
+
+        start_movi(0)
+        for filename, info in zip(filenames, infos):
+            with open(filename, "rb") as f:
+                for offset, size in info.frames:
+                    # Start a new RIFF AVIX chunk when the current one becomes too large
+                    if out.tell() - riffs[-1].start + size + 8 + 8 * (len(riffs[-1].frames) + 1) + 32 > max_riff_size \
+                            and riffs[-1].frames:
+                        end_movi()
+                        if len(riffs) == 1:
+                            _write_idx1(out, riffs[0])
+                        _patch_size(out, riffs[-1].start, out.tell())
+                        if len(riffs) >= MAX_RIFF_CHUNKS:
+                            raise ValueError("The joined file is too large")
+                        riff_start = out.tell()
+                        _write_chunk_header(out, b"RIFF", 0, b"AVIX")
+                        start_movi(riff_start)
+                    f.seek(offset)
+                    _write_chunk_header(out, b"00dc", size)
+                    riffs[-1].frames.append((out.tell(), size))
+                    out.write(f.read(size))
+                    if size & 1:
+                        out.write(b"\0")
+        end_movi()
+        if len(riffs) == 1:
+            _write_idx1(out, riffs[0])
+        _patch_size(out, riffs[-1].start, out.tell())
+
+        # Now that everything is known, write the headers
+        out.seek(avih_pos)
+        _write_chunk_header(out, b"avih", 56)
+        out.write(struct.pack("<10I16s", first.micro_sec_per_frame, 0, 0, AVIF_HASINDEX | AVIF_ISINTERLEAVED,
+                              len(riffs[0].frames), 0, 1, max_frame_size, first.width, first.height, b"\0" * 16))
+        out.seek(strh_pos)
+        _write_chunk_header(out, b"strh", 56)
+        out.write(struct.pack("<4s4sIHHIIIIIIIIhhhh", b"vids", first.handler, 0, 0, 0, 0, first.scale, first.rate,
+                              0, total_frames, max_frame_size, 0xFFFFFFFF, 0, 0, 0, first.width, first.height))
+        out.seek(indx_pos)
+        _write_chunk_header(out, b"indx", 24 + 16 * MAX_RIFF_CHUNKS)
+        out.write(struct.pack("<HBBI4s12s", 4, 0, AVI_INDEX_OF_INDEXES, len(riffs), b"00dc", b"\0" * 12))
+        for riff in riffs:
+            out.write(struct.pack("<QII", riff.index_offset, riff.index_size, len(riff.frames)))
+        out.seek(dmlh_pos)
+        out.write(struct.pack("<I", total_frames))
+    return total_frames
+
+
+def _write_idx1(out, riff):
+    """
+    Writes the legacy AVI 1.0 index of the frames of the first RIFF chunk
+    """
+    entries = b"".join(struct.pack("<4sIII", b"00dc", AVIIF_KEYFRAME, offset - 8 - riff.movi_start - 8, size)
+                       for offset, size in riff.frames)
+    _write_chunk_header(out, b"idx1", len(entries))
+    out.write(entries)
@@ -0,0 +1,468 @@
+"""
+Benchmark of the filters and of whole filter chains, without any display.
+
+Every filter is timed on its own on synthetic frames, and a few representative chains are timed end to end
+(decode -> filter -> encode) on short synthetic videos, at several resolutions:
+    python benchmark.py
+    python benchmark.py --resolutions 480p,1080p --frames 60
+
+Filters that can be applied in strips of the frame (see TilePool) are also timed in strips on several threads,
+as in the preview:
+    python benchmark.py --chains "" --transports "" --encoders "" --tile-threads 4
+
+The filters are also timed on blocks of frames (see Filter.process_batch()), as when saving:
+    python benchmark.py --chains "" --transports "" --encoders "" --batch-size 8
+
+The handoff of frames between the processes of a parallel export is also timed with an empty chain, frames going
+either through shared memory or pickled through the queues (see render_parallel()):
+    python benchmark.py --chains "" --filters "" --transports shm,pickle
+
+The encoder backends (see encoders.py) are timed on the frames of the synthetic videos, and the size of their output
+is reported too - backends that are not available (e.g. ffmpeg is not installed) are skipped:
+    python benchmark.py --chains "" --filters "" --transports "" --encoders opencv-mjpg,ffmpeg-x264
+
+Results are reported in frames per second and in MB/s of raw (decoded) frames. They can be saved as a baseline
+and later compared to it, e.g. before and after changing a filter:
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json
+Every timing is the fastest of several runs (--repeat for the filters, --rounds for whole videos) after untimed
+warm-up runs (--warmup), so that a single slow run does not look like a regression.
+The exit code is 1 if anything is slower than the baseline by more than the tolerance, 0 otherwise. With fewer runs
+than MIN_REPEAT, MIN_ROUNDS or MIN_FRAMES, the timings are too noisy: regressions are reported but the exit code is 0.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+from encoders import EncoderConfig
+from filter_chain import FilterChain
+from filter_loader import FilterLoader
+from pipeline import Pipeline, TilePool
+from render_pipeline import render_parallel, render_serial
+
+FILTERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "filters")
+# Name => (width, height)
+RESOLUTIONS = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+}
+# Representative chains timed end to end: name => filter names (see Filter.get_filter_name()),
+# chains using a missing filter are skipped
+CHAINS = {
+    "color": ["Luminosity", "Sharpen"],
+    "gray": ["Luminosity", "Grayscale", "Luminosity"],
+    "edges": ["Blur", "Edge Detection (Canny)"],
+    "gray-edges": ["Grayscale", "Edge Detection (Canny)", "Blur"],
+    "faces": ["Face Detection"],
+}
+# How frames are handed between processes in a parallel export: name => shared_frames argument of render_parallel()
+TRANSPORTS = {
+    "shm": True,
+    "pickle": False,
+}
+# Number of filtering processes when timing the handoff of frames
+HANDOFF_WORKERS = 2
+# Encoders timed on synthetic frames: name => (EncoderConfig description (see EncoderConfig.to_dict()), extension)
+ENCODERS = {
+    "opencv-mjpg": ({"backend": "opencv"}, ".avi"),
+    "ffmpeg-x264": ({"backend": "ffmpeg", "options": {"codec": "libx264"}}, ".mp4"),
+    "ffmpeg-x264-ultrafast": ({"backend": "ffmpeg", "options": {"codec": "libx264", "preset": "ultrafast"}}, ".mp4"),
+    "ffmpeg-x265": ({"backend": "ffmpeg", "options": {"codec": "libx265"}}, ".mp4"),
+}
+# A result is reported as a regression when it is slower than the baseline by more than this ratio
+TOLERANCE = 0.2
+# Fewest timed runs of each filter, rounds of each video and frames of the videos for which a comparison to the
+# baseline can fail the run: below that, two runs of the same code differ by more than the tolerance
+MIN_REPEAT = 10
+MIN_ROUNDS = 3
+MIN_FRAMES = 30
+# Shortest duration timed at once (in seconds), see best_time()
+MIN_SAMPLE_SECONDS = 0.01
+
+
+def synthetic_frame(width, height, index=0):
+    """
+    Generates a frame with some structure (gradients, shapes) and some noise, so that filters and encoders
+    have realistic work to do - always the same for the same arguments
+    :param index: the index of the frame in a synthetic video, the content moves with it
+    :return: a BGR uint8 image
+    """
+    rng = np.random.default_rng(index)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:, :, 0] = ((x[None, :] + 4 * index) % 256).astype(np.uint8)
+    frame[:, :, 1] = y[:, None].astype(np.uint8)
+    frame[:, :, 2] = ((x[None, :] + y[:, None]) / 2).astype(np.uint8)
+    for i in range(8):
+        center = ((width * (i + 1) // 9 + 5 * index) % width, height * (1 + i % 3) // 4)
+        cv2.circle(frame, center, height // 10, (40 * i % 256, 255 - 30 * i, 128), -1)
+    noise = rng.integers(0, 16, frame.shape, dtype=np.uint8)
+    return cv2.add(frame, noise)
+
+
+def synthetic_video(filename, width, height, frames, fps=25):
+    """
+    Writes a short synthetic video (MJPG in AVI, like the saved videos)
+    """
+    out = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    if not out.isOpened():
+        raise RuntimeError("Cannot write " + filename + ": the MJPG encoder is not available")
+    try:
+        for index in range(frames):
+            out.write(synthetic_frame(width, height, index))
+    finally:
+        out.release()
+
+
+def measure(frame_count, frame_bytes, seconds):
+    """
+    :return: {"fps", "mbps"} for frame_count frames of frame_bytes bytes processed in seconds
+    """
+    seconds = max(seconds, 1e-9)
+    return {"fps": frame_count / seconds, "mbps": frame_count * frame_bytes / seconds / 1e6}
+
+
+def best_time(run, repeat, warmup):
+    """
+    Times several calls of the same function. Calls shorter than MIN_SAMPLE_SECONDS are timed in groups of calls
+    lasting at least that long, like timeit does: the timer and the scheduler make shorter timings unreliable
+    :param run: the function to time, called without any argument
+    :param repeat: number of timed calls (or groups of calls)
+    :param warmup: number of untimed calls before them (caches, lazy allocations, thread pools...)
+    :return: the duration of a call in the fastest timed group in seconds (other processes and interrupts only ever
+             slow a call down, so that the fastest one is the most reproducible), and what the last call returned
+    """
+    result = None
+    calls = 1
+    for _ in range(warmup):
+        start = time.perf_counter()
+        result = run()
+        calls = max(1, math.ceil(MIN_SAMPLE_SECONDS / max(time.perf_counter() - start, 1e-9)))
+    durations = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        for _ in range(calls):
+            result = run()
+        durations.append((time.perf_counter() - start) / calls)
+    return min(durations), result
+
+
+def bench_filter(filter, frame, repeat, warmup=1):
+    """
+    Times a filter with its default parameters on a frame, like a pipeline would apply it
+    :param repeat: number of timed runs, after warmup untimed runs
+    :return: see measure(), from the fastest run
+    """
+    instance = filter()
+    instance.configure({param.name: param.default_val for param in filter.get_config()})
+    try:
+        seconds, _ = best_time(lambda: instance.process(frame), repeat, warmup)
+        return measure(1, frame.nbytes, seconds)
+    finally:
+        instance.close()
+
+
+def bench_tiled(filter, frame, repeat, tiles, warmup=1):
+    """
+    Times a filter with its default parameters on a frame split into strips (see TilePool)
+    :param repeat: number of timed runs, after warmup untimed runs
+    :param tiles: the TilePool applying the strips
+    :return: see measure(), from the fastest run
+    """
+    chain, _ = FilterChain().add(filter)
+    pipeline = Pipeline(chain, tiles=tiles)
+    try:
+        seconds, _ = best_time(lambda: pipeline.process(frame), repeat, warmup)
+        return measure(1, frame.nbytes, seconds)
+    finally:
+        pipeline.close()
+
+
+def bench_batch(filter, frame, repeat, batch_size, warmup=1):
+    """
+    Times a filter with its default parameters on blocks of copies of a frame (see Filter.process_batch()), writing
+    into the same block for every run when the filter supports it, like a pipeline
+    :param repeat: number of timed runs, after warmup untimed runs (at least one, which allocates the block)
+    :param batch_size: number of frames of each block
+    :return: see measure(), per frame, from the fastest run
+    """
+    instance = filter()
+    instance.configure({param.name: param.default_val for param in filter.get_config()})
+    frames = np.stack([frame] * batch_size)
+    try:
+        out = instance.process_batch(frames)
+        if not filter.supports_out:
+            out = None
+        seconds, _ = best_time(lambda: instance.process_batch(frames, out), repeat, max(0, warmup - 1))
+        return measure(batch_size, frame.nbytes, seconds)
+    finally:
+        instance.close()
+
+
+def bench_chain(chain, video_filename, target_filename, width, height, rounds=1, warmup=0):
+    """
+    Times the rendering of a video with a chain: decoding, filtering and encoding
+    :param rounds: number of timed renderings, after warmup untimed ones
+    :return: see measure(), from the fastest rendering
+    """
+    seconds, count = best_time(lambda: render_serial(video_filename, target_filename, chain), rounds, warmup)
+    return measure(count, width * height * 3, seconds)
+
+
+def bench_handoff(video_filename, target_filename, width, height, shared_frames, rounds=1, warmup=0):
+    """
+    Times a parallel export without any filter, which is mostly decoding, encoding and handing frames between processes
+    :param shared_frames: see render_parallel()
+    :param rounds: number of timed exports, after warmup untimed ones
+    :return: see measure(), from the fastest export
+    """
+    seconds, count = best_time(lambda: render_parallel(video_filename, target_filename, FilterChain(),
+                                                         HANDOFF_WORKERS, 8, shared_frames=shared_frames),
+                                 rounds, warmup)
+    return measure(count, width * height * 3, seconds)
+
+
+def bench_encoder(encoder, frames, target_filename, rounds=1, warmup=0):
+    """
+    Times the encoding of frames, without decoding nor filtering them
+    :param encoder: the EncoderConfig to time
+    :param frames: the frames to encode, all of the same size
+    :param rounds: number of timed encodings, after warmup untimed ones
+    :return: see measure(), from the fastest encoding, with the size of the encoded video in "bytes"
+    """
+    height, width = frames[0].shape[:2]
+
+    def encode():
+        out = encoder.open(target_filename, 25, (width, height))
+        try:
+            for frame in frames:
+                out.write(frame)
+        finally:
+            out.release()
+        return os.path.getsize(target_filename)
+
+    seconds, size = best_time(encode, rounds, warmup)
+    result = measure(len(frames), frames[0].nbytes, seconds)
+    result["bytes"] = size
+    os.remove(target_filename)
+    return result
+
+
+def run(all_filters, resolutions, frames, repeat, filter_names=None, chain_names=None, transport_names=None,
+        encoder_names=None, tile_threads=0, batch_size=1, warmup=1, rounds=1):
+    """
+    Runs the benchmarks, printing each result as soon as it is known
+    :param all_filters: the available filters {name => Filter}
+    :param resolutions: the names of the resolutions to use (see RESOLUTIONS)
+    :param frames: number of frames of the synthetic videos
+    :param repeat: number of timed runs of each filter
+    :param filter_names: the filters to time, None for all of them
+    :param chain_names: the chains to time (see CHAINS), None for all of them
+    :param transport_names: the handoffs to time (see TRANSPORTS), None for all of them
+    :param encoder_names: the encoders to time (see ENCODERS), None for all of them
+    :param tile_threads: the number of threads timing the filters in strips, 0 or 1 not to time them
+    :param batch_size: the number of frames of the blocks on which the filters are also timed, 1 not to time them
+    :param warmup: number of untimed runs of each filter before timing it, and of untimed renderings of each video
+                   (at most one, since a whole video is already a long run)
+    :param rounds: number of timed renderings of each video (chains, handoffs and encoders), the fastest one is reported
+    :return: {"filter/<name>/<resolution>", "tiled/<name>/<resolution>", "batch/<name>/<resolution>",
+             "chain/<name>/<resolution>",
+             "handoff/<name>/<resolution>" or "encoder/<name>/<resolution>" => {"fps", "mbps"},
+             and "bytes" for encoders}
+    """
+    results = {}
+    tiles = TilePool(tile_threads) if tile_threads > 1 else None
+    chains = {}
+    for name in CHAINS if chain_names is None else chain_names:
+        if all(f in all_filters for f in CHAINS[name]):
+            chain = FilterChain()
+            for f in CHAINS[name]:
+                chain, _ = chain.add(all_filters[f])
+            chains[name] = chain
+        else:
+            print("Skipping chain " + name + ": missing filters")
+    encoders = {}
+    for name in ENCODERS if encoder_names is None else encoder_names:
+        description, extension = ENCODERS[name]
+        encoder = EncoderConfig.from_dict(description)
+        if encoder.encoder.available():
+            encoders[name] = (encoder, extension)
+        else:
+            print("Skipping encoder " + name + ": " + encoder.backend + " is not available")
+    work_dir = tempfile.mkdtemp(prefix="video_filter_benchmark_")
+    try:
+        for resolution in resolutions:
+            width, height = RESOLUTIONS[resolution]
+            frame = synthetic_frame(width, height)
+            for name in all_filters if filter_names is None else filter_names:
+                key = "filter/" + name + "/" + resolution
+                results[key] = bench_filter(all_filters[name], frame, repeat, warmup)
+                report(key, results[key])
+                filter = all_filters[name]
+                defaults = {param.name: param.default_val for param in filter.get_config()}
+                if tiles is not None and not filter.is_stateful(defaults) and filter.get_halo(defaults) is not None:
+                    key = "tiled/" + name + "/" + resolution
+                    results[key] = bench_tiled(filter, frame, repeat, tiles, warmup)
+                    report(key, results[key])
+                if batch_size > 1:
+                    key = "batch/" + name + "/" + resolution
+                    results[key] = bench_batch(filter, frame, repeat, batch_size, warmup)
+                    report(key, results[key])
+            transports = TRANSPORTS if transport_names is None else transport_names
+            if not chains and not transports and not encoders:
+                continue
+            video_warmup = min(warmup, 1)
+            video_filename = os.path.join(work_dir, resolution + ".avi")
+            target_filename = os.path.join(work_dir, "out.avi")
+            synthetic_video(video_filename, width, height, frames)
+            for name, chain in chains.items():
+                key = "chain/" + name + "/" + resolution
+                results[key] = bench_chain(chain, video_filename, target_filename, width, height, rounds,
+                                           video_warmup)
+                report(key, results[key])
+            for name in transports:
+                key = "handoff/" + name + "/" + resolution
+                results[key] = bench_handoff(video_filename, target_filename, width, height, TRANSPORTS[name],
+                                             rounds, video_warmup)
+                report(key, results[key])
+            if encoders:
+                video_frames = [synthetic_frame(width, height, index) for index in range(frames)]
+                for name, (encoder, extension) in encoders.items():
+                    key = "encoder/" + name + "/" + resolution
+                    results[key] = bench_encoder(encoder, video_frames, os.path.join(work_dir, "out" + extension),
+                                                 rounds, video_warmup)
+                    report(key, results[key])
+    finally:
+        shutil.rmtree(work_dir)
+        if tiles is not None:
+            tiles.close()
+    return results
+
+
+def report(key, result, baseline=None):
+    """
+    Prints one result, compared to its baseline if there is one
+    """
+    line = "%-40s %9.1f fps %9.1f MB/s" % (key, result["fps"], result["mbps"])
+    if "bytes" in result:
+        line += " %9.1f MB written" % (result["bytes"] / 1e6)
+    if baseline is not None:
+        line += "   %+6.1f%% vs baseline" % (100 * (result["fps"] / baseline["fps"] - 1))
+    print(line, flush=True)
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Prints the results compared to a baseline
+    :param results: the results of run()
+    :param baseline: results of a previous run
+    :param tolerance: see TOLERANCE
+    :return: the keys of the results slower than the baseline by more than the tolerance
+    """
+    regressions = []
+    print("Compared to the baseline:")
+    for key, result in results.items():
+        if key not in baseline:
+            report(key, result)
+            continue
+        report(key, result, baseline[key])
+        if result["fps"] < baseline[key]["fps"] * (1 - tolerance):
+            regressions.append(key)
+    for key in regressions:
+        print("REGRESSION " + key)
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks the filters and some filter chains.")
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS),
+                        help="comma separated resolutions among " + ", ".join(RESOLUTIONS))
+    parser.add_argument("--frames", type=int, default=30, help="number of frames of the synthetic videos")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="number of timed runs of each filter, the fastest one is reported")
+    parser.add_argument("--warmup", type=int, default=3, help="number of untimed runs of each filter before timing it")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="number of timed renderings of each video (chains, handoffs, encoders), "
+                             "the fastest one is reported")
+    parser.add_argument("--filters", help="comma separated filters to time, all of them by default")
+    parser.add_argument("--chains", help="comma separated chains to time among " + ", ".join(CHAINS) +
+                                         ", all of them by default - empty for none")
+    parser.add_argument("--transports", help="comma separated handoffs between processes to time among " +
+                                             ", ".join(TRANSPORTS) + ", all of them by default - empty for none")
+    parser.add_argument("--encoders", help="comma separated encoders to time among " + ", ".join(ENCODERS) +
+                                           ", all of them by default - empty for none")
+    parser.add_argument("--tile-threads", type=int, default=os.cpu_count() or 1,
+                        help="number of threads timing the filters in strips, 1 not to time them "
+                             "(default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="number of frames of the blocks on which the filters are also timed, 1 not to time them")
+    parser.add_argument("--save", help="save the results into this JSON file, e.g. to use them as a baseline")
+    parser.add_argument("--baseline", help="compare the results to this JSON file saved with --save")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+    if args.repeat < 1 or args.rounds < 1 or args.warmup < 0:
+        parser.error("--repeat and --rounds must be at least 1, --warmup must not be negative")
+    args.resolutions = args.resolutions.split(",")
+    for resolution in args.resolutions:
+        if resolution not in RESOLUTIONS:
+            parser.error("unknown resolution: " + resolution)
+    if args.chains is not None:
+        args.chains = [name for name in args.chains.split(",") if name]
+        for name in args.chains:
+            if name not in CHAINS:
+                parser.error("unknown chain: " + name)
+    if args.transports is not None:
+        args.transports = [name for name in args.transports.split(",") if name]
+        for name in args.transports:
+            if name not in TRANSPORTS:
+                parser.error("unknown transport: " + name)
+    if args.encoders is not None:
+        args.encoders = [name for name in args.encoders.split(",") if name]
+        for name in args.encoders:
+            if name not in ENCODERS:
+                parser.error("unknown encoder: " + name)
+    if args.filters is not None:
+        args.filters = [name for name in args.filters.split(",") if name]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    all_filters = FilterLoader.load_filters([FILTERS_DIR])
+    for name in args.filters or []:
+        if name not in all_filters:
+            print("Unknown filter: " + name, file=sys.stderr)
+            return 2
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run(all_filters, args.resolutions, args.frames, args.repeat, args.filters, args.chains,
+                  args.transports, args.encoders, args.tile_threads, args.batch_size, args.warmup, args.rounds)
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if baseline is not None and compare(results, baseline, args.tolerance):
+        if args.repeat < MIN_REPEAT or args.rounds < MIN_ROUNDS or args.frames < MIN_FRAMES:
+            print("Not failing: at least --repeat %d, --rounds %d and --frames %d are needed to tell a regression "
+                  "from noise" % (MIN_REPEAT, MIN_ROUNDS, MIN_FRAMES))
+            return 0
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
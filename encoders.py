@@ -0,0 +1,340 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import cv2
+import numpy as np
+
+from avi_stitch import join_avi
+from frame_format import to_bgr
+
+
+class EncoderOption:
+    """
+    An option of an encoder backend: either one value among choices, or an int within a range
+
+    Attributes
+    ----------
+    name : str
+        the name of the option, as written in chain files
+    default : str or int
+        the value used when the option is not set
+    choices : [str] or None
+        the possible values, None for an int option
+    min_val, max_val : int
+        the range of an int option
+    description : str
+        a short explanation shown to the user
+    """
+    def __init__(self, name, default, choices=None, min_val=None, max_val=None, description=""):
+        self.name = name
+        self.default = default
+        self.choices = choices
+        self.min_val = min_val
+        self.max_val = max_val
+        self.description = description
+
+    def validate(self, value):
+        """
+        :return: the value if it is valid for this option
+        :raise ValueError: if it is not
+        """
+        if self.choices is not None:
+            if value not in self.choices:
+                raise ValueError("Invalid value for " + self.name + ": " + str(value) +
+                                 " (expected one of " + ", ".join(self.choices) + ")")
+        elif isinstance(value, bool) or not isinstance(value, int) or not self.min_val <= value <= self.max_val:
+            raise ValueError("Invalid value for " + self.name + ": " + str(value) +
+                             " (expected an integer from " + str(self.min_val) + " to " + str(self.max_val) + ")")
+        return value
+
+
+class OpenCVEncoder:
+    """
+    Encodes with cv2.VideoWriter, by default into MJPG: fast but large files
+    Segments are written as AVI files: MJPG ones are joined directly (see avi_stitch.py), the other codecs have
+    frames depending on the previous ones and are joined by ffmpeg
+    """
+    name = "opencv"
+    options = [
+        EncoderOption("codec", "MJPG", choices=["MJPG", "XVID", "mp4v"], description="FourCC of the codec"),
+        # With the default of OpenCV, the compression adapts to the first frames of every file: the first frames of
+        # a segment may not be encoded exactly like the same frames in the middle of a video
+        EncoderOption("quality", 0, min_val=0, max_val=100,
+                      description="MJPG quality from 1 to 100, 0 for the default of OpenCV"),
+    ]
+
+    @staticmethod
+    def available():
+        return True
+
+    @staticmethod
+    def extension(target_filename):
+        """
+        :return: the extension of the segments of a video saved in segments
+        """
+        return ".avi"
+
+    @staticmethod
+    def can_join(options):
+        """
+        :return: whether videos written with these options can be joined, i.e. saved in segments
+        """
+        return options["codec"] == "MJPG" or FFmpegEncoder.available()
+
+    def __init__(self, target_filename, fps, size, options):
+        """
+        :param target_filename: path of the video to write
+        :param fps: frame rate
+        :param size: (width, height) of the frames
+        :param options: the values of all the options {name => value}
+        """
+        fourcc = cv2.VideoWriter_fourcc(*options["codec"])
+        if options["quality"] > 0 and options["codec"] == "MJPG":
+            # Only OpenCV's own MJPG encoder has a quality setting
+            self.writer = cv2.VideoWriter(target_filename, cv2.CAP_OPENCV_MJPEG, fourcc, fps, size)
+            self.writer.set(cv2.VIDEOWRITER_PROP_QUALITY, options["quality"])
+        else:
+            self.writer = cv2.VideoWriter(target_filename, fourcc, fps, size)
+
+    def isOpened(self):
+        return self.writer.isOpened()
+
+    def write(self, frame):
+        # Writers are opened for color frames
+        self.writer.write(to_bgr(frame))
+
+    def release(self):
+        self.writer.release()
+
+    @staticmethod
+    def join(segment_filenames, target_filename, options):
+        """
+        Joins videos written by this backend with the same options, without re-encoding them
+        :return: the number of frames of the joined video
+        """
+        if options["codec"] != "MJPG":
+            # join_avi marks every frame as a key frame, which is only true for intra-frame codecs
+            return FFmpegEncoder.join(segment_filenames, target_filename, options)
+        return join_avi(segment_filenames, target_filename)
+
+
+class FFmpegEncoder:
+    """
+    Streams the raw frames through a pipe to an ffmpeg process, which encodes them with compact codecs
+    (H.264, H.265, VP9...) into the container given by the extension of the target (.mp4, .mkv...)
+    Writing blocks while ffmpeg is busy, so that frames never pile up in memory
+    """
+    name = "ffmpeg"
+    # The ffmpeg binary, looked up in the PATH if it is not a path - can be set with the FFMPEG_BINARY variable
+    binary = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+    options = [
+        EncoderOption("codec", "libx264", choices=["libx264", "libx265", "libvpx-vp9", "mpeg4", "mjpeg"],
+                      description="ffmpeg video encoder"),
+        EncoderOption("quality", 23, min_val=0, max_val=51,
+                      description="constant rate factor: lower is better and larger, 23 is the default of H.264"),
+        EncoderOption("preset", "medium",
+                      choices=["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower",
+                               "veryslow"],
+                      description="speed of H.264 and H.265 encoding, slower presets give smaller files"),
+        EncoderOption("threads", 0, min_val=0, max_val=64, description="encoding threads, 0 to let ffmpeg choose"),
+    ]
+
+    @staticmethod
+    def available():
+        return shutil.which(FFmpegEncoder.binary) is not None
+
+    @staticmethod
+    def extension(target_filename):
+        return os.path.splitext(target_filename)[1] or ".mkv"
+
+    @staticmethod
+    def can_join(options):
+        return FFmpegEncoder.available()
+
+    @staticmethod
+    def codec_args(options):
+        """
+        :return: the ffmpeg arguments selecting the codec and its settings
+        """
+        codec = options["codec"]
+        args = ["-c:v", codec, "-threads", str(options["threads"])]
+        if codec in ("libx264", "libx265"):
+            args += ["-preset", options["preset"], "-crf", str(options["quality"])]
+        elif codec == "libvpx-vp9":
+            # Constant quality mode of VP9, whose crf scale goes up to 63
+            args += ["-crf", str(round(options["quality"] * 63 / 51)), "-b:v", "0"]
+        else:
+            # mpeg4 and mjpeg have a fixed quantizer from 2 (best) to 31 instead
+            args += ["-q:v", str(round(2 + options["quality"] * 29 / 51))]
+        if codec != "mjpeg":
+            args += ["-pix_fmt", "yuv420p"]
+        return args
+
+    def __init__(self, target_filename, fps, size, options):
+        if not FFmpegEncoder.available():
+            raise RuntimeError("Cannot find " + FFmpegEncoder.binary +
+                               ": install ffmpeg or set the FFMPEG_BINARY environment variable")
+        width, height = size
+        self.frame_bytes = width * height * 3
+        command = [FFmpegEncoder.binary, "-hide_banner", "-loglevel", "error", "-y",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", "%dx%d" % (width, height), "-r", repr(fps), "-i", "-",
+                   "-an"]
+        if width % 2 or height % 2:
+            # yuv420p needs even sizes
+            command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        command += FFmpegEncoder.codec_args(options) + [target_filename]
+        # Errors are read at the end: a file cannot fill up and block ffmpeg like a pipe would
+        self.errors = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.errors)
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def _fail(self):
+        try:
+            # release() has nothing left to do
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.wait()
+        self.errors.seek(0)
+        message = self.errors.read().decode("utf-8", "replace").strip()
+        raise RuntimeError("ffmpeg failed (exit code " + str(self.process.returncode) + "): " + message)
+
+    def write(self, frame):
+        frame = np.ascontiguousarray(to_bgr(frame))
+        if frame.nbytes != self.frame_bytes:
+            raise ValueError("Frame of shape " + str(frame.shape) + " does not match the size of the video")
+        try:
+            self.process.stdin.write(frame.data)
+        except (BrokenPipeError, OSError):
+            self._fail()
+
+    def release(self):
+        """
+        Waits for ffmpeg to encode all the frames
+        :raise RuntimeError: if ffmpeg failed
+        """
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        if self.process.wait() != 0:
+            self._fail()
+        self.errors.close()
+
+    @staticmethod
+    def join(segment_filenames, target_filename, options):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            for filename in segment_filenames:
+                f.write("file '" + os.path.abspath(filename).replace("'", "'\\''") + "'\n")
+            list_filename = f.name
+        try:
+            result = subprocess.run([FFmpegEncoder.binary, "-hide_banner", "-loglevel", "error", "-y",
+                                     "-f", "concat", "-safe", "0", "-i", list_filename, "-c", "copy", target_filename],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        finally:
+            os.remove(list_filename)
+        if result.returncode != 0:
+            raise RuntimeError("ffmpeg could not join the segments: " + result.stderr.decode("utf-8", "replace"))
+        cap = cv2.VideoCapture(target_filename)
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        return count
+
+
+# The encoder backends by name
+ENCODERS = {encoder.name: encoder for encoder in (OpenCVEncoder, FFmpegEncoder)}
+
+
+class EncoderConfig:
+    """
+    The encoder backend used to save videos and the values of its options. The default is OpenCV's MJPG writer.
+    It is saved in chain files next to the filters, under "encoder":
+        {"backend": "ffmpeg", "options": {"codec": "libx264", "quality": 20}}
+    Configurations are never modified once created, and can be sent to other processes.
+
+    Attributes
+    ----------
+    backend : str
+        the name of the backend (see ENCODERS)
+    options : {name => value}
+        the values of all the options of the backend
+    """
+    def __init__(self, backend="opencv", options=None):
+        """
+        :param backend: the name of the backend
+        :param options: the values of some options, the others get their default value
+        :raise ValueError: if the backend or an option is not valid
+        """
+        if backend not in ENCODERS:
+            raise ValueError("Unknown encoder: " + str(backend) + " (expected one of " + ", ".join(ENCODERS) + ")")
+        options = options or {}
+        known = {option.name: option for option in ENCODERS[backend].options}
+        for name in options:
+            if name not in known:
+                raise ValueError("Unknown option of encoder " + backend + ": " + str(name))
+        self.backend = backend
+        self.options = {name: option.validate(options.get(name, option.default)) for name, option in known.items()}
+
+    @property
+    def encoder(self):
+        """
+        :return: the class of the backend
+        """
+        return ENCODERS[self.backend]
+
+    def open(self, target_filename, fps, size):
+        """
+        :return: a new writer of the backend, with the methods write(frame), release() and isOpened() - frames
+                 can be BGR or GRAY (see frame_format.py)
+        """
+        return self.encoder(target_filename, fps, size, self.options)
+
+    def join(self, segment_filenames, target_filename):
+        """
+        Joins videos written with this configuration into the target, without re-encoding them
+        :return: the number of frames of the target
+        """
+        return self.encoder.join(segment_filenames, target_filename, self.options)
+
+    def can_join(self):
+        """
+        :return: whether videos written with this configuration can be joined, i.e. saved in segments
+        """
+        return self.encoder.can_join(self.options)
+
+    def extension(self, target_filename):
+        """
+        :return: the extension of the segments when saving into target_filename in segments
+        """
+        return self.encoder.extension(target_filename)
+
+    def to_dict(self):
+        return {"backend": self.backend, "options": dict(self.options)}
+
+    @staticmethod
+    def from_dict(data):
+        """
+        :param data: a description returned by to_dict(), None for the default configuration
+        :raise ValueError: if the description is not valid
+        """
+        if data is None:
+            return EncoderConfig()
+        if not isinstance(data, dict) or not isinstance(data.get("options", {}), dict):
+            raise ValueError("Not an encoder configuration")
+        return EncoderConfig(data.get("backend", "opencv"), data.get("options"))
+
+    @staticmethod
+    def load(filename):
+        """
+        :param filename: path of a chain file (see FilterChain.save())
+        :return: the configuration saved in the chain file, the default one if there is none
+        """
+        with open(filename) as f:
+            data = json.load(f)
+        return EncoderConfig.from_dict(data.get("encoder") if isinstance(data, dict) else None)
@@ -0,0 +1,261 @@
+import queue
+import threading
+import time
+import cv2
+
+from encoders import EncoderConfig
+from filter_chain import FilterChain
+from frame_cache import CachedReader, FrameCache
+from frame_format import BGR, open_video, video_format
+from frame_index import FrameIndex
+from pipeline import Pipeline
+
+# How long (in seconds) blocking queue operations wait before checking whether the export has been aborted
+QUEUE_POLL_TIMEOUT = 0.5
+
+
+class ExportOutput:
+    """
+    One of the videos written by render_fanout()
+
+    Attributes
+    ----------
+    target_filename : str
+        path of the video to write
+    chain : FilterChain
+        the filters to apply
+    encoder : EncoderConfig
+        the encoder writing the video
+    size : (int, int) or None
+        (width, height) to which the filtered frames are resized, e.g. for a proxy copy - None to keep the source size
+    """
+    def __init__(self, target_filename, chain, encoder=None, size=None):
+        self.target_filename = target_filename
+        self.chain = chain
+        self.encoder = encoder or EncoderConfig()
+        self.size = None if size is None else tuple(size)
+
+
+class PrefixNode:
+    """
+    A node of the tree of the filters of several chains: the chains that start with the same filters (with the same
+    parameters) share the nodes of those filters, so that they are applied only once to each frame.
+    Each node applies the filters that are between its parent and the next branch or output, with its own Pipeline.
+
+    Attributes
+    ----------
+    entries : [ChainEntry]
+        the filters applied by this node, after those of its parents
+    children : [PrefixNode]
+        the nodes applying the next filters of the chains
+    outputs : [int]
+        the outputs (their position in the list given to build()) whose chain ends with this node
+    pipeline : Pipeline or None
+        applies the entries, None for the root, which does not have any
+    """
+    def __init__(self, entries):
+        self.entries = entries
+        self.children = []
+        self.outputs = []
+        self.pipeline = None
+
+    @staticmethod
+    def build(chains):
+        """
+        :param chains: the chain of each output [FilterChain]
+        :return: the root of the tree, which does not apply any filter
+        """
+        # First a node per filter: [entry, {key => child}, outputs]
+        root = [None, {}, []]
+        for i, chain in enumerate(chains):
+            node = root
+            for entry in chain:
+                key = (entry.filter, tuple(sorted(entry.vals.items())))
+                if key not in node[1]:
+                    node[1][key] = [entry, {}, []]
+                node = node[1][key]
+            node[2].append(i)
+
+        # Then filters without branches nor outputs in between are merged into a single node
+        def compress(node):
+            entries = [node[0]]
+            while len(node[1]) == 1 and not node[2]:
+                node = next(iter(node[1].values()))
+                entries.append(node[0])
+            merged = PrefixNode(entries)
+            merged.outputs = node[2]
+            merged.children = [compress(child) for child in node[1].values()]
+            return merged
+
+        tree = PrefixNode([])
+        tree.outputs = root[2]
+        tree.children = [compress(child) for child in root[1].values()]
+        return tree
+
+    def nodes(self):
+        """
+        :return: this node and all the nodes below it
+        """
+        yield self
+        for child in self.children:
+            yield from child.nodes()
+
+    def open(self, input_format=BGR):
+        """
+        Builds the pipelines of this node and of the nodes below it
+        :param input_format: the format of the decoded frames, BGR or GRAY
+        """
+        for node in self.nodes():
+            if node.entries:
+                node.pipeline = Pipeline(FilterChain(node.entries), input_format=input_format)
+
+    def close(self):
+        """
+        Releases the instances of the filters of this node and of the nodes below it
+        """
+        for node in self.nodes():
+            if node.pipeline is not None:
+                node.pipeline.close()
+                node.pipeline = None
+
+    def label(self):
+        """
+        :return: a prefix for the names of the stages of this node in a Profiler, telling which outputs share it
+        """
+        outputs = sorted(i for node in self.nodes() for i in node.outputs)
+        return "outputs " + "+".join(str(i + 1) for i in outputs) + ": "
+
+    def process(self, frame, results, profiler=None):
+        """
+        Applies the filters of this node and of the nodes below it
+        :param frame: the output of the parent node
+        :param results: receives the filtered frame of each output {output => frame} - the frames are only valid
+                        until the next call
+        :param profiler: optional Profiler recording the duration of each stage
+        """
+        if self.pipeline is not None:
+            frame = self.pipeline.process(frame, None if profiler is None else _PrefixedProfiler(profiler, self))
+        for i in self.outputs:
+            results[i] = frame
+        for child in self.children:
+            child.process(frame, results, profiler)
+
+
+class _PrefixedProfiler:
+    """
+    Records the stages of the Pipeline of a PrefixNode into a Profiler, under names telling which outputs share them
+    """
+    def __init__(self, profiler, node):
+        self.profiler = profiler
+        self.prefix = node.label()
+
+    def record(self, name, seconds):
+        self.profiler.record(self.prefix + name, seconds)
+
+
+def _write_frames(frames, out, progress, profiler, name, errors, stop_event):
+    """
+    Body of the thread writing one output: encodes the frames of its queue until it gets None
+    :param errors: receives the exception that stopped the thread, if any
+    """
+    count = 0
+    try:
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            start = time.perf_counter()
+            out.write(frame)
+            if profiler is not None:
+                profiler.record(name, time.perf_counter() - start)
+            count += 1
+            if progress is not None:
+                progress(count)
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+        # Let the decoding thread go on until it sees the error
+        while frames.get() is not None:
+            pass
+
+
+def render_fanout(source_filename, outputs, progress=None, start_frame=0, end_frame=None, queue_size=8,
+                  profiler=None):
+    """
+    Renders several videos from a single decoding of the source, e.g. variants of the same video with different
+    filters and encoders, or a smaller proxy copy:
+    - the calling thread decodes every frame once and applies the filters of all the chains, those that several
+      chains start with being applied only once (see PrefixNode),
+    - one thread per output encodes its frames, taken from a queue of queue_size frames: when the slowest output
+      falls behind, decoding waits for it so that memory does not grow.
+    :param source_filename: path of the source video
+    :param outputs: the videos to write [ExportOutput]
+    :param progress: optional callables, one per output, receiving the number of frames written so far to the output
+    :param start_frame: index of the first frame to render
+    :param end_frame: index of the frame after the last one to render, None to render until the end of the video
+    :param queue_size: maximum number of filtered frames waiting to be encoded for each output
+    :param profiler: optional Profiler recording the duration of decoding ("decode"), of each stage of each chain
+                     and of encoding each output ("encode 1", "encode 2"...)
+    :return: the number of frames written to each output [int]
+    """
+    tree = PrefixNode.build([output.chain for output in outputs])
+    cap = open_video(source_filename)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    source_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    reader = CachedReader(cap, FrameCache.load(source_filename), start_frame, FrameIndex.load(source_filename))
+    writers = []
+    threads = []
+    queues = []
+    errors = []
+    stop_event = threading.Event()
+    counts = [0] * len(outputs)
+    try:
+        for output in outputs:
+            writers.append(output.encoder.open(output.target_filename, fps, output.size or source_size))
+        for i, out in enumerate(writers):
+            frames = queue.Queue(queue_size)
+            thread = threading.Thread(target=_write_frames, daemon=True,
+                                      args=(frames, out, None if progress is None else progress[i], profiler,
+                                            "encode " + str(i + 1), errors, stop_event))
+            thread.start()
+            queues.append(frames)
+            threads.append(thread)
+        tree.open(video_format(cap))
+        results = {}
+        index = start_frame
+        while cap.isOpened() and not stop_event.is_set() and (end_frame is None or index < end_frame):
+            start = time.perf_counter()
+            ret, frame = reader.read()
+            if not ret:
+                break
+            if profiler is not None:
+                profiler.record("decode", time.perf_counter() - start)
+            tree.process(frame, results, profiler)
+            for i, output in enumerate(outputs):
+                result = results[i]
+                if output.size is not None and output.size != (result.shape[1], result.shape[0]):
+                    result = cv2.resize(result, output.size, interpolation=cv2.INTER_AREA)
+                elif result is not frame:
+                    # The pipelines reuse their buffers for the next frame
+                    result = result.copy()
+                # Waits while the output's queue is full, unless an output failed
+                while not stop_event.is_set():
+                    try:
+                        queues[i].put(result, timeout=QUEUE_POLL_TIMEOUT)
+                        counts[i] += 1
+                        break
+                    except queue.Full:
+                        pass
+            index += 1
+    finally:
+        for frames in queues:
+            frames.put(None)
+        for thread in threads:
+            thread.join()
+        tree.close()
+        cap.release()
+        for out in writers:
+            out.release()
+    if errors:
+        raise errors[0]
+    return counts
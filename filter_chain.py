@@ -0,0 +1,179 @@
+import itertools
+import json
+
+# Version of the format of the dictionaries returned by FilterChain.to_dict(), increased on incompatible changes
+CHAIN_FORMAT_VERSION = 1
+
+# Source of unique identifiers for chain entries and of snapshot versions
+_uids = itertools.count(1)
+_versions = itertools.count(1)
+
+
+class ChainEntry:
+    """
+    One filter of a FilterChain with its parameters. Entries are never modified once created.
+
+    Attributes
+    ----------
+    uid : int
+        a unique identifier of the entry, which is kept when its parameters change
+    filter : Filter (one of the filters in the subdirectory "filters")
+        the filter itself
+    vals : {name => value}
+        the values of the filter's parameters - must not be modified
+    """
+    __slots__ = ("uid", "filter", "vals")
+
+    def __init__(self, uid, filter, vals):
+        self.uid = uid
+        self.filter = filter
+        self.vals = vals
+
+
+class FilterChain:
+    """
+    An immutable, versioned snapshot of the selected filters and their parameters.
+    Every modification returns a new snapshot, so that a snapshot can be read (or sent to another process)
+    without any locking while the user keeps editing the filters.
+
+    Attributes
+    ----------
+    entries : tuple of ChainEntry
+        the filters in the order in which they are applied
+    version : int
+        a number that is different for every snapshot, and increases with every modification
+    """
+    def __init__(self, entries=()):
+        self.entries = tuple(entries)
+        self.version = next(_versions)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def filters(self):
+        """
+        :return: the filters, in order [Filter]
+        """
+        return [entry.filter for entry in self.entries]
+
+    def values(self):
+        """
+        :return: the parameters of each filter [{name => value}]
+        """
+        return [entry.vals for entry in self.entries]
+
+    def index_of(self, uid):
+        """
+        :return: the position of the entry with the given uid
+        """
+        for i, entry in enumerate(self.entries):
+            if entry.uid == uid:
+                return i
+        raise KeyError(uid)
+
+    def add(self, filter, vals=None):
+        """
+        Adds a filter at the end of the chain
+        :param filter: the filter to add, a Filter class or a LazyFilter whose module is imported now
+        :param vals: the values of its parameters, defaults to the default values of the filter's parameters
+        :return: the new snapshot and the new entry
+        """
+        filter = filter.load()
+        if vals is None:
+            vals = {param.name: param.default_val for param in filter.get_config()}
+        entry = ChainEntry(next(_uids), filter, dict(vals))
+        return FilterChain(self.entries + (entry,)), entry
+
+    def remove(self, uid):
+        """
+        Removes a filter from the chain
+        :param uid: the uid of the entry to remove
+        :return: the new snapshot
+        """
+        return FilterChain(entry for entry in self.entries if entry.uid != uid)
+
+    def with_value(self, uid, name, value):
+        """
+        Changes the value of a parameter of one filter
+        :param uid: the uid of the entry to change
+        :param name: the name of the parameter
+        :param value: the new value
+        :return: the new snapshot
+        """
+        i = self.index_of(uid)
+        entry = self.entries[i]
+        vals = dict(entry.vals)
+        vals[name] = value
+        return FilterChain(self.entries[:i] + (ChainEntry(entry.uid, entry.filter, vals),) + self.entries[i + 1:])
+
+    def to_dict(self):
+        """
+        :return: a description of the chain made of filter names and parameter values, that can be saved as JSON
+        """
+        return {"version": CHAIN_FORMAT_VERSION,
+                "filters": [{"name": entry.filter.get_filter_name(), "params": dict(entry.vals)}
+                            for entry in self.entries]}
+
+    @staticmethod
+    def from_dict(data, all_filters):
+        """
+        Builds a chain from the description returned by to_dict(), validating it against the available filters:
+        the resulting chain can be used as it is, e.g. sent to other processes, without any further check.
+        Missing parameters get their default value.
+        :param data: the description of the chain
+        :param all_filters: the available filters {name => Filter or LazyFilter}, as returned by
+                            FilterLoader.load_filters() or FilterLoader.discover() - only the filters of the chain
+                            are imported
+        :return: a new FilterChain
+        :raise ValueError: if the description is not valid
+        """
+        if not isinstance(data, dict) or not isinstance(data.get("filters"), list):
+            raise ValueError("Not a filter chain")
+        version = data.get("version", 1)
+        if not isinstance(version, int) or version > CHAIN_FORMAT_VERSION:
+            raise ValueError("Unsupported filter chain version: " + str(version))
+        chain = FilterChain()
+        for item in data["filters"]:
+            name = item.get("name") if isinstance(item, dict) else None
+            if name not in all_filters:
+                raise ValueError("Unknown filter: " + str(name))
+            f = all_filters[name]
+            params = item.get("params") or {}
+            if not isinstance(params, dict):
+                raise ValueError("Invalid parameters of " + name + ": " + str(params))
+            config = {param.name: param for param in f.get_config()}
+            for param_name, value in params.items():
+                if param_name not in config:
+                    raise ValueError("Unknown parameter of " + name + ": " + str(param_name))
+                param = config[param_name]
+                if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                        or not param.min_val <= value <= param.max_val:
+                    raise ValueError("Invalid value for " + name + " / " + param_name + ": " + str(value))
+            vals = {param.name: params.get(param.name, param.default_val) for param in config.values()}
+            chain, _ = chain.add(f, vals)
+        return chain
+
+    def save(self, filename, encoder=None):
+        """
+        Saves the chain into a JSON file
+        :param encoder: optional EncoderConfig saved with the chain (see encoders.py), under "encoder"
+        """
+        data = self.to_dict()
+        if encoder is not None:
+            data["encoder"] = encoder.to_dict()
+        with open(filename, "w") as f:
+            json.dump(data, f, indent=2)
+
+    @staticmethod
+    def load(filename, all_filters):
+        """
+        Loads a chain saved with save()
+        :param filename: path of the JSON file
+        :param all_filters: the available filters, see from_dict()
+        :return: a new FilterChain
+        """
+        with open(filename) as f:
+            return FilterChain.from_dict(json.load(f), all_filters)
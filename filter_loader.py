@@ -1,26 +1,170 @@
-from pkgutil import walk_packages
+import hashlib
+import importlib
+import json
+import os
+import traceback
+
+from abstract_filter import FilterParameter
+
+# Version of the manifest files, increased on incompatible changes
+MANIFEST_FORMAT_VERSION = 1
+# The manifests of the filter directories are written into this directory
+MANIFEST_DIR = os.path.join(os.path.expanduser("~"), ".video_filter_manifest")
+
+
+class LazyFilter:
+    """
+    A filter found by FilterLoader.discover(): its name and parameters come from the manifest, so that it can be shown
+    and validated without importing its module, which is only imported by load() - typically when the filter is first
+    added to a chain (see FilterChain.add()).
+
+    Attributes
+    ----------
+    module_name : str
+        the name of the module defining the filter, e.g. "filters.Blur"
+    class_name : str
+        the name of the filter's class in the module
+    """
+    def __init__(self, name, module_name, class_name, config, filter=None):
+        """
+        :param name: the name of the filter (see Filter.get_filter_name())
+        :param config: its parameters [FilterParameter]
+        :param filter: the class of the filter if its module is already imported
+        """
+        self.name = name
+        self.module_name = module_name
+        self.class_name = class_name
+        self.config = config
+        self.filter = filter
+
+    def get_filter_name(self):
+        return self.name
+
+    def get_config(self):
+        return self.config
+
+    @property
+    def loaded(self):
+        """
+        :return: True if the module of the filter has been imported
+        """
+        return self.filter is not None
+
+    def load(self):
+        """
+        Imports the module of the filter if it is not imported yet
+        :return: the class of the filter
+        """
+        if self.filter is None:
+            self.filter = getattr(importlib.import_module(self.module_name), self.class_name)
+        return self.filter
 
 
 class FilterLoader:
     """
-    A class used to load all filters in the directory "filters"
+    A class used to find all filters in the directory "filters" and its subdirectories
+    Every module defines one filter: a Filter class with the name of the module, e.g. filters/Blur.py defines Blur
     """
     @staticmethod
-    def load_filters(root_import_path, is_valid=lambda entity: True):
-        """Returns modules in ``root_import_path`` that satisfy the ``is_valid`` test
+    def manifest_path(filters_dir):
+        """
+        :return: the path of the manifest of a directory of filters
+        """
+        name = hashlib.sha1(os.path.abspath(filters_dir).encode("utf-8")).hexdigest() + ".json"
+        return os.path.join(MANIFEST_DIR, name)
 
-        :param root_import_path: A string name for importing (i.e. "myapp").
-        :param is_valid: A callable that takes a variable and returns ``True``
-                         if it is of interest to us."""
+    @staticmethod
+    def _describe(module_name, class_name, path):
+        """
+        Imports a module of filters to describe its filter in the manifest
+        :return: the description of the filter, and its class
+        """
+        c = getattr(importlib.import_module(module_name), class_name)
+        stat = os.stat(path)
+        description = {"size": stat.st_size, "mtime": stat.st_mtime, "module": module_name, "class": class_name,
+                       "name": c.get_filter_name(),
+                       "params": [{"name": p.name, "min": p.min_val, "max": p.max_val, "default": p.default_val,
+                                   "scale_axis": p.scale_axis} for p in c.get_config()]}
+        return description, c
 
-        classes = {}
+    @staticmethod
+    def discover(filters_dir, package=None):
+        """
+        Finds the filters of a directory and of its subdirectories, without importing them: their names and parameters
+        are read from the directory's manifest. Only the modules that are new or that changed since the manifest was
+        written are imported, to describe them, and the manifest is then updated.
+        Modules that cannot be imported are reported and skipped.
+        :param filters_dir: path of the directory
+        :param package: the name under which the directory is imported, defaults to the name of the directory
+        :return: the filters sorted by name {name => LazyFilter}
+        """
+        filters_dir = os.path.abspath(filters_dir)
+        if package is None:
+            package = os.path.basename(filters_dir)
+        manifest_path = FilterLoader.manifest_path(filters_dir)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_FORMAT_VERSION:
+                manifest = {}
+        except (OSError, ValueError):
+            manifest = {}
+        old_modules = manifest.get("modules", {})
+        # Relative path of each module => its description, for the modules found this time
+        modules = {}
+        filters = {}
+        for dir_path, dir_names, file_names in os.walk(filters_dir):
+            # Sorted so that the first of two filters with the same name is always the same one
+            dir_names[:] = sorted(d for d in dir_names if not d.startswith(("_", ".")))
+            for file_name in sorted(file_names):
+                if not file_name.endswith(".py") or file_name.startswith(("_", ".")):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                relative = os.path.relpath(path, filters_dir)
+                class_name = file_name[:-3]
+                module_name = package + "." + relative[:-3].replace(os.sep, ".")
+                description = old_modules.get(relative)
+                c = None
+                try:
+                    stat = os.stat(path)
+                    if description is None or description.get("size") != stat.st_size \
+                            or description.get("mtime") != stat.st_mtime or description.get("module") != module_name:
+                        description, c = FilterLoader._describe(module_name, class_name, path)
+                except Exception:
+                    # A bogus module must not prevent the other filters from being used
+                    traceback.print_exc()
+                    print("Skipping filter module " + relative)
+                    continue
+                modules[relative] = description
+                name = description["name"]
+                if name in filters:
+                    print("Skipping filter module " + relative + ": there is already a filter named " + name)
+                    continue
+                config = [FilterParameter(p["name"], p["min"], p["max"], p["default"], p["scale_axis"])
+                          for p in description["params"]]
+                filters[name] = LazyFilter(name, module_name, description["class"], config, c)
+        if modules != old_modules:
+            try:
+                os.makedirs(MANIFEST_DIR, exist_ok=True)
+                with open(manifest_path + ".tmp", "w") as f:
+                    json.dump({"version": MANIFEST_FORMAT_VERSION, "dir": filters_dir, "modules": modules}, f)
+                os.replace(manifest_path + ".tmp", manifest_path)
+            except OSError as e:
+                print("Could not save the manifest of the filters: " + str(e))
+        return {name: filters[name] for name in sorted(filters)}
 
-        for finder, name, is_pkg in walk_packages(root_import_path):
-            if is_pkg:
-                continue
-            filters_mod = __import__("filters." + name)
-            actual_mod = getattr(filters_mod, name)
-            c = getattr(actual_mod, name)
-            classes[c.get_filter_name()] = c
-        res = {key: val for key, val in sorted(classes.items(), key=lambda ele: ele[0])}
-        return res
+    @staticmethod
+    def load_filters(root_import_path, is_valid=lambda entity: True):
+        """
+        Imports all the filters of some directories, see discover()
+        :param root_import_path: the paths of the directories
+        :param is_valid: A callable that takes a filter class and returns ``True`` if it is of interest to us
+        :return: the filter classes sorted by name {name => Filter}
+        """
+        classes = {}
+        for path in root_import_path:
+            for name, lazy in FilterLoader.discover(path).items():
+                c = lazy.load()
+                if name not in classes and is_valid(c):
+                    classes[name] = c
+        return {name: classes[name] for name in sorted(classes)}
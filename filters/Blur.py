@@ -1,4 +1,4 @@
-from abstract_filter import Filter, FilterParameter
+from abstract_filter import Filter, FilterParameter, BGR, GRAY
 import cv2
 
 
@@ -6,18 +6,25 @@ class Blur(Filter):
     """
     A simple blurring filter using a matrix of a given size horizontally and vertically
     """
-    param_horiz = FilterParameter("Horizontal", 2.0, 100.0, 10.0)
-    param_vert = FilterParameter("Vertical", 2.0, 100.0, 10.0)
+    param_horiz = FilterParameter("Horizontal", 2.0, 100.0, 10.0, scale_axis="x")
+    param_vert = FilterParameter("Vertical", 2.0, 100.0, 10.0, scale_axis="y")
     config = [param_horiz, param_vert]
+    formats = (BGR, GRAY)
+    supports_out = True
 
     @staticmethod
     def get_filter_name():
         return "Blur"
 
     @staticmethod
-    def apply_filter(frame, params):
-        # Simply call cv2.blur()
-        return cv2.blur(frame, (round(params["Horizontal"]), round(params["Vertical"])))
+    def apply_filter(frame, params, out=None):
+        # Simply call cv2.blur() - the kernel may become smaller than 1 pixel on scaled down frames
+        return cv2.blur(frame, (max(1, round(params["Horizontal"])), max(1, round(params["Vertical"]))), dst=out)
+
+    @staticmethod
+    def get_halo(params):
+        # The kernel is centered: a pixel depends on half the kernel above and below it
+        return max(1, round(params["Vertical"])) // 2
 
     @staticmethod
     def get_config():
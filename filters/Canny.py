@@ -1,6 +1,5 @@
-from abstract_filter import Filter, FilterParameter
+from abstract_filter import Filter, FilterParameter, BGR, GRAY
 import cv2
-import numpy as np
 
 class Canny(Filter):
     """
@@ -9,13 +8,18 @@ class Canny(Filter):
     param_horiz = FilterParameter("Horizontal", 1.0, 1000.0, 100.0)
     param_vert = FilterParameter("Vertical", 1.0, 1000.0, 100.0)
     config = [param_horiz, param_vert]
+    # Color frames get edges for each channel, grayscale frames a single detection
+    formats = (BGR, GRAY)
+    supports_out = True
 
     @staticmethod
     def get_filter_name():
         return "Edge Detection (Canny)"
 
     @staticmethod
-    def apply_filter(frame, params):
+    def apply_filter(frame, params, out=None):
+        if frame.ndim == 2:
+            return cv2.Canny(frame, params[Canny.param_horiz.name], params[Canny.param_vert.name], edges=out)
         # Do Canny on all 3 channels - separate them first
         (B, G, R) = cv2.split(frame)
         # Apply on each channel
@@ -23,7 +27,9 @@ class Canny(Filter):
         G_cny = cv2.Canny(G, params[Canny.param_horiz.name], params[Canny.param_vert.name])
         R_cny = cv2.Canny(R, params[Canny.param_horiz.name], params[Canny.param_vert.name])
         # Merge all channels back to a single image
-        return cv2.merge([B_cny, G_cny, R_cny])
+        return cv2.merge([B_cny, G_cny, R_cny], dst=out)
+
+    # No get_halo(): hysteresis follows edges across the whole frame, so that strips would not give the same edges
 
     @staticmethod
     def get_config():
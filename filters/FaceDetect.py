@@ -1,37 +1,131 @@
-from abstract_filter import Filter, FilterParameter
+from abstract_filter import Filter, FilterParameter, RESOLUTION_SCALE
+import os
 import cv2
+import numpy as np
 
 
 class FaceDetect(Filter):
     """
     A simple face detector using haar cascades - find the data in subfolder data
+    Detection can run on a downscaled image and only every few frames: in between, faces are either held where they
+    were last found or tracked with template matching, which is much cheaper than a detection
+    Every instance loads its own classifier, which is not thread-safe
     """
-    # !! WARNING !! By doing this, we are not thread-safe
-    haar_cascade_face = cv2.CascadeClassifier('filters/data/haarcascade_frontalface_default.xml')
+    cascade_path = os.path.join(os.path.dirname(__file__), 'data', 'haarcascade_frontalface_default.xml')
     param_scale_factor = FilterParameter("Scale factor", 2, 100, 5)
-    config = [param_scale_factor]
+    # Detection runs on the grayscale image resized by this factor - 1 for full resolution
+    param_detection_scale = FilterParameter("Detection scale", 0.1, 1, 1)
+    # Faces are detected every this number of frames
+    param_detect_every = FilterParameter("Detect every", 1, 30, 1)
+    # Between detections: 0 holds the faces where they were, 1 tracks them
+    param_tracking = FilterParameter("Tracking", 0, 1, 1)
+    config = [param_scale_factor, param_detection_scale, param_detect_every, param_tracking]
+    supports_out = True
+    stateful = True
+    # Thickness in pixels on the original video, scaled down on resized frames
+    rectangle_thickness = 15
 
     @staticmethod
     def get_filter_name():
         return "Face Detection"
 
-    @staticmethod
-    def apply_filter(frame, params):
-        gray_image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    def __init__(self):
+        super().__init__()
+        self.haar_cascade_face = cv2.CascadeClassifier(FaceDetect.cascade_path)
+        # Number of frames filtered so far
+        self.count = 0
+        # The faces found in the last frame [(x, y, w, h)], in frame coordinates
+        self.faces = []
+        # The grayscale image in which faces were detected or tracked in the last frame, and its scale
+        self.small = None
+        self.scale = None
 
+    def detect(self, small, scale):
+        """
+        :return: the faces found in the downscaled grayscale image [(x, y, w, h)], in frame coordinates
+        """
         # Applying the haar classifier to detect faces on the grayscale image
-        faces_rect = FaceDetect.haar_cascade_face.detectMultiScale(
-            gray_image,
-            scaleFactor=params[FaceDetect.param_scale_factor.name],
+        faces_rect = self.haar_cascade_face.detectMultiScale(
+            small,
+            scaleFactor=self.params[FaceDetect.param_scale_factor.name],
             minNeighbors=5)
+        return [tuple(round(v / scale) for v in rect) for rect in faces_rect]
+
+    @staticmethod
+    def track(previous, small, scale, faces):
+        """
+        Moves the faces found in the previous image to where they look the most alike in the new one,
+        searching around their previous position
+        :return: the moved faces [(x, y, w, h)], in frame coordinates
+        """
+        height, width = small.shape
+        tracked = []
+        for (x, y, w, h) in faces:
+            # Face in the downscaled image, and a search window half a face larger on each side
+            x0, y0 = max(0, round(x * scale)), max(0, round(y * scale))
+            x1, y1 = min(width, round((x + w) * scale)), min(height, round((y + h) * scale))
+            margin = max(x1 - x0, y1 - y0) // 2
+            wx0, wy0 = max(0, x0 - margin), max(0, y0 - margin)
+            wx1, wy1 = min(width, x1 + margin), min(height, y1 + margin)
+            if x1 - x0 < 4 or y1 - y0 < 4 or wx1 - wx0 <= x1 - x0 or wy1 - wy0 <= y1 - y0:
+                # Too small or at the border: hold it
+                tracked.append((x, y, w, h))
+                continue
+            result = cv2.matchTemplate(small[wy0:wy1, wx0:wx1], previous[y0:y1, x0:x1], cv2.TM_CCOEFF_NORMED)
+            _, _, _, (dx, dy) = cv2.minMaxLoc(result)
+            tracked.append((round((wx0 + dx) / scale), round((wy0 + dy) / scale), w, h))
+        return tracked
+
+    @staticmethod
+    def is_stateful(params):
+        # Detecting on every frame does not depend on the previous frames
+        return max(1, round(params[FaceDetect.param_detect_every.name])) > 1
+
+    @staticmethod
+    def apply_filter(frame, params, out=None):
+        # A single frame on its own: the classifier is loaded for this frame only, use process() for a video
+        face_detect = FaceDetect()
+        face_detect.configure(params)
+        return face_detect.process(frame, out)
+
+    def process(self, frame, out=None):
+        params = self.params
+        gray_image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Rectangles are drawn on a copy so that the source frame is left untouched
+        if out is None:
+            out = frame.copy()
+        else:
+            np.copyto(out, frame)
+
+        scale = params[FaceDetect.param_detection_scale.name]
+        if scale < 1:
+            small = cv2.resize(gray_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1
+            small = gray_image
+        every = max(1, round(params[FaceDetect.param_detect_every.name]))
+        if self.count % every == 0 or self.scale != scale or self.small.shape != small.shape:
+            faces = self.detect(small, scale)
+        elif params[FaceDetect.param_tracking.name] >= 0.5:
+            faces = FaceDetect.track(self.small, small, scale, self.faces)
+        else:
+            faces = self.faces
+        self.count += 1
+        self.faces = faces
+        self.small = small
+        self.scale = scale
 
         # Draw a rectangle for each detected face
-        for (x, y, w, h) in faces_rect:
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 15)
+        thickness = max(1, round(FaceDetect.rectangle_thickness * params.get(RESOLUTION_SCALE, 1.0)))
+        for (x, y, w, h) in faces:
+            cv2.rectangle(out, (x, y), (x + w, y + h), (0, 255, 0), thickness)
+
+        return out
 
-        return frame
+    def close(self):
+        self.haar_cascade_face = None
+        self.small = None
 
     @staticmethod
     def get_config():
         return FaceDetect.config
-
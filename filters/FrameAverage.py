@@ -0,0 +1,73 @@
+from abstract_filter import Filter, FilterParameter, BGR, GRAY
+import cv2
+import numpy as np
+
+
+class FrameAverage(Filter):
+    """
+    A temporal filter replacing each frame by the average of the last frames (itself included): it removes the noise
+    of static scenes, and leaves trails behind whatever moves
+    The instance keeps the last frames it has seen, the average is computed for a whole block of frames at once
+    """
+    param_frames = FilterParameter("Frames", 1, 16, 3)
+    config = [param_frames]
+    formats = (BGR, GRAY)
+    supports_out = True
+    stateful = True
+
+    @staticmethod
+    def get_filter_name():
+        return "Frame Average"
+
+    def __init__(self):
+        super().__init__()
+        # The last frames seen (at most Frames - 1 of them) as a single array, None before the first frame
+        self.history = None
+
+    @staticmethod
+    def apply_filter(frame, params, out=None):
+        # A single frame on its own is its own average, use process() for a video
+        if out is None:
+            return frame.copy()
+        np.copyto(out, frame)
+        return out
+
+    @staticmethod
+    def is_stateful(params):
+        # The average of a single frame is the frame itself
+        return max(1, round(params[FrameAverage.param_frames.name])) > 1
+
+    def process(self, frame, out=None):
+        return self.process_batch(frame[np.newaxis], None if out is None else out[np.newaxis])[0]
+
+    def process_batch(self, frames, out=None):
+        count = max(1, round(self.params[FrameAverage.param_frames.name]))
+        history = self.history
+        if history is not None and history.shape[1:] != frames.shape[1:]:
+            # Frames of another size (e.g. in the preview after resizing the window): start again
+            history = None
+        past = 0 if history is None or count == 1 else min(len(history), count - 1)
+        block = frames if past == 0 else np.concatenate((history[len(history) - past:], frames))
+        # Sum of the last count frames of each frame: one shifted view of the block added per frame of the window
+        sums = block[past:].astype(np.uint16)
+        for shift in range(1, min(count, past + len(frames))):
+            first = max(0, shift - past)
+            np.add(sums[first:], block[past + first - shift:past + len(frames) - shift], out=sums[first:])
+        result = np.empty(frames.shape, np.uint8) if out is None else out
+        # The first frames of the stream are averaged over the frames before them only, the others over the whole
+        # window: those are all scaled in a single call, on the frames stacked into one tall image
+        full = min(len(frames), max(0, count - 1 - past))
+        for i in range(full):
+            cv2.convertScaleAbs(sums[i], dst=result[i], alpha=1 / (past + i + 1))
+        if full < len(frames):
+            shape = (-1,) + frames.shape[2:]
+            cv2.convertScaleAbs(sums[full:].reshape(shape), dst=result[full:].reshape(shape), alpha=1 / count)
+        self.history = None if count == 1 else block[max(0, len(block) - (count - 1)):].copy()
+        return result
+
+    def close(self):
+        self.history = None
+
+    @staticmethod
+    def get_config():
+        return FrameAverage.config
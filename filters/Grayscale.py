@@ -1,4 +1,4 @@
-from abstract_filter import Filter, FilterParameter
+from abstract_filter import Filter, BGR, GRAY
 import cv2
 
 
@@ -6,14 +6,29 @@ class Grayscale(Filter):
     """
     A simple grayscale filter
     """
+    formats = (BGR, GRAY)
+    output_format = GRAY
+    to_gray = True
+    supports_out = True
+
     @staticmethod
     def get_filter_name():
         return "Grayscale"
 
     @staticmethod
-    def apply_filter(frame, params):
-        # Switch to grayscale and then back to BGR since the main window expects the 3 channels to be present
-        return cv2.cvtColor(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+    def apply_filter(frame, params, out=None):
+        # The frame stays in grayscale: it is only converted back to BGR if a later filter needs colors
+        if frame.ndim == 2:
+            # Already in grayscale
+            if out is None:
+                return frame.copy()
+            out[:] = frame
+            return out
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=out)
+
+    @staticmethod
+    def get_halo(params):
+        return 0
 
     @staticmethod
     def get_config():
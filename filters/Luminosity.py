@@ -1,5 +1,6 @@
-from abstract_filter import Filter, FilterParameter
+from abstract_filter import Filter, FilterParameter, BGR, GRAY
 import cv2
+import numpy as np
 
 
 class Luminosity(Filter):
@@ -9,14 +10,34 @@ class Luminosity(Filter):
     param_contrast = FilterParameter("Contrast", 1.0, 3.0, 1)
     param_luminosity = FilterParameter("Luminosity", 0.0, 100.0, 0.0)
     config = [param_contrast, param_luminosity]
+    formats = (BGR, GRAY)
+    supports_out = True
+    supports_batch = True
 
     @staticmethod
     def get_filter_name():
         return "Luminosity"
 
     @staticmethod
-    def apply_filter(frame, params):
-        return cv2.convertScaleAbs(frame, alpha=params["Contrast"], beta=params["Luminosity"])
+    def apply_filter(frame, params, out=None):
+        return cv2.convertScaleAbs(frame, dst=out, alpha=params["Contrast"], beta=params["Luminosity"])
+
+    @staticmethod
+    def apply_batch(frames, params, out=None):
+        # The filter is point-wise: the block is filtered in a single call, as one image made of all the frames
+        tall = np.ascontiguousarray(frames).reshape((-1,) + frames.shape[2:])
+        result = cv2.convertScaleAbs(tall, dst=None if out is None else out.reshape(tall.shape),
+                                     alpha=params["Contrast"], beta=params["Luminosity"])
+        return result.reshape(frames.shape)
+
+    @staticmethod
+    def get_lut(params):
+        # Apply the filter to all possible values, so that the table gives exactly the same results
+        return Luminosity.apply_filter(np.arange(256, dtype=np.uint8), params).reshape(256)
+
+    @staticmethod
+    def get_halo(params):
+        return 0
 
     @staticmethod
     def get_config():
@@ -1,4 +1,4 @@
-from abstract_filter import Filter, FilterParameter
+from abstract_filter import Filter, BGR, GRAY
 import cv2
 import numpy as np
 
@@ -6,14 +6,23 @@ class Sharpen(Filter):
     """
     A basic sharpening filter
     """
+    formats = (BGR, GRAY)
+    supports_out = True
+    # Use a simple sharpening matrix - built once, it is never modified
+    kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+
     @staticmethod
     def get_filter_name():
         return "Sharpen"
 
     @staticmethod
-    def apply_filter(frame, params):
-        # Use a simple sharpening matrix
-        return cv2.filter2D(frame, -1, np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]]))
+    def apply_filter(frame, params, out=None):
+        return cv2.filter2D(frame, -1, Sharpen.kernel, dst=out)
+
+    @staticmethod
+    def get_halo(params):
+        # 3x3 kernel
+        return 1
 
     @staticmethod
     def get_config():
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+from frame_format import BGR, frame_shape
+from frame_index import seek
+
+# Version of the cache files, increased on incompatible changes
+FRAME_CACHE_FORMAT_VERSION = 1
+# The cached frames of all videos are written into this directory
+FRAME_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".video_filter_cache")
+
+
+class FrameCache:
+    """
+    Decoded frames of a video kept in a memory-mapped file, so that playing the same part of a video again
+    (e.g. looping a clip while tuning the filters) reads them instead of decoding them.
+    The file has one fixed-size slot per frame: frame i goes into slot i % slots, replacing the frame that was there.
+    A clip shorter than the number of slots is therefore entirely kept after it has been played once.
+    The number of each slot's frame is kept in a second memory-mapped file: -1 while the slot is being written.
+
+    Frames are only written by the process that opened the cache with open() (the player), other processes
+    (e.g. an export) open it read-only with load() and check that a slot was not replaced while they copied it.
+    The cache is dropped when the video's size or modification time changes.
+
+    Attributes
+    ----------
+    slots : int
+        the number of frames that the cache can hold
+    shape : tuple
+        the shape of the frames (height, width, 3), or (height, width) for grayscale videos
+    hits : int
+        number of frames read from the cache
+    """
+    # A cache that cannot hold this number of frames is not worth it: a clip would not even fit in it
+    MIN_SLOTS = 32
+
+    def __init__(self, frames, owners, writable):
+        self.frames = frames
+        self.owners = owners
+        self.writable = writable
+        self.slots = len(owners)
+        self.shape = frames.shape[1:]
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def paths(source_filename):
+        """
+        :return: the paths of the description, frames and owners files of the cache of a video
+        """
+        name = hashlib.sha1(os.path.abspath(source_filename).encode("utf-8")).hexdigest()
+        base = os.path.join(FRAME_CACHE_DIR, name)
+        return base + ".json", base + ".frames", base + ".owners.npy"
+
+    @staticmethod
+    def _read_description(source_filename):
+        """
+        :return: the description of the cache of a video if it is still valid, None otherwise
+        """
+        description_path = FrameCache.paths(source_filename)[0]
+        try:
+            stat = os.stat(source_filename)
+            with open(description_path) as f:
+                description = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if description.get("version") != FRAME_CACHE_FORMAT_VERSION or description.get("size") != stat.st_size \
+                or description.get("mtime") != stat.st_mtime:
+            return None
+        return description
+
+    @staticmethod
+    def open(source_filename, width, height, max_bytes, fmt=BGR):
+        """
+        Opens the cache of a video to read and write frames, creating it if there is none or if it is not valid anymore
+        :param width: the width of the frames
+        :param height: the height of the frames
+        :param max_bytes: the maximum size of the cached frames
+        :param fmt: the format of the decoded frames (see frame_format.video_format())
+        :return: a FrameCache, None if max_bytes cannot hold MIN_SLOTS frames
+        """
+        shape = frame_shape(height, width, fmt)
+        frame_bytes = int(np.prod(shape))
+        slots = max_bytes // frame_bytes if frame_bytes > 0 else 0
+        if slots < FrameCache.MIN_SLOTS:
+            return None
+        description_path, frames_path, owners_path = FrameCache.paths(source_filename)
+        description = FrameCache._read_description(source_filename)
+        if description is not None and description["shape"] == list(shape) and description["slots"] == slots:
+            frames = np.memmap(frames_path, np.uint8, "r+", shape=(slots,) + shape)
+            owners = np.load(owners_path, mmap_mode="r+")
+            return FrameCache(frames, owners, True)
+
+        # New files replace the old ones: processes still reading the old ones keep them until they close them
+        os.makedirs(FRAME_CACHE_DIR, exist_ok=True)
+        stat = os.stat(source_filename)
+        owners = np.lib.format.open_memmap(owners_path + ".tmp", "w+", np.int64, (slots,))
+        owners[:] = -1
+        owners.flush()
+        frames = np.memmap(frames_path + ".tmp", np.uint8, "w+", shape=(slots,) + shape)
+        os.replace(owners_path + ".tmp", owners_path)
+        os.replace(frames_path + ".tmp", frames_path)
+        with open(description_path + ".tmp", "w") as f:
+            json.dump({"version": FRAME_CACHE_FORMAT_VERSION, "source": os.path.abspath(source_filename),
+                       "size": stat.st_size, "mtime": stat.st_mtime, "shape": list(shape), "slots": slots}, f)
+        os.replace(description_path + ".tmp", description_path)
+        return FrameCache(frames, owners, True)
+
+    @staticmethod
+    def load(source_filename):
+        """
+        Opens the cache of a video to read frames only
+        :return: a FrameCache, None if the video has no valid cache
+        """
+        description = FrameCache._read_description(source_filename)
+        if description is None:
+            return None
+        _, frames_path, owners_path = FrameCache.paths(source_filename)
+        try:
+            frames = np.memmap(frames_path, np.uint8, "r", shape=(description["slots"],) + tuple(description["shape"]))
+            owners = np.load(owners_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        return FrameCache(frames, owners, False)
+
+    def get(self, index, copy=False):
+        """
+        :param index: the index of the frame
+        :param copy: if False, returns a read-only view of the slot, which remains valid until the frame index + slots
+                     is written into the cache - if True, returns a copy, checking that the slot was not replaced
+                     in the meantime (use it when another process may write into the cache)
+        :return: the frame, None if it is not in the cache
+        """
+        slot = index % self.slots
+        if self.owners[slot] != index:
+            return None
+        frame = self.frames[slot]
+        if copy:
+            frame = frame.copy()
+            if self.owners[slot] != index:
+                return None
+        else:
+            frame = frame.view()
+            frame.flags.writeable = False
+        self.hits += 1
+        return frame
+
+    def put(self, index, frame):
+        """
+        Writes a frame into the cache, replacing the frame that was in its slot
+        Frames which do not have the shape of the cache are ignored
+        :return: the cached frame (see get()), or frame itself if it was not cached
+        """
+        if not self.writable or frame.shape != self.shape:
+            return frame
+        slot = index % self.slots
+        with self.lock:
+            # Readers must never see a partially written frame
+            self.owners[slot] = -1
+            self.frames[slot] = frame
+            self.owners[slot] = index
+        cached = self.frames[slot].view()
+        cached.flags.writeable = False
+        return cached
+
+    def close(self):
+        """
+        Releases the files - views returned by get() keep them open until they are released too
+        """
+        self.frames = None
+        self.owners = None
+
+
+class CachedReader:
+    """
+    Reads the frames of a video in order like a cv2.VideoCapture, taking them from a FrameCache when they are in it
+    The video is only positioned (see frame_index.seek()) when a frame has to be decoded
+    """
+    def __init__(self, cap, cache=None, start_index=0, frame_index=None):
+        """
+        :param cap: the cv2.VideoCapture of the video, positioned on its first frame
+        :param cache: the FrameCache of the video, None to decode every frame
+        :param start_index: the index of the first frame to read
+        :param frame_index: the FrameIndex of the video if it is known, see frame_index.seek()
+        """
+        self.cap = cap
+        self.cache = cache
+        self.index = start_index
+        self.frame_index = frame_index
+        # The index of the frame that the next read() of cap returns, None if unknown
+        self.position = 0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        """
+        :return: (True, frame) for the next frame, (False, None) at the end of the video
+        """
+        frame = None if self.cache is None else self.cache.get(self.index, True)
+        if frame is None:
+            seek(self.cap, self.index, self.frame_index, self.position)
+            ret, frame = self.cap.read()
+            if not ret:
+                self.position = None
+                return False, None
+            self.position = self.index + 1
+        self.index += 1
+        return True, frame
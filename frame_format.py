@@ -0,0 +1,82 @@
+import cv2
+
+# Color frames: (height, width, 3) uint8 arrays, channels in OpenCV's order
+BGR = "BGR"
+# Grayscale frames: (height, width) uint8 arrays
+GRAY = "GRAY"
+
+# Pixel formats of the decoded frames (FourCC of CAP_PROP_CODEC_PIXEL_FORMAT) of 8 bits grayscale videos
+GRAY_PIXEL_FORMATS = {"Y800", "GREY", "Y8  "}
+
+# cvtColor() codes: (from format, to format) => code
+_CONVERSIONS = {
+    (BGR, GRAY): cv2.COLOR_BGR2GRAY,
+    (GRAY, BGR): cv2.COLOR_GRAY2BGR,
+}
+
+
+def format_of(frame):
+    """
+    :return: the format of a frame, BGR or GRAY
+    """
+    return GRAY if frame.ndim == 2 else BGR
+
+
+def frame_shape(height, width, fmt):
+    """
+    :return: the shape of the frames of a given size and format
+    """
+    return (height, width) if fmt == GRAY else (height, width, 3)
+
+
+def shape_as(frame, fmt):
+    """
+    :return: the shape of the frame once converted into another format
+    """
+    return frame_shape(frame.shape[0], frame.shape[1], fmt)
+
+
+def convert(frame, fmt, dst=None):
+    """
+    Converts a frame into a format
+    :param dst: optional image of the converted shape in which the result is written
+    :return: the converted frame, the frame itself if it already is in this format
+    """
+    source = format_of(frame)
+    if source == fmt:
+        return frame
+    return cv2.cvtColor(frame, _CONVERSIONS[(source, fmt)], dst=dst)
+
+
+def to_bgr(frame):
+    """
+    :return: the frame in BGR, e.g. for an encoder that only takes color frames
+    """
+    return convert(frame, BGR)
+
+
+def video_format(cap):
+    """
+    :param cap: an opened cv2.VideoCapture
+    :return: GRAY if the video is in grayscale, BGR otherwise
+    """
+    prop = getattr(cv2, "CAP_PROP_CODEC_PIXEL_FORMAT", None)
+    if prop is None:
+        # Older OpenCV versions do not tell
+        return BGR
+    code = int(cap.get(prop))
+    fourcc = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+    return GRAY if fourcc in GRAY_PIXEL_FORMATS else BGR
+
+
+def open_video(filename):
+    """
+    Opens a video like cv2.VideoCapture(), except that grayscale videos are decoded into GRAY frames instead of
+    being expanded into 3 identical channels, so that the filters only process a single channel
+    :return: the cv2.VideoCapture
+    """
+    cap = cv2.VideoCapture(filename)
+    if cap.isOpened() and video_format(cap) == GRAY:
+        # Without the conversion to BGR, FFmpeg decodes grayscale videos into single channel frames
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    return cap
@@ -0,0 +1,164 @@
+import bisect
+import hashlib
+import json
+import os
+import cv2
+
+# Version of the index files, increased on incompatible changes
+INDEX_FORMAT_VERSION = 1
+# Indexes that cannot be written next to their video are written into this directory
+INDEX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".video_filter_index")
+
+
+class FrameIndex:
+    """
+    The keyframes and timestamps of all the frames of a video, used to seek to any frame quickly:
+    seeking forward within the same group of pictures only grabs the frames in between, instead of seeking back
+    to the keyframe and decoding all the frames from there.
+    The index is built once by reading the packets of the video without decoding them (see build()),
+    and saved into a file next to the video (see save() and load()).
+
+    Attributes
+    ----------
+    frame_count : int
+        the number of frames of the video
+    fps : float
+        the frame rate of the video
+    keyframes : [int]
+        the indexes of the keyframes, in increasing order - frame 0 is always considered as a keyframe
+    timestamps : [float]
+        the presentation time of each frame, in milliseconds
+    """
+    def __init__(self, frame_count, fps, keyframes, timestamps):
+        self.frame_count = frame_count
+        self.fps = fps
+        self.keyframes = keyframes
+        self.timestamps = timestamps
+
+    def keyframe_before(self, index):
+        """
+        :return: the index of the last keyframe at or before the frame index
+        """
+        i = bisect.bisect_right(self.keyframes, index) - 1
+        return self.keyframes[i] if i >= 0 else 0
+
+    def seek(self, cap, index, position=None):
+        """
+        Positions an opened video so that its next read() returns the frame index
+        When the video is already positioned before the frame and there is no keyframe in between, the frames are
+        only grabbed: a real seek would decode them anyway, from the keyframe
+        :param cap: a cv2.VideoCapture of the indexed video
+        :param index: the index of the frame
+        :param position: the index of the frame that the next read() of cap would return, if known
+        """
+        if position is not None and position <= index and self.keyframe_before(index) <= position:
+            for _ in range(index - position):
+                if not cap.grab():
+                    break
+        else:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+
+    @staticmethod
+    def build(source_filename, stop_event=None):
+        """
+        Reads all the packets of a video without decoding them
+        :param source_filename: path of the video
+        :param stop_event: optional threading.Event stopping the build when set
+        :return: a FrameIndex, None if the build was stopped or the video cannot be read packet by packet
+        """
+        cap = cv2.VideoCapture(source_filename, cv2.CAP_FFMPEG)
+        try:
+            # Raw packets: grab() only reads the next packet, the keyframe flag is then available
+            if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+                return None
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            keyframes = []
+            timestamps = []
+            while cap.grab():
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) or not timestamps:
+                    keyframes.append(len(timestamps))
+                timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+            return FrameIndex(len(timestamps), fps, keyframes, timestamps)
+        finally:
+            cap.release()
+
+    @staticmethod
+    def index_paths(source_filename):
+        """
+        :return: the paths where the index of a video may be saved: next to the video, and in INDEX_CACHE_DIR
+        """
+        source_filename = os.path.abspath(source_filename)
+        name = hashlib.sha1(source_filename.encode("utf-8")).hexdigest() + ".json"
+        return [source_filename + ".index.json", os.path.join(INDEX_CACHE_DIR, name)]
+
+    def save(self, source_filename):
+        """
+        Saves the index next to the video, or into INDEX_CACHE_DIR if the video's directory is not writable
+        The size and modification time of the video are saved too, so that a modified video is indexed again
+        :return: the path of the saved index
+        """
+        stat = os.stat(source_filename)
+        data = {"version": INDEX_FORMAT_VERSION, "size": stat.st_size, "mtime": stat.st_mtime,
+                "frame_count": self.frame_count, "fps": self.fps,
+                "keyframes": self.keyframes, "timestamps": self.timestamps}
+        for path in FrameIndex.index_paths(source_filename):
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as f:
+                    json.dump(data, f)
+                return path
+            except OSError:
+                continue
+        raise OSError("Cannot save the index of " + source_filename)
+
+    @staticmethod
+    def load(source_filename):
+        """
+        :return: the saved index of a video, None if there is none or if the video changed since it was saved
+        """
+        try:
+            stat = os.stat(source_filename)
+        except OSError:
+            return None
+        for path in FrameIndex.index_paths(source_filename):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get("version") != INDEX_FORMAT_VERSION or data.get("size") != stat.st_size \
+                    or data.get("mtime") != stat.st_mtime:
+                continue
+            return FrameIndex(data["frame_count"], data["fps"], data["keyframes"], data["timestamps"])
+        return None
+
+    @staticmethod
+    def load_or_build(source_filename, stop_event=None):
+        """
+        :return: the saved index of a video, or a new one which is then saved - None if it cannot be built
+        """
+        index = FrameIndex.load(source_filename)
+        if index is None:
+            index = FrameIndex.build(source_filename, stop_event)
+            if index is not None:
+                try:
+                    index.save(source_filename)
+                except OSError as e:
+                    print("Could not save the index: " + str(e))
+        return index
+
+
+def seek(cap, index, frame_index=None, position=None):
+    """
+    Positions an opened video so that its next read() returns the frame index
+    :param cap: a cv2.VideoCapture
+    :param index: the index of the frame
+    :param frame_index: the FrameIndex of the video if there is one, otherwise OpenCV seeks on its own
+    :param position: the index of the frame that the next read() of cap would return, if known
+    """
+    if frame_index is not None:
+        frame_index.seek(cap, index, position)
+    elif index != position:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
@@ -0,0 +1,106 @@
+import os
+import queue
+from multiprocessing import shared_memory
+import numpy as np
+
+# Where shared memory lives on Linux: a pool larger than the free space there would crash the processes writing
+# into it (SIGBUS) instead of failing when it is created
+SHM_DIR = "/dev/shm"
+
+
+class SharedFramePool:
+    """
+    A fixed number of frame slots in shared memory, so that frames are handed from process to process by sending
+    the number of their slot instead of pickling them through a queue.
+    The process that creates the pool hands out free slots with acquire(), which blocks while all slots are busy:
+    this is the back-pressure that keeps a fast reader from running ahead of the filtering processes.
+    A slot is given back with release() once its frame has been consumed.
+    The pool is sent to the other processes with their arguments, they only use frame().
+
+    Attributes
+    ----------
+    slots : int
+        the number of frames that the pool holds
+    shape : tuple
+        the shape of the frames (height, width, 3), or (height, width) for grayscale frames
+    """
+    # How long (in seconds) acquire() waits for a slot before checking whether it should stop
+    POLL_TIMEOUT = 0.2
+
+    def __init__(self, slots, shape):
+        """
+        :param slots: the number of frames that the pool holds
+        :param shape: the shape of the frames (height, width, 3) or (height, width) - uint8
+        """
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.frame_bytes = int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, slots * self.frame_bytes))
+        # Other processes get a copy of the pool: only the process that created it frees the memory
+        self.owner_pid = os.getpid()
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def __getstate__(self):
+        # Other processes attach to the same memory, they never hand out slots
+        return {"name": self.shm.name, "slots": self.slots, "shape": self.shape}
+
+    def __setstate__(self, state):
+        self.slots = state["slots"]
+        self.shape = state["shape"]
+        self.frame_bytes = int(np.prod(self.shape))
+        # Processes started by multiprocessing share the resource tracker of their parent, which frees the memory
+        # if the creator could not
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self.owner_pid = None
+        self.free = None
+
+    @staticmethod
+    def max_slots(shape):
+        """
+        :param shape: the shape of the frames
+        :return: the maximum number of slots of a pool that fits in the free shared memory, None if unknown
+        """
+        try:
+            stat = os.statvfs(SHM_DIR)
+        except (OSError, AttributeError):
+            return None
+        # Leave some room for the other users of the shared memory
+        return stat.f_bavail * stat.f_frsize // 2 // int(np.prod(shape))
+
+    def frame(self, slot, shape=None):
+        """
+        :param shape: the shape of the frame, defaults to the shape of the pool - a smaller frame (e.g. in grayscale)
+                      can also be kept in a slot
+        :return: the frame of a slot, a numpy array backed by the shared memory
+        """
+        return np.ndarray(self.shape if shape is None else shape, np.uint8, self.shm.buf, slot * self.frame_bytes)
+
+    def acquire(self, stop_event=None):
+        """
+        Waits for a free slot
+        :param stop_event: optional threading.Event stopping the wait when set
+        :return: the number of the slot, None if stop_event was set
+        """
+        while stop_event is None or not stop_event.is_set():
+            try:
+                return self.free.get(timeout=self.POLL_TIMEOUT)
+            except queue.Empty:
+                pass
+        return None
+
+    def release(self, slot):
+        """
+        Gives a slot back to the pool once its frame is not needed anymore
+        """
+        self.free.put(slot)
+
+    def close(self):
+        """
+        Detaches from the shared memory, which is freed by the process that created the pool
+        All the arrays returned by frame() must have been released before
+        """
+        self.shm.close()
+        if self.owner_pid == os.getpid():
+            self.shm.unlink()
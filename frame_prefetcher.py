@@ -0,0 +1,164 @@
+import collections
+import threading
+import time
+import cv2
+
+from frame_format import open_video
+from frame_index import seek
+
+class FramePrefetcher:
+    """
+    Decodes a video in a background thread and keeps a bounded ring of upcoming frames ready,
+    so that the player only has to filter and display frames
+
+    Attributes
+    ----------
+    fps : float
+        the frame rate of the video
+    depth : int
+        the maximum number of decoded frames waiting to be read
+    underruns : int
+        number of times a frame was requested while none was decoded yet, i.e. decoding is the bottleneck
+    decoded : int
+        number of frames decoded so far
+    dropped : int
+        number of frames skipped because they were already late, see skip_to()
+    cached : int
+        number of frames read from the frame cache instead of being decoded
+    """
+    def __init__(self, source_filename, depth=8, profiler=None, start_index=0, frame_index=None, cache=None):
+        """
+        :param source_filename: path of the video
+        :param depth: the maximum number of decoded frames waiting to be read
+        :param profiler: optional Profiler recording the time spent decoding each frame ("decode")
+        :param start_index: the index of the first frame to decode
+        :param frame_index: the FrameIndex of the video if it is known, used to seek to start_index faster
+        :param cache: optional FrameCache of the video: frames in it are not decoded, the others are written into it
+        """
+        # Grayscale videos are decoded into GRAY frames
+        self.cap = open_video(source_filename)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.depth = depth
+        self.underruns = 0
+        self.decoded = 0
+        self.dropped = 0
+        self.cached = 0
+        self.cache = cache
+        self.profiler = profiler
+        self.frame_index = frame_index
+        # Index of the next frame that the decoding thread will read - it seeks there when it starts
+        self.next_index = start_index
+        # Frames before this index are not needed anymore: they are grabbed without being decoded
+        self.skip_target = start_index
+        # Decoded frames waiting to be read: (index, frame)
+        self.frames = collections.deque()
+        # Signals both "a frame is available" and "some room is available" - there is only one reader and one writer
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.end_reached = False
+        self.thread = threading.Thread(target=self._decode, daemon=True)
+
+    def start(self):
+        """
+        Starts decoding frames in the background
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the decoding thread and releases the video
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.cap.release()
+
+    def _decode(self):
+        """
+        Body of the decoding thread
+        """
+        # The index of the frame that the next read() of the capture returns, None if unknown: frames taken from
+        # the cache are not read from the capture, which is only positioned when a frame has to be decoded.
+        # Seeking may take a while on long groups of pictures: it is done here rather than in the UI thread
+        position = 0
+        while True:
+            with self.condition:
+                while len(self.frames) >= self.depth and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                index = self.next_index
+                skip = index < self.skip_target
+            # Decode without holding the lock so that the reader is never blocked by decoding
+            frame = None if skip or self.cache is None else self.cache.get(index)
+            if not self.cap.isOpened():
+                ret = False
+            elif skip:
+                # Late frame: only grab it, which is much cheaper than decoding it
+                seek(self.cap, index, self.frame_index, position)
+                ret = self.cap.grab()
+                position = index + 1 if ret else None
+            elif frame is not None:
+                ret = True
+                self.cached += 1
+            else:
+                start = time.perf_counter()
+                seek(self.cap, index, self.frame_index, position)
+                ret, frame = self.cap.read()
+                position = index + 1 if ret else None
+                if ret and self.profiler is not None:
+                    self.profiler.record("decode", time.perf_counter() - start)
+                if ret and self.cache is not None:
+                    frame = self.cache.put(index, frame)
+            with self.condition:
+                if not ret:
+                    self.end_reached = True
+                    return
+                if skip:
+                    self.dropped += 1
+                else:
+                    self.frames.append((self.next_index, frame))
+                    self.decoded += 1
+                self.next_index += 1
+                self.condition.notify_all()
+
+    def skip_to(self, index):
+        """
+        Declares that frames before index will never be shown: those already decoded are dropped
+        and the others are skipped by the decoding thread without being decoded
+        :param index: the index of the first frame that is still needed
+        """
+        with self.condition:
+            self.skip_target = max(self.skip_target, index)
+            while self.frames and self.frames[0][0] < self.skip_target:
+                self.frames.popleft()
+                self.dropped += 1
+            self.condition.notify_all()
+
+    def read(self, max_index=None):
+        """
+        Returns the next frame without waiting
+        :param max_index: if set, a frame with a higher index is not returned yet (it is too early to show it)
+        :return: (index, frame) for the next frame, or None if no frame is ready
+                 see finished to know whether it is the end of the video
+        """
+        with self.condition:
+            if not self.frames:
+                if not self.end_reached:
+                    self.underruns += 1
+                return None
+            if max_index is not None and self.frames[0][0] > max_index:
+                return None
+            item = self.frames.popleft()
+            self.condition.notify_all()
+            return item
+
+    @property
+    def finished(self):
+        """
+        :return: True if all the frames of the video have been decoded and read
+        """
+        with self.condition:
+            return self.end_reached and not self.frames
@@ -0,0 +1,546 @@
+import collections
+import concurrent.futures
+import time
+import cv2
+import numpy as np
+
+from frame_format import BGR, GRAY, convert, format_of, shape_as
+
+
+def _as_table(lut):
+    """
+    :return: the lookup table as a 256x3 uint8 array (one column per channel)
+    """
+    lut = np.asarray(lut, dtype=np.uint8)
+    if lut.size == 256:
+        return np.repeat(lut.reshape(256, 1), 3, axis=1)
+    return lut.reshape(256, 3)
+
+
+def _compose(first, then):
+    """
+    :return: the lookup table equivalent to applying first and then then
+    """
+    if first is None:
+        return then
+    return np.stack([then[first[:, c], c] for c in range(3)], axis=1)
+
+
+def _is_uniform(table):
+    """
+    :return: True if the table is the same for all channels (so that it can be applied to a single channel)
+    """
+    return table is None or bool((table == table[:, :1]).all())
+
+
+def _apply_table(frame, table, out=None):
+    """
+    Applies a 256x3 lookup table to a frame with cv2.LUT()
+    :param out: optional image with the shape of the frame in which the result is written, which can be the frame
+    :return: the result (out if it was given)
+    """
+    if not _is_uniform(table):
+        return cv2.LUT(frame, table.reshape(256, 1, 3), dst=out)
+    lut = np.ascontiguousarray(table[:, 0])
+    if frame.flags.c_contiguous and (out is None or out.flags.c_contiguous):
+        # cv2.LUT() is faster with a single table on a single channel: see the frame as one wide channel
+        wide = frame.reshape(frame.shape[0], -1)
+        result = cv2.LUT(wide, lut, dst=None if out is None else out.reshape(wide.shape))
+        return result.reshape(frame.shape) if out is None else out
+    return cv2.LUT(frame, lut, dst=out)
+
+
+def _apply_stacked(process, frames, buffers=None):
+    """
+    Applies a point-wise stage to a block of frames (N x height x width...) in a single pass, on the frames stacked
+    into one tall image
+    :param process: the process() method of the stage
+    :return: the processed block
+    """
+    count, height = frames.shape[:2]
+    tall = np.ascontiguousarray(frames).reshape((count * height,) + frames.shape[2:])
+    result = process(tall, buffers)
+    return result.reshape((count, height) + result.shape[1:])
+
+
+class FrameBuffers:
+    """
+    Pre-allocated frames reused from one frame to the next: two buffers per frame shape, so that a stage
+    can always write into the buffer that does not hold its input (ping-pong)
+    """
+    def __init__(self):
+        # (shape, dtype) => [buffer, buffer]
+        self.buffers = {}
+
+    def get(self, frame, shape=None):
+        """
+        :param shape: the shape of the buffer, defaults to the shape of the frame (see frame_format.shape_as())
+        :return: a buffer with this shape and the type of frame, which does not share the memory of frame
+        """
+        shape = frame.shape if shape is None else tuple(shape)
+        key = (shape, frame.dtype.str)
+        pair = self.buffers.get(key)
+        if pair is None:
+            pair = [np.empty(shape, frame.dtype), np.empty(shape, frame.dtype)]
+            self.buffers[key] = pair
+        return pair[1] if np.may_share_memory(pair[0], frame) else pair[0]
+
+
+class PrefixCache:
+    """
+    Keeps the output of the stages of pipelines for some frames, so that changing the parameters of a filter
+    only recomputes the stages from this filter onwards (see Pipeline.process()).
+    The least recently used outputs are dropped when the total size of the frames exceeds a limit.
+    """
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: the maximum total size of the kept frames
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key => frame, from the least to the most recently used
+        self.frames = collections.OrderedDict()
+
+    def get(self, key):
+        """
+        :return: the frame kept for this key, which must not be modified, or None
+        """
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.frames.move_to_end(key)
+        return frame
+
+    def put(self, key, frame):
+        """
+        Keeps a copy of the frame for this key
+        """
+        if frame.nbytes > self.max_bytes:
+            return
+        old = self.frames.pop(key, None)
+        if old is not None:
+            self.size -= old.nbytes
+        self.frames[key] = frame.copy()
+        self.size += frame.nbytes
+        while self.size > self.max_bytes:
+            _, dropped = self.frames.popitem(last=False)
+            self.size -= dropped.nbytes
+
+    def clear(self):
+        self.frames.clear()
+        self.size = 0
+
+
+class TilePool:
+    """
+    Applies a stage to horizontal strips of a frame in a pool of threads, so that all cores work on a single frame:
+    most OpenCV functions release the GIL. Each strip is computed from its rows plus the halo rows above and below it
+    (see Filter.get_halo()) and written into its rows of the output frame, so that the result is exactly the same as
+    applying the stage to the whole frame.
+    """
+    # Frames are not split into strips smaller than this number of rows: the threads would cost more than they save
+    MIN_STRIP_ROWS = 64
+
+    def __init__(self, threads):
+        """
+        :param threads: the number of threads, i.e. the maximum number of strips of a frame
+        """
+        self.threads = threads
+        # Created on first use, and again after close()
+        self.executor = None
+
+    def strips(self, rows, halo):
+        """
+        :param rows: the height of the frame
+        :param halo: the halo of the stage
+        :return: the (first, last + 1) rows of each strip, fewer than 2 strips if the frame is not worth splitting
+        """
+        # The halo is computed twice for every strip boundary: strips must be large compared to it
+        count = min(self.threads, rows // max(self.MIN_STRIP_ROWS, 4 * halo))
+        if count < 2:
+            return []
+        bounds = [rows * i // count for i in range(count + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def process(self, stage, frame, buffers=None):
+        """
+        Applies a tile-safe stage (whose halo is not None) to a frame
+        :param buffers: optional FrameBuffers in which the result is written
+        :return: the filtered frame, None if the frame is too small to be split (the stage was not applied)
+        """
+        strips = self.strips(frame.shape[0], stage.halo)
+        if not strips:
+            return None
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.threads, thread_name_prefix="tile")
+        shape = shape_as(frame, stage.format)
+        out = np.empty(shape, frame.dtype) if buffers is None else buffers.get(frame, shape)
+        # Waits for all strips, and raises the exception of a strip that failed
+        for _ in self.executor.map(lambda strip: stage.process_strip(frame, out, *strip), strips):
+            pass
+        return out
+
+    def close(self):
+        """
+        Stops the threads
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def _apply_filter(filter, frame, buffers):
+    """
+    Applies a filter instance, writing the result into a pre-allocated buffer if the filter supports it
+    """
+    if buffers is not None and filter.supports_out:
+        return filter.process(frame, buffers.get(frame, shape_as(frame, filter.output_format or format_of(frame))))
+    return filter.process(frame)
+
+
+class ConvertStage:
+    """
+    A stage of the pipeline converting frames into the format of the next filter, see Filter.formats
+    """
+    def __init__(self, input_format, output_format):
+        self.input_format = input_format
+        # The format of the frames returned by the stage
+        self.format = output_format
+        # No chain entry is applied by this stage
+        self.uids = []
+        self.halo = 0
+
+    def name(self):
+        return self.input_format + " to " + self.format
+
+    def process(self, frame, buffers=None):
+        dst = None if buffers is None else buffers.get(frame, shape_as(frame, self.format))
+        return convert(frame, self.format, dst)
+
+    def process_batch(self, frames, buffers=None):
+        return _apply_stacked(self.process, frames, buffers)
+
+    def process_strip(self, frame, out, start, end):
+        """
+        Converts the rows start to end (excluded) of frame into the same rows of out, see TilePool
+        """
+        convert(frame[start:end], self.format, out[start:end])
+
+
+class FilterStage:
+    """
+    A stage of the pipeline applying a single filter
+    """
+    def __init__(self, filter, uid=None, input_format=BGR):
+        # The configured instance of the filter
+        self.filter = filter
+        # The uids of the chain entries applied by this stage
+        self.uids = [uid]
+        # The format of the frames returned by the stage
+        self.format = filter.output_format or input_format
+        # The rows needed around a strip to apply it in strips (see TilePool), None if it must see the whole frame
+        self.halo = None if filter.is_stateful(filter.params) else filter.get_halo(filter.params)
+
+    def name(self):
+        return self.filter.get_filter_name()
+
+    def process(self, frame, buffers=None):
+        return _apply_filter(self.filter, frame, buffers)
+
+    def process_batch(self, frames, buffers=None):
+        """
+        Applies the filter to a block of frames, see Filter.process_batch()
+        """
+        if buffers is None or not self.filter.supports_out:
+            return self.filter.process_batch(frames)
+        shape = (len(frames),) + shape_as(frames[0], self.format)
+        return self.filter.process_batch(frames, buffers.get(frames, shape))
+
+    def process_strip(self, frame, out, start, end):
+        """
+        Filters the rows start to end (excluded) of frame into the same rows of out - called from TilePool's threads
+        """
+        top = max(0, start - self.halo)
+        bottom = min(frame.shape[0], end + self.halo)
+        if top == start and bottom == end and self.filter.supports_out:
+            # No halo: the filter can write its rows directly
+            self.filter.process(frame[start:end], out[start:end])
+        else:
+            out[start:end] = self.filter.process(frame[top:bottom])[start - top:end - top]
+
+
+class LutStage:
+    """
+    A stage of the pipeline merging consecutive point-wise filters (see Filter.get_lut()):
+    all tables are composed into a single one when the stage is built, which is applied with cv2.LUT().
+    A grayscale conversion (Filter.to_gray) can also be part of the stage, the tables that follow it are
+    then applied to the single grayscale channel, and the stage returns GRAY frames: Luminosity -> Grayscale ->
+    Luminosity goes through the color frame once (table and conversion), and then once through the gray one.
+    """
+    def __init__(self, input_format=BGR):
+        # The merged filters (configured instances)
+        self.filters = []
+        # Table applied to the frame as it comes, None for identity
+        self.pre = None
+        # Whether the frame is converted from BGR to grayscale after the pre table
+        self.gray = False
+        # Table applied after the grayscale conversion, None for identity
+        self.post = None
+        self.input_format = input_format
+        # The format of the frames returned by the stage, with the filters merged so far
+        self.format = input_format
+        # The uids of the chain entries merged into this stage
+        self.uids = []
+        # All the merged filters are point-wise: the stage can be applied in strips without any halo (see TilePool)
+        self.halo = 0
+
+    def name(self):
+        return " + ".join(filter.get_filter_name() for filter in self.filters)
+
+    def accepts(self, filter):
+        """
+        :return: True if the configured filter can be merged into this stage
+        """
+        if self.format not in filter.formats:
+            return False
+        if filter.to_gray:
+            # A grayscale conversion of a grayscale frame does nothing
+            return True
+        lut = filter.get_lut(filter.params)
+        # A single channel can only be transformed by a table that is the same for all channels
+        return lut is not None and (self.format == BGR or _is_uniform(_as_table(lut)))
+
+    def add(self, filter, uid=None):
+        self.filters.append(filter)
+        self.uids.append(uid)
+        if filter.to_gray:
+            if self.format == BGR:
+                self.gray = True
+                self.format = GRAY
+        elif self.gray:
+            self.post = _compose(self.post, _as_table(filter.get_lut(filter.params)))
+        else:
+            self.pre = _compose(self.pre, _as_table(filter.get_lut(filter.params)))
+
+    def process(self, frame, buffers=None):
+        if self.pre is not None:
+            frame = _apply_table(frame, self.pre, None if buffers is None else buffers.get(frame))
+        if not self.gray:
+            return frame
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY,
+                            dst=None if buffers is None else buffers.get(frame, shape_as(frame, GRAY)))
+        if self.post is None:
+            return gray
+        # In place: the converted frame is not needed anymore
+        return _apply_table(gray, self.post, gray)
+
+    def process_batch(self, frames, buffers=None):
+        # All the merged filters are point-wise
+        return _apply_stacked(self.process, frames, buffers)
+
+    def process_strip(self, frame, out, start, end):
+        """
+        Applies the stage to the rows start to end (excluded) of frame into the same rows of out, see TilePool
+        """
+        out[start:end] = self.process(frame[start:end])
+
+
+class Pipeline:
+    """
+    A FilterChain compiled into a list of stages ready to be applied to frames.
+    A pipeline is built for a given snapshot of the chain: it must be rebuilt when the chain changes.
+    It applies its own instances of the filters (see Filter), which must be released with close().
+
+    Attributes
+    ----------
+    chain : FilterChain
+        the snapshot that this pipeline applies
+    scale : (float, float) or None
+        when set, the horizontal and vertical ratios between the size of the frames and the original video,
+        used to scale the parameters (see Filter.scale_params())
+    input_format : str
+        the format of the frames (see frame_format.py) for which the stages are compiled, see compile()
+    output_format : str
+        the format of the frames returned by process()
+    stages : list of FilterStage / LutStage / ConvertStage
+    keys : list of str
+        the name of each stage for a Profiler, e.g. "2. Luminosity + Grayscale"
+    buffers : FrameBuffers or None
+        the frames reused by the filters that support it (see Filter.supports_out), None to always allocate new frames
+    instances : {uid => Filter}
+        the configured instance of each filter of the chain, by uid of its entry
+    prefix_keys : list
+        for each stage, a key describing the stage and all the stages before it (filters and parameters)
+        for a PrefixCache, None if the output of the stage cannot be cached because a stateful filter
+        (see Filter.is_stateful()) is applied by this stage or before
+    tiles : TilePool or None
+        the threads applying the tile-safe stages (see Filter.get_halo()) in strips, None to apply them in one piece
+    """
+    def __init__(self, chain, scale=None, reuse_buffers=True, instances=None, tiles=None, input_format=BGR):
+        """
+        :param chain: the FilterChain to apply
+        :param scale: see the scale attribute
+        :param reuse_buffers: if True, filters write into pre-allocated buffers that are reused for every frame:
+                              the frame returned by process() is then only valid until the next call
+        :param instances: the instances of another pipeline, e.g. for a previous snapshot of the same chain, to
+                          take over instead of creating new ones: they are only configured again if their
+                          parameters changed, and stateful filters go on from where they were.
+                          The other pipeline must not be used anymore, see close()
+        :param tiles: see the tiles attribute - it is not closed with the pipeline and can be shared by pipelines
+                      used by the same thread
+        :param input_format: the format of the frames that will be given to process(), see compile()
+        """
+        self.chain = chain
+        self.scale = scale
+        self.tiles = tiles
+        self.buffers = FrameBuffers() if reuse_buffers else None
+        self.instances = {}
+        for entry in chain:
+            vals = entry.vals if scale is None else entry.filter.scale_params(entry.vals, *scale)
+            filter = instances.get(entry.uid) if instances is not None else None
+            if filter is None:
+                filter = entry.filter()
+            if filter.params != vals:
+                filter.configure(vals)
+            self.instances[entry.uid] = filter
+        self.compile(input_format)
+
+    def compile(self, input_format):
+        """
+        Builds the stages applying the filters to frames of a given format: frames are only converted into another
+        format (see ConvertStage) before a filter that does not accept their current format (see Filter.formats).
+        process() compiles the stages again when it is given a frame in another format.
+        """
+        stages = []
+        fmt = input_format
+        # The description of the filters applied so far, and whether one of them is stateful
+        prefix = (self.scale, input_format)
+        stateful = False
+        # For each stage, the prefix after its last filter
+        prefixes = []
+        for entry in self.chain:
+            filter = self.instances[entry.uid]
+            if fmt not in filter.formats:
+                stages.append(ConvertStage(fmt, filter.formats[0]))
+                prefixes.append(prefix)
+                fmt = filter.formats[0]
+            stateful = stateful or filter.is_stateful(filter.params)
+            prefix = None if stateful else prefix + ((entry.filter, tuple(sorted(filter.params.items()))),)
+            last = stages[-1] if stages else None
+            if isinstance(last, LutStage) and last.accepts(filter):
+                last.add(filter, entry.uid)
+                prefixes[-1] = prefix
+            else:
+                stage = LutStage(fmt)
+                if stage.accepts(filter):
+                    stage.add(filter, entry.uid)
+                else:
+                    stage = FilterStage(filter, entry.uid, fmt)
+                stages.append(stage)
+                prefixes.append(prefix)
+            fmt = stages[-1].format
+        # There is nothing to gain with a stage that contains a single filter
+        for i, stage in enumerate(stages):
+            if isinstance(stage, LutStage) and len(stage.filters) == 1:
+                stages[i] = FilterStage(stage.filters[0], stage.uids[0], stage.input_format)
+        # The attributes are replaced, never modified: other threads may read them while frames are processed
+        self.input_format = input_format
+        self.output_format = fmt
+        self.prefix_keys = prefixes
+        self.stages = stages
+        self.keys = [str(i + 1) + ". " + stage.name() for i, stage in enumerate(stages)]
+
+    @property
+    def stateful(self):
+        """
+        :return: True if some filters keep a state from one frame to the next, frames must then be given in order
+        """
+        return any(filter.is_stateful(filter.params) for filter in self.instances.values())
+
+    def close(self, keep=None):
+        """
+        Releases the instances of the filters
+        :param keep: the instances taken over by another pipeline {uid => Filter}, which are not released
+        """
+        for uid, filter in self.instances.items():
+            if keep is None or keep.get(uid) is not filter:
+                filter.close()
+        self.instances = {}
+
+    def apply_stage(self, i, frame):
+        """
+        :return: the output of stage i for the frame, computed in strips when possible
+        """
+        stage = self.stages[i]
+        if self.tiles is not None and stage.halo is not None:
+            out = self.tiles.process(stage, frame, self.buffers)
+            if out is not None:
+                return out
+        return stage.process(frame, self.buffers)
+
+    def stage_of(self, uid):
+        """
+        :return: the index of the stage applying the chain entry with the given uid, None if there is none
+        """
+        for i, stage in enumerate(self.stages):
+            if uid in stage.uids:
+                return i
+        return None
+
+    def process(self, frame, profiler=None, cache=None, frame_id=None):
+        """
+        Applies all stages to the frame
+        :param frame: the source image, which is never modified - in any format (see frame_format.py)
+        :param profiler: optional Profiler recording the duration of each stage under its key (see keys)
+        :param cache: optional PrefixCache: the stages whose output is already in the cache for this frame
+                      are skipped, and the output of the other stages is added to it
+        :param frame_id: with a cache, a hashable value identifying the source image
+        :return: the filtered image, in output_format - when reusing buffers, it is overwritten by the next call,
+                 copy it to keep it. It may also come from the cache, or be the source image: it must not be modified.
+        """
+        if format_of(frame) != self.input_format:
+            self.compile(format_of(frame))
+        first = 0
+        if cache is not None:
+            # Start after the last stage whose output is known
+            for i in range(len(self.stages) - 1, -1, -1):
+                if self.prefix_keys[i] is not None:
+                    cached = cache.get((frame_id, self.prefix_keys[i]))
+                    if cached is not None:
+                        frame = cached
+                        first = i + 1
+                        break
+        if profiler is None and cache is None:
+            for i in range(len(self.stages)):
+                frame = self.apply_stage(i, frame)
+            return frame
+        for i in range(first, len(self.stages)):
+            start = time.perf_counter()
+            frame = self.apply_stage(i, frame)
+            if profiler is not None:
+                profiler.record(self.keys[i], time.perf_counter() - start)
+            if cache is not None and self.prefix_keys[i] is not None:
+                cache.put((frame_id, self.prefix_keys[i]), frame)
+        return frame
+
+    def process_batch(self, frames, profiler=None):
+        """
+        Applies all stages to a block of consecutive frames at once: filters that support it process the whole block
+        in a few calls (see Filter.apply_batch()), point-wise stages see it as a single tall image, and the others
+        filter the frames one by one
+        :param frames: the source images as a single contiguous array (N x height x width x 3 for BGR frames,
+                       N x height x width for GRAY ones), which is never modified
+        :param profiler: optional Profiler recording the duration of each stage per frame (see process())
+        :return: the filtered images as a single array, see process() for how long it is valid
+        """
+        fmt = format_of(frames[0])
+        if fmt != self.input_format:
+            self.compile(fmt)
+        for i, stage in enumerate(self.stages):
+            start = time.perf_counter()
+            frames = stage.process_batch(frames, self.buffers)
+            if profiler is not None:
+                # Recorded per frame, so that the statistics can be compared with those of process()
+                seconds = (time.perf_counter() - start) / len(frames)
+                for _ in range(len(frames)):
+                    profiler.record(self.keys[i], seconds)
+        return frames
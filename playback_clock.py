@@ -0,0 +1,58 @@
+import collections
+import time
+
+
+class PlaybackClock:
+    """
+    A presentation clock telling which frame should be on screen at any time, so that playback follows
+    wall-clock time even when filtering is slower than the frame rate.
+    It also measures the effective number of frames shown per second.
+    """
+    # Duration (in seconds) over which the effective frame rate is measured
+    FPS_WINDOW = 1.0
+
+    def __init__(self, fps, first_index=0):
+        """
+        :param fps: the frame rate of the video
+        :param first_index: the index of the frame shown when the clock starts
+        """
+        self.fps = fps
+        self.first_index = first_index
+        self.start_time = time.monotonic()
+        # Time at which the clock was paused, None if it is running
+        self.paused_at = None
+        # Times at which the last frames were shown
+        self.shown_times = collections.deque()
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = time.monotonic()
+
+    def resume(self):
+        if self.paused_at is not None:
+            # Shift the start so that the clock continues from where it was paused
+            self.start_time += time.monotonic() - self.paused_at
+            self.paused_at = None
+            self.shown_times.clear()
+
+    def due_index(self):
+        """
+        :return: the index of the frame that should be shown now
+        """
+        now = self.paused_at if self.paused_at is not None else time.monotonic()
+        return self.first_index + int((now - self.start_time) * self.fps)
+
+    def frame_shown(self):
+        """
+        Records that a frame was just shown, for the effective frame rate
+        """
+        now = time.monotonic()
+        self.shown_times.append(now)
+        while self.shown_times and self.shown_times[0] < now - self.FPS_WINDOW:
+            self.shown_times.popleft()
+
+    def effective_fps(self):
+        """
+        :return: the number of frames shown per second over the last FPS_WINDOW seconds
+        """
+        return len(self.shown_times) / self.FPS_WINDOW
@@ -0,0 +1,97 @@
+import threading
+import time
+import traceback
+from PyQt5 import QtCore, QtGui
+
+from render_pipeline import PreviewPipeline
+
+
+class PreviewRenderer(QtCore.QObject):
+    """
+    Filters the frames shown in the video widget in its own thread so that the UI is never blocked.
+    Only the most recent request is rendered: requests made while a frame is being rendered replace each other,
+    e.g. when dragging a slider fires many changes, only the last position is rendered once the current frame is done.
+    The rendered images are sent back with the rendered signal, the requests that could not be rendered (a filter
+    raised an exception) with the failed signal.
+    """
+    # The rendered image and the number of the request (see request())
+    rendered = QtCore.pyqtSignal(QtGui.QImage, int)
+    # The number of a request that could not be rendered
+    failed = QtCore.pyqtSignal(int)
+    # Internal: wakes the rendering thread up
+    requested = QtCore.pyqtSignal()
+
+    def __init__(self, size, cache_bytes=0, profiler=None, tile_threads=0):
+        """
+        :param size: the display size (width, height)
+        :param cache_bytes: see PreviewPipeline
+        :param profiler: optional Profiler recording the duration of each stage and of the conversion to a QImage
+        :param tile_threads: see PreviewPipeline
+        """
+        super().__init__()
+        # Only used by the rendering thread
+        self.preview = PreviewPipeline(size, cache_bytes, tile_threads)
+        self.profiler = profiler
+        self.lock = threading.Lock()
+        # The request waiting to be rendered, None if there is none
+        self.pending = None
+        # Number of requests replaced by a newer one before being rendered
+        self.skipped = 0
+        # Number of the last request
+        self.requests = 0
+        self.requested.connect(self.render_pending)
+
+    def request(self, frame, chain, fast, frame_id=None):
+        """
+        Asks for a frame to be rendered, replacing the previous request if it has not been rendered yet
+        Can be called from any thread. See PreviewPipeline.render() for the parameters
+        :param frame: the source image, which must not be modified afterwards
+        :return: the number of the request, sent back with the rendered image
+        """
+        with self.lock:
+            if self.pending is not None:
+                self.skipped += 1
+            self.requests += 1
+            number = self.requests
+            self.pending = (frame, chain, fast, frame_id, number)
+        self.requested.emit()
+        return number
+
+    @QtCore.pyqtSlot()
+    def render_pending(self):
+        """
+        Renders the latest request if there is one, in the rendering thread
+        """
+        with self.lock:
+            request, self.pending = self.pending, None
+        if request is None:
+            # Already rendered with a previous wake up
+            return
+        frame, chain, fast, frame_id, number = request
+        try:
+            frame = self.preview.render(frame, chain, fast, self.profiler, frame_id)
+            start = time.perf_counter()
+            # rgbSwapped() and copy() make a copy: the image does not refer to the frame, which may be a reused buffer
+            if frame.ndim == 2:
+                # Grayscale frames are shown as they are, without going back to 3 channels
+                image = QtGui.QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0],
+                                     QtGui.QImage.Format_Grayscale8).copy()
+            else:
+                image = QtGui.QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0],
+                                     QtGui.QImage.Format_RGB888).rgbSwapped()
+            if self.profiler is not None:
+                self.profiler.record("qimage", time.perf_counter() - start)
+        except:
+            # Let's make sure we get some trace if anything goes wrong in this thread
+            traceback.print_exc()
+            # The player must not wait for this request forever
+            self.failed.emit(number)
+            return
+        self.rendered.emit(image, number)
+
+    @QtCore.pyqtSlot()
+    def close(self):
+        """
+        Releases the instances of the filters - call it once the rendering thread is stopped
+        """
+        self.preview.close()
@@ -0,0 +1,137 @@
+import collections
+import csv
+import json
+import threading
+
+
+class StageStats:
+    """
+    Durations of one stage (decoding, a filter, encoding...): the last ones for rolling percentiles,
+    and optionally all of them for a complete trace
+    """
+    def __init__(self, window, keep_trace):
+        self.recent = collections.deque(maxlen=window)
+        self.trace = [] if keep_trace else None
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.recent.append(seconds)
+        if self.trace is not None:
+            self.trace.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def summary(self):
+        """
+        :return: {"count", "mean", "p50", "p95", "max"} with durations in milliseconds, percentiles are computed
+                 on the whole trace when it is kept, on the last durations otherwise
+        """
+        samples = sorted(self.trace if self.trace is not None else self.recent)
+        if not samples:
+            return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": self.count,
+            "mean": 1000 * self.total / self.count,
+            "p50": 1000 * samples[(len(samples) - 1) // 2],
+            "p95": 1000 * samples[min(len(samples) - 1, round(0.95 * (len(samples) - 1)))],
+            "max": 1000 * samples[-1],
+        }
+
+
+class Profiler:
+    """
+    Collects the time spent in every stage of the rendering, possibly from several threads.
+    Stages are identified by their name, e.g. "decode", "encode" or the keys of the stages of a Pipeline.
+    """
+    # Number of recent durations used for the rolling percentiles
+    WINDOW = 300
+
+    def __init__(self, keep_trace=False, window=WINDOW):
+        """
+        :param keep_trace: if True, all durations are kept, e.g. to export the trace of a whole export
+        :param window: number of recent durations used for the rolling percentiles
+        """
+        self.keep_trace = keep_trace
+        self.window = window
+        self.lock = threading.Lock()
+        # name => StageStats, in the order in which stages were first seen
+        self.stages = {}
+
+    def __getstate__(self):
+        # Profilers are sent back from other processes, but not their lock
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """
+        Records the duration of one execution of a stage
+        """
+        with self.lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = StageStats(self.window, self.keep_trace)
+                self.stages[name] = stats
+            stats.add(seconds)
+
+    def merge(self, other):
+        """
+        Adds all the durations recorded by another profiler (which must keep its trace), e.g. from another process
+        """
+        for name, stats in other.stages.items():
+            for seconds in stats.trace:
+                self.record(name, seconds)
+
+    def summary(self, name=None):
+        """
+        :param name: the stage to summarize, None for all stages
+        :return: the summary of a stage (see StageStats.summary()), or {name => summary} for all stages
+        """
+        with self.lock:
+            if name is not None:
+                stats = self.stages.get(name)
+                return None if stats is None else stats.summary()
+            return {stage: stats.summary() for stage, stats in self.stages.items()}
+
+    def export(self, filename):
+        """
+        Writes the summary of all stages, and the trace if it is kept, into a JSON or CSV file (from the extension)
+        The CSV file has one line per stage execution (stage, duration in ms) if the trace is kept,
+        one line per stage with its summary otherwise
+        """
+        with self.lock:
+            stages = list(self.stages.items())
+        if filename.lower().endswith(".csv"):
+            with open(filename, "w", newline="") as f:
+                writer = csv.writer(f)
+                if self.keep_trace:
+                    writer.writerow(["stage", "duration_ms"])
+                    for name, stats in stages:
+                        for seconds in stats.trace:
+                            writer.writerow([name, 1000 * seconds])
+                else:
+                    writer.writerow(["stage", "count", "mean_ms", "p50_ms", "p95_ms", "max_ms"])
+                    for name, stats in stages:
+                        summary = stats.summary()
+                        writer.writerow([name, summary["count"], summary["mean"], summary["p50"], summary["p95"],
+                                         summary["max"]])
+        else:
+            data = {"summary": {name: stats.summary() for name, stats in stages}}
+            if self.keep_trace:
+                data["trace_ms"] = {name: [1000 * seconds for seconds in stats.trace] for name, stats in stages}
+            with open(filename, "w") as f:
+                json.dump(data, f)
+
+
+def format_summary(summary):
+    """
+    :return: a short text for a stage summary, e.g. to be shown in the UI
+    """
+    if summary is None or summary["count"] == 0:
+        return "-"
+    return "p50 %.1f ms, p95 %.1f ms, max %.1f ms" % (summary["p50"], summary["p95"], summary["max"])
@@ -0,0 +1,305 @@
+"""
+Command line renderer: applies a saved filter chain to one or many videos without any display.
+
+Render a single video:
+    python render_cli.py source.mp4 target.avi --chain chain.json
+
+Render many videos, either all the videos of a directory with the same chain:
+    python render_cli.py --jobs videos/ --chain chain.json --output-dir rendered/
+or the jobs listed in a JSON manifest:
+    python render_cli.py --jobs manifest.json
+where the manifest looks like:
+    {"jobs": [{"source": "a.mp4", "target": "a.avi", "chain": "chain.json"}, ...]}
+"chain" is either the path of a chain file (relative to the manifest) or the chain itself.
+A job can also write several videos from a single decoding of its source (see fanout_export.py), e.g. variants with
+different chains or encoders and a smaller proxy copy, each printing its own progress:
+    {"jobs": [{"source": "a.mp4", "outputs": [{"target": "a.avi", "chain": "chain.json"},
+                                              {"target": "a_proxy.avi", "chain": "chain.json", "size": [640, 360]}]}]}
+
+Every job prints its progress prefixed with its name. The exit code is 0 if all jobs succeeded, 1 otherwise.
+Only a range of frames is saved with --start and/or --end (frame indexes, end excluded): the frames are then
+located with the keyframe index of the video (see frame_index.py), which is built if needed.
+The encoder is the one saved in the chain file ("encoder", see encoders.py), OpenCV's MJPG writer by default.
+It can be overridden with --encoder and --encoder-option, e.g. to stream the frames to ffmpeg:
+    python render_cli.py source.mp4 target.mp4 --chain chain.json --encoder ffmpeg --encoder-option quality=20
+With --trace json (or csv), the time spent decoding, in each filter and encoding is written next to each
+target, e.g. target.avi.trace.json
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+
+from encoders import ENCODERS, EncoderConfig
+from fanout_export import ExportOutput, render_fanout
+from filter_chain import FilterChain
+from filter_loader import FilterLoader
+from frame_index import FrameIndex
+from profiler import Profiler
+from render_pipeline import ProgressPrinter
+from video_export import render_video
+
+FILTERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "filters")
+# Extensions of the files considered as videos when rendering a directory
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".m4v", ".mkv", ".mpg", ".mpeg")
+
+
+class Job:
+    """
+    A video to render
+
+    Attributes
+    ----------
+    name : str
+        the name used to prefix the job's output
+    source : str
+        path of the source video
+    target : str
+        path of the video to write, None for a job with outputs
+    chain : FilterChain
+        the filters to apply, None for a job with outputs
+    encoder : EncoderConfig
+        the encoder writing the target
+    outputs : [ExportOutput] or None
+        the videos written from a single decoding of the source instead of target, see fanout_export.py
+    """
+    def __init__(self, name, source, target, chain, encoder=None, outputs=None):
+        self.name = name
+        self.source = source
+        self.target = target
+        self.chain = chain
+        self.encoder = encoder or EncoderConfig()
+        self.outputs = outputs
+
+
+def load_chain(chain, base_dir, all_filters):
+    """
+    :param chain: the path of a chain file (relative to base_dir) or a chain description (see FilterChain.to_dict())
+    :return: a FilterChain
+    """
+    if isinstance(chain, dict):
+        return FilterChain.from_dict(chain, all_filters)
+    if not isinstance(chain, str):
+        raise ValueError("a chain must be the path of a chain file or a chain: " + str(chain))
+    return FilterChain.load(os.path.join(base_dir, chain), all_filters)
+
+
+def load_encoder(chain, base_dir):
+    """
+    :param chain: the path of a chain file (relative to base_dir) or a chain description
+    :return: the EncoderConfig saved with the chain, the default one if there is none
+    """
+    if isinstance(chain, dict):
+        return EncoderConfig.from_dict(chain.get("encoder"))
+    return EncoderConfig.load(os.path.join(base_dir, chain))
+
+
+def manifest_path(item, key, base_dir):
+    """
+    :return: the path given by the entry key of an item of a manifest, relative to base_dir
+    :raise ValueError: if it is not a string
+    """
+    if not isinstance(item[key], str):
+        raise ValueError('"' + key + '" must be a path: ' + str(item[key]))
+    return os.path.join(base_dir, item[key])
+
+
+def manifest_size(output):
+    """
+    :return: the (width, height) of an output of a manifest, None if it has none
+    :raise ValueError: if it is not a pair of positive integers
+    """
+    size = output.get("size")
+    if size is not None and (not isinstance(size, list) or len(size) != 2 or
+                             not all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in size)):
+        raise ValueError('"size" must be [width, height]: ' + str(size))
+    return size
+
+
+def read_manifest(filename, all_filters):
+    """
+    :return: the list of jobs of a JSON manifest
+    :raise ValueError: if the manifest does not have the expected structure
+    :raise KeyError: if a required entry is missing
+    """
+    base_dir = os.path.dirname(os.path.abspath(filename))
+    with open(filename) as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or not isinstance(manifest["jobs"], list):
+        raise ValueError("a manifest must be an object with a list of jobs")
+    jobs = []
+    for i, item in enumerate(manifest["jobs"]):
+        if not isinstance(item, dict):
+            raise ValueError("job " + str(i + 1) + " is not an object")
+        source = manifest_path(item, "source", base_dir)
+        name = str(item.get("name", os.path.basename(source)))
+        if "outputs" in item:
+            if not isinstance(item["outputs"], list) or not all(isinstance(output, dict) for output in item["outputs"]):
+                raise ValueError("the outputs of job " + str(i + 1) + " must be a list of objects")
+            outputs = [ExportOutput(manifest_path(output, "target", base_dir),
+                                    load_chain(output["chain"], base_dir, all_filters),
+                                    load_encoder(output["chain"], base_dir), manifest_size(output))
+                       for output in item["outputs"]]
+            jobs.append(Job(name, source, None, None, outputs=outputs))
+        else:
+            jobs.append(Job(name, source, manifest_path(item, "target", base_dir),
+                            load_chain(item["chain"], base_dir, all_filters), load_encoder(item["chain"], base_dir)))
+    return jobs
+
+
+def read_directory(directory, chain, output_dir, encoder=None):
+    """
+    :return: one job per video of the directory, all with the same chain and encoder, written into output_dir
+             (as .avi, or .mp4 with ffmpeg)
+    """
+    encoder = encoder or EncoderConfig()
+    extension = ".avi" if encoder.backend == "opencv" else ".mp4"
+    jobs = []
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS:
+            target = os.path.join(output_dir, os.path.splitext(name)[0] + extension)
+            jobs.append(Job(name, os.path.join(directory, name), target, chain, encoder))
+    return jobs
+
+
+def override_encoder(encoder, backend, options):
+    """
+    Applies the encoder given on the command line
+    :param encoder: the EncoderConfig of a job
+    :param backend: the backend to use instead, None to keep the job's one
+    :param options: the options to change {name => value}
+    :return: the EncoderConfig to use
+    """
+    if backend is None or backend == encoder.backend:
+        values = dict(encoder.options)
+        backend = encoder.backend
+    else:
+        values = {}
+    values.update(options)
+    return EncoderConfig(backend, values)
+
+
+def run_job(job, args):
+    """
+    Renders one job
+    :return: the exit code of the job: 0 if it succeeded, 1 otherwise
+    """
+    try:
+        if not os.path.exists(job.source):
+            raise FileNotFoundError(job.source)
+        targets = [job.target] if job.outputs is None else [output.target_filename for output in job.outputs]
+        print(job.name + ": saving to " + ", ".join(targets), flush=True)
+        profiler = None if args.trace is None else Profiler(keep_trace=True)
+        frame_count = None
+        if args.start > 0 or args.end is not None:
+            frame_index = FrameIndex.load_or_build(job.source)
+            end = args.end
+            if frame_index is not None:
+                end = frame_index.frame_count if end is None else min(end, frame_index.frame_count)
+            frame_count = None if end is None else max(0, end - args.start)
+        if job.outputs is None:
+            counts = [render_video(job.source, job.target, job.chain, args.workers, args.queue_size, args.segments,
+                                   ProgressPrinter(job.source, job.name, frame_count), profiler, args.start, args.end,
+                                   job.encoder, args.batch_size)]
+        else:
+            progress = [ProgressPrinter(job.source, job.name + " -> " + os.path.basename(target), frame_count)
+                        for target in targets]
+            counts = render_fanout(job.source, job.outputs, progress, args.start, args.end, profiler=profiler)
+        for target, count in zip(targets, counts):
+            print(job.name + ": " + str(count) + " frames saved" + ("" if job.outputs is None else " to " + target),
+                  flush=True)
+        if profiler is not None:
+            # A single trace for all the outputs of a job, since they share the decoding and the common filters
+            profiler.export(targets[0] + ".trace." + args.trace)
+        return 0
+    except:
+        print(job.name + ": failed", file=sys.stderr, flush=True)
+        traceback.print_exc()
+        return 1
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Applies a saved filter chain to videos without any display.")
+    parser.add_argument("source", nargs="?", help="the video to render")
+    parser.add_argument("target", nargs="?", help="the video to write (.avi, or e.g. .mp4 with ffmpeg)")
+    parser.add_argument("--chain", help="the filter chain file (JSON)")
+    parser.add_argument("--jobs", help="a directory of videos (rendered with --chain into --output-dir) "
+                                       "or a JSON manifest of jobs")
+    parser.add_argument("--output-dir", help="where to write the videos of a directory of jobs")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of jobs rendered at the same time")
+    parser.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1),
+                        help="number of processes applying the filters for each job")
+    parser.add_argument("--queue-size", type=int, default=32,
+                        help="maximum number of decoded frames waiting to be filtered for each job")
+    parser.add_argument("--segments", type=int, default=1,
+                        help="split each video into this number of segments rendered separately (resumable)")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="number of consecutive frames filtered together, 1 to filter them one by one")
+    parser.add_argument("--start", type=int, default=0, help="index of the first frame to save")
+    parser.add_argument("--end", type=int, help="index of the frame after the last one to save")
+    parser.add_argument("--encoder", choices=list(ENCODERS), help="the encoder, instead of the chain file's one")
+    parser.add_argument("--encoder-option", action="append", default=[], metavar="NAME=VALUE",
+                        help="an option of the encoder, e.g. codec=libx265 or quality=20 - can be repeated")
+    parser.add_argument("--trace", choices=("json", "csv"),
+                        help="write the time spent in each stage of each job next to its target in this format")
+    args = parser.parse_args(argv)
+    options = {}
+    for option in args.encoder_option:
+        name, sep, value = option.partition("=")
+        if not sep:
+            parser.error("--encoder-option must look like NAME=VALUE: " + option)
+        options[name] = int(value) if value.lstrip("-").isdigit() else value
+    args.encoder_option = options
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.start < 0 or (args.end is not None and args.end <= args.start):
+        parser.error("--end must be greater than --start, which must not be negative")
+    if args.jobs is None and (args.source is None or args.target is None or args.chain is None):
+        parser.error("either source, target and --chain, or --jobs are required")
+    if args.jobs is not None and os.path.isdir(args.jobs) and (args.chain is None or args.output_dir is None):
+        parser.error("--chain and --output-dir are required to render a directory")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Only the filters used by the chains are imported
+    all_filters = FilterLoader.discover(FILTERS_DIR)
+    try:
+        chain = None
+        encoder = None
+        if args.chain is not None:
+            chain = FilterChain.load(args.chain, all_filters)
+            encoder = override_encoder(EncoderConfig.load(args.chain), args.encoder, args.encoder_option)
+        if args.jobs is None:
+            jobs = [Job(os.path.basename(args.source), args.source, args.target, chain, encoder)]
+        elif os.path.isdir(args.jobs):
+            os.makedirs(args.output_dir, exist_ok=True)
+            jobs = read_directory(args.jobs, chain, args.output_dir, encoder)
+        else:
+            jobs = read_manifest(args.jobs, all_filters)
+            for job in jobs:
+                job.encoder = override_encoder(job.encoder, args.encoder, args.encoder_option)
+                for output in job.outputs or []:
+                    output.encoder = override_encoder(output.encoder, args.encoder, args.encoder_option)
+    except KeyError as e:
+        # A manifest without "jobs", or a job without "source", "target" or "chain"
+        print("Invalid jobs: missing " + str(e), file=sys.stderr)
+        return 2
+    except (OSError, json.JSONDecodeError, ValueError) as e:
+        print("Invalid jobs: " + str(e), file=sys.stderr)
+        return 2
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, args.concurrency)) as executor:
+        codes = list(executor.map(lambda job: run_job(job, args), jobs))
+
+    for job, code in zip(jobs, codes):
+        print(("OK     " if code == 0 else "FAILED ") + job.name + " (exit code " + str(code) + ")")
+    return 0 if all(code == 0 for code in codes) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,454 @@
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+import cv2
+import numpy as np
+
+from encoders import EncoderConfig
+from frame_cache import CachedReader, FrameCache
+from frame_format import frame_shape, open_video, video_format
+from frame_index import FrameIndex
+from frame_pool import SharedFramePool
+from pipeline import Pipeline, PrefixCache, TilePool
+
+# How long (in seconds) blocking queue operations wait before checking whether the export has been aborted
+QUEUE_POLL_TIMEOUT = 0.5
+# The filtering processes are spawned, never forked: the processes that save videos also run other threads (the
+# preview's threads in the app, the other jobs of the command line renderer), and a child forked while one of them
+# holds a lock would wait for it forever
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+class PreviewPipeline:
+    """
+    Applies the filters to frames shown in the video widget, and resizes them to the widget's size.
+    The compiled pipeline is kept as long as the chain and the frame size do not change, and the instances of the
+    filters are kept when the chain changes: they are only configured again, and stateful filters keep their state
+    (e.g. tracked faces stay where they are when moving a slider).
+    Frames rendered with a frame_id (typically while paused) keep the output of every stage in a PrefixCache,
+    so that moving the slider of a filter only recomputes the stages from this filter onwards.
+    Filters that support it can be applied in strips by several threads (see TilePool), to render each frame faster.
+    """
+    def __init__(self, size, cache_bytes=0, tile_threads=0):
+        """
+        :param size: the display size (width, height)
+        :param cache_bytes: the maximum size of the PrefixCache, 0 not to cache anything
+        :param tile_threads: the number of threads applying the filters in strips, 0 or 1 not to split frames
+        """
+        self.size = size
+        self.pipeline = None
+        self.cache = PrefixCache(cache_bytes) if cache_bytes > 0 else None
+        self.tiles = TilePool(tile_threads) if tile_threads > 1 else None
+
+    def get_pipeline(self, chain, scale):
+        """
+        :return: the Pipeline for this chain and scale, compiled only if needed
+        """
+        if self.pipeline is None or self.pipeline.chain is not chain or self.pipeline.scale != scale:
+            instances = None
+            if self.pipeline is not None:
+                # States hold positions in the frames: they cannot be kept when the size of the frames changes
+                instances = {uid: filter for uid, filter in self.pipeline.instances.items()
+                             if self.pipeline.scale == scale or not filter.stateful}
+            pipeline = Pipeline(chain, scale, instances=instances, tiles=self.tiles)
+            if self.pipeline is not None:
+                self.pipeline.close(pipeline.instances)
+            self.pipeline = pipeline
+        return self.pipeline
+
+    def close(self):
+        """
+        Releases the instances of the filters and the threads
+        """
+        if self.pipeline is not None:
+            self.pipeline.close()
+            self.pipeline = None
+        if self.cache is not None:
+            self.cache.clear()
+        if self.tiles is not None:
+            self.tiles.close()
+
+    def render(self, frame, chain, fast, profiler=None, frame_id=None):
+        """
+        Applies a chain of filters to a frame and resizes it for display
+        :param frame: the source image
+        :param chain: the filters to apply with their parameters (FilterChain)
+        :param fast: if True and the frame is larger than the display, the frame is resized first and filtered at
+                     display resolution, with the parameters scaled accordingly (see Filter.scale_params())
+                     otherwise the frame is filtered at full resolution and then resized, exactly like when saving
+        :param profiler: optional Profiler recording the duration of the resize ("resize") and of each filter
+        :param frame_id: a hashable value identifying the frame (e.g. the video and the frame index), to use the
+                         cache - the same frame is typically rendered again and again while paused
+        :return: the filtered image, at display size - it must not be modified
+        """
+        cache = self.cache if frame_id is not None else None
+        height, width = frame.shape[:2]
+        if fast and width * height > self.size[0] * self.size[1]:
+            scale = (self.size[0] / width, self.size[1] / height)
+            resized = None if cache is None else cache.get((frame_id, self.size))
+            if resized is None:
+                start = time.perf_counter()
+                resized = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+                if profiler is not None:
+                    profiler.record("resize", time.perf_counter() - start)
+                if cache is not None:
+                    cache.put((frame_id, self.size), resized)
+            return self.get_pipeline(chain, scale).process(resized, profiler, cache, frame_id)
+        frame = self.get_pipeline(chain, None).process(frame, profiler, cache, frame_id)
+        start = time.perf_counter()
+        frame = cv2.resize(frame, self.size)
+        if profiler is not None:
+            profiler.record("resize", time.perf_counter() - start)
+        return frame
+
+
+def open_writer(cap, target_filename, encoder=None):
+    """
+    Prepares the writer for the target file, using the same fps and size as the source
+    :param cap: the opened cv2.VideoCapture of the source
+    :param target_filename: the path of the video to write
+    :param encoder: the EncoderConfig to use (see encoders.py), None for OpenCV's MJPG writer
+    :return: a writer with the methods write(frame) and release()
+    """
+    if encoder is None:
+        encoder = EncoderConfig()
+    return encoder.open(
+        target_filename,
+        cap.get(cv2.CAP_PROP_FPS),
+        (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
+
+
+class ProgressPrinter:
+    """
+    A progress callback for the render functions that prints a line every 10 seconds of video saved
+    """
+    def __init__(self, source_filename, label=None, frame_count=None):
+        """
+        :param source_filename: path of the source video, to know its frame rate and length
+        :param label: optional prefix of the printed lines, e.g. to tell jobs apart
+        :param frame_count: the number of frames to save, defaults to the length of the video
+        """
+        cap = cv2.VideoCapture(source_filename)
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if frame_count is None else frame_count
+        cap.release()
+        self.prefix = "" if label is None else label + ": "
+        self.step = max(1, int(self.fps * 10))
+        self.last = 0
+
+    def __call__(self, frame_count):
+        # Segments report their progress by large steps: print when a 10 seconds boundary is crossed
+        if frame_count // self.step > self.last // self.step and self.fps > 0:
+            line = self.prefix + str(round(frame_count // self.fps)) + " seconds saved"
+            if self.frame_count > 0:
+                line += " (" + str(min(100, 100 * frame_count // self.frame_count)) + "%)"
+            print(line, flush=True)
+        self.last = frame_count
+
+
+def _read_batch(reader, size, profiler=None):
+    """
+    Decodes the next frames of a video
+    :param reader: the cv2.VideoCapture or CachedReader of the video
+    :param size: the number of frames to read
+    :param profiler: optional Profiler recording the duration of decoding each frame ("decode")
+    :return: the frames, fewer than size at the end of the video
+    """
+    frames = []
+    while len(frames) < size and reader.isOpened():
+        start = time.perf_counter()
+        ret, frame = reader.read()
+        if not ret:
+            break
+        if profiler is not None:
+            profiler.record("decode", time.perf_counter() - start)
+        frames.append(frame)
+    return frames
+
+
+def render_serial(source_filename, target_filename, chain, progress=None, start_frame=0, end_frame=None,
+                  profiler=None, encoder=None, batch_size=1):
+    """
+    Decodes, filters and encodes every frame one after the other in the current thread
+    :param source_filename: path of the source video
+    :param target_filename: path of the video to write
+    :param chain: the filters to apply with their parameters (FilterChain)
+    :param progress: optional callable receiving the number of frames written so far
+    :param start_frame: index of the first frame to render
+    :param end_frame: index of the frame after the last one to render, None to render until the end of the video
+    :param profiler: optional Profiler recording the duration of decoding ("decode"), encoding ("encode")
+                     and of each filter
+    :param encoder: the EncoderConfig to use, None for OpenCV's MJPG writer
+    :param batch_size: number of consecutive frames filtered together, see Pipeline.process_batch()
+    :return: the number of frames written
+    """
+    cap = open_video(source_filename)
+    pipeline = Pipeline(chain, input_format=video_format(cap))
+    out = open_writer(cap, target_filename, encoder)
+    # Frames already decoded by the player are read from its cache
+    reader = CachedReader(cap, FrameCache.load(source_filename), start_frame, FrameIndex.load(source_filename))
+    count = 0
+    try:
+        while cap.isOpened() and (end_frame is None or start_frame + count < end_frame):
+            size = batch_size if end_frame is None else min(batch_size, end_frame - start_frame - count)
+            frames = _read_batch(reader, max(1, size), profiler)
+            if not frames:
+                break
+            if len(frames) > 1 and all(frame.shape == frames[0].shape for frame in frames):
+                filtered = pipeline.process_batch(np.stack(frames), profiler)
+            else:
+                # A generator: each frame is written before the next one overwrites the buffers of the pipeline
+                filtered = (pipeline.process(frame, profiler) for frame in frames)
+            for frame in filtered:
+                start = time.perf_counter()
+                out.write(frame)
+                if profiler is not None:
+                    profiler.record("encode", time.perf_counter() - start)
+                count += 1
+                if progress is not None:
+                    progress(count)
+    finally:
+        pipeline.close()
+        cap.release()
+        out.release()
+    return count
+
+
+class _StageTimes(list):
+    """
+    The durations of the stages for a single frame [(name, seconds)], recorded like a Profiler would
+    and sent to the writer with the filtered frame
+    """
+    def record(self, name, seconds):
+        self.append((name, seconds))
+
+
+def _get_batch(in_queue, batch_size):
+    """
+    Takes up to batch_size items from the queue of a filtering process, only waiting for the first one:
+    the others are those that are already available
+    :return: the items, and whether the end marker was reached
+    """
+    items = []
+    while len(items) < max(1, batch_size):
+        try:
+            item = in_queue.get() if not items else in_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is None:
+            return items, True
+        items.append(item)
+    return items, False
+
+
+def _filter_worker(in_queue, out_queue, chain, profile, pool=None, batch_size=1):
+    """
+    Body of a filtering process: picks indexed frames from in_queue and sends the filtered frames to out_queue,
+    with the duration of each filter if profile is True (None otherwise)
+    Items are (index, slot, frame): with a SharedFramePool, the frame is in the slot and the filtered frame replaces
+    it there, otherwise (slot is None) the frame itself goes through the queues.
+    Filtered items are (index, slot, frame, times): with a slot, frame is the shape of the filtered frame in the slot,
+    which can differ from the shape of the source frame (e.g. in grayscale).
+    Up to batch_size frames that are waiting in in_queue are filtered together, see Pipeline.process_batch().
+    A None item marks the end of the frames, it is forwarded so that the writer can count finished workers
+    """
+    try:
+        pipeline = Pipeline(chain)
+        done = False
+        while not done:
+            items, done = _get_batch(in_queue, batch_size)
+            frames = [frame if slot is None else pool.frame(slot) for _, slot, frame in items]
+            if len(frames) > 1 and all(frame.shape == frames[0].shape for frame in frames):
+                batch_times = _StageTimes() if profile else None
+                results = pipeline.process_batch(np.stack(frames), batch_times)
+                # The batch records each stage once per frame, stage after stage: every len(frames)-th duration
+                # belongs to the same frame
+                times = [None if batch_times is None else _StageTimes(batch_times[i::len(frames)])
+                         for i in range(len(frames))]
+            else:
+                times = [_StageTimes() if profile else None for _ in frames]
+                # A generator: each frame is sent before the next one overwrites the buffers of the pipeline
+                results = (pipeline.process(frame, frame_times) for frame, frame_times in zip(frames, times))
+            for (index, slot, _), frame, result, frame_times in zip(items, frames, results, times):
+                if slot is None:
+                    # The queue sends the frame from another thread: it must not be a buffer reused by the pipeline
+                    out_queue.put((index, None, result.copy(), frame_times))
+                elif result.nbytes <= pool.frame_bytes and result.dtype == frame.dtype:
+                    if result is not frame:
+                        np.copyto(pool.frame(slot, result.shape), result)
+                    out_queue.put((index, slot, result.shape, frame_times))
+                else:
+                    out_queue.put((index, slot, result.copy(), frame_times))
+            # The shared memory cannot be closed while arrays refer to it
+            items = frames = results = frame = result = None
+        pipeline.close()
+    except:
+        # The traceback is sent to the writer which aborts the whole export
+        out_queue.put((-1, None, traceback.format_exc(), None))
+        items = frames = results = frame = result = None
+        return
+    finally:
+        if pool is not None:
+            pool.close()
+    out_queue.put(None)
+
+
+def _read_frames(cap, in_queue, workers, stop_event, profiler, frame_count, pool=None):
+    """
+    Body of the reading thread: decodes every frame and sends it with its index to the filtering processes
+    :param cap: the cv2.VideoCapture or CachedReader of the video
+    :param frame_count: the number of frames to read, None to read until the end of the video
+    :param pool: optional SharedFramePool: frames are copied into its slots and only the slots are sent, waiting for
+                 a free slot when all of them are busy
+    """
+    def put(item):
+        while not stop_event.is_set():
+            try:
+                in_queue.put(item, timeout=QUEUE_POLL_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    index = 0
+    while cap.isOpened() and not stop_event.is_set() and (frame_count is None or index < frame_count):
+        slot = None
+        if pool is not None:
+            slot = pool.acquire(stop_event)
+            if slot is None:
+                return
+        start = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            if slot is not None:
+                pool.release(slot)
+            break
+        if profiler is not None:
+            profiler.record("decode", time.perf_counter() - start)
+        if slot is not None:
+            if frame.shape == pool.shape:
+                np.copyto(pool.frame(slot), frame)
+                frame = None
+            else:
+                # Not the size announced by the video: this one goes through the queue
+                pool.release(slot)
+                slot = None
+        if not put((index, slot, frame)):
+            return
+        index += 1
+    # One end marker per worker
+    for _ in range(workers):
+        if not put(None):
+            return
+
+
+def render_parallel(source_filename, target_filename, chain, workers, queue_size, progress=None, profiler=None,
+                    start_frame=0, end_frame=None, shared_frames=True, encoder=None, batch_size=1):
+    """
+    Decodes, filters and encodes the video using several processes for the filtering:
+    - a reading thread decodes the frames and sends them to a bounded queue (with an index),
+    - n processes pick frames from the queue and apply the filters,
+    - the calling thread picks the filtered frames and waits for the next index to be available
+      so that frames are encoded in the correct order.
+    Frames are handed between processes through a SharedFramePool (see frame_pool.py) of queue_size + workers slots:
+    only the numbers of the slots go through the queues, instead of the pickled frames.
+    The output is identical to render_serial(), except for stateful filters (see Filter.is_stateful()) which see every
+    n-th frame in each process: see render_video()
+    :param source_filename: path of the source video
+    :param target_filename: path of the video to write
+    :param chain: the filters to apply with their parameters (FilterChain)
+    :param workers: number of filtering processes
+    :param queue_size: maximum number of decoded frames waiting to be filtered
+    :param progress: optional callable receiving the number of frames written so far
+    :param profiler: optional Profiler, see render_serial()
+    :param start_frame: index of the first frame to render
+    :param end_frame: index of the frame after the last one to render, None to render until the end of the video
+    :param shared_frames: False to pickle the frames through the queues instead of using shared memory
+    :param encoder: the EncoderConfig to use, None for OpenCV's MJPG writer
+    :param batch_size: maximum number of frames waiting in the queue that each process filters together
+                       (see Pipeline.process_batch())
+    :return: the number of frames written
+    """
+    cap = open_video(source_filename)
+    out = open_writer(cap, target_filename, encoder)
+    reader = CachedReader(cap, FrameCache.load(source_filename), start_frame, FrameIndex.load(source_filename))
+    pool = None
+    if shared_frames:
+        shape = frame_shape(int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                            video_format(cap))
+        slots = queue_size + workers
+        max_slots = SharedFramePool.max_slots(shape)
+        if max_slots is not None and max_slots < slots:
+            print("Not enough shared memory for " + str(slots) + " frames, frames are sent through the queues")
+        elif shape[0] > 0 and shape[1] > 0:
+            pool = SharedFramePool(slots, shape)
+    in_queue = MP_CONTEXT.Queue(queue_size)
+    # The output queue is bounded too so that a slow writer does not let filtered frames pile up in memory
+    out_queue = MP_CONTEXT.Queue(queue_size)
+    stop_event = threading.Event()
+    processes = [MP_CONTEXT.Process(target=_filter_worker,
+                                    args=(in_queue, out_queue, chain, profiler is not None, pool, batch_size),
+                                    daemon=True)
+                 for _ in range(workers)]
+    for p in processes:
+        p.start()
+    frame_count = None if end_frame is None else end_frame - start_frame
+    reader = threading.Thread(target=_read_frames,
+                              args=(reader, in_queue, workers, stop_event, profiler, frame_count, pool), daemon=True)
+    reader.start()
+
+    # Filtered frames that arrived before their turn, by index: (slot, frame)
+    pending = {}
+    count = 0
+    finished_workers = 0
+    try:
+        while finished_workers < workers:
+            try:
+                item = out_queue.get(timeout=QUEUE_POLL_TIMEOUT)
+            except queue.Empty:
+                # A process killed by the system (out of memory, crash in a native library...) never reports back
+                for p in processes:
+                    if p.exitcode is not None and p.exitcode != 0:
+                        raise RuntimeError("A filtering process died (exit code " + str(p.exitcode) + ")")
+                continue
+            if item is None:
+                finished_workers += 1
+                continue
+            index, slot, frame, times = item
+            if index < 0:
+                raise RuntimeError("A filtering process failed:\n" + frame)
+            if times is not None:
+                for name, seconds in times:
+                    profiler.record(name, seconds)
+            if slot is not None and not isinstance(frame, tuple):
+                # The filtered frame did not fit in the slot
+                pool.release(slot)
+                slot = None
+            pending[index] = (slot, frame)
+            # Write all frames that are now in order
+            while count in pending:
+                slot, frame = pending.pop(count)
+                start = time.perf_counter()
+                out.write(frame if slot is None else pool.frame(slot, frame))
+                if profiler is not None:
+                    profiler.record("encode", time.perf_counter() - start)
+                if slot is not None:
+                    pool.release(slot)
+                count += 1
+                if progress is not None:
+                    progress(count)
+    finally:
+        stop_event.set()
+        reader.join()
+        for p in processes:
+            if finished_workers < workers:
+                p.terminate()
+            p.join()
+        cap.release()
+        out.release()
+        if pool is not None:
+            pending = frame = None
+            pool.close()
+    return count
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import shutil
+import cv2
+
+from encoders import EncoderConfig
+from frame_index import FrameIndex
+from profiler import Profiler
+from render_pipeline import MP_CONTEXT, render_serial
+
+
+def chain_signature(source_filename, chain, encoder=None):
+    """
+    Computes a signature of everything that determines the content of the segments:
+    the source file (path, size and modification time), the filters and their parameters, and the encoder
+    :return: a hexadecimal string
+    """
+    stat = os.stat(source_filename)
+    description = {
+        "source": os.path.abspath(source_filename),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "filters": [[entry.filter.__module__ + "." + entry.filter.__name__, entry.vals] for entry in chain],
+        "encoder": (encoder or EncoderConfig()).to_dict(),
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def split_frames(frame_count, segments, start_frame=0):
+    """
+    Splits frame_count frames into (at most) segments ranges of similar length
+    :param start_frame: the index of the first frame
+    :return: a list of (start, end) with end excluded
+    """
+    segments = max(1, min(segments, frame_count))
+    bounds = [start_frame + round(i * frame_count / segments) for i in range(segments + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(segments)]
+
+
+def segment_paths(parts_dir, index, extension=".avi"):
+    """
+    :param extension: the extension of the video, which depends on the encoder (see EncoderConfig.extension())
+    :return: the path of a segment's video and the path of the marker written once it is complete
+    """
+    base = os.path.join(parts_dir, "segment_%04d" % index)
+    return base + extension, base + ".json"
+
+
+def is_segment_done(parts_dir, index, start, end, signature, extension=".avi"):
+    """
+    Checks whether a segment has already been fully rendered by a previous export with the same filters
+    The segment must have a marker written after its completion and contain the expected number of frames
+    """
+    video_path, marker_path = segment_paths(parts_dir, index, extension)
+    if not os.path.exists(video_path) or not os.path.exists(marker_path):
+        return False
+    try:
+        with open(marker_path) as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if marker.get("signature") != signature or marker.get("start") != start or marker.get("end") != end:
+        return False
+    cap = cv2.VideoCapture(video_path)
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else -1
+    cap.release()
+    return frames == end - start
+
+
+def _render_segment(args):
+    """
+    Body of a segment rendering process: renders a range of frames and writes the completion marker
+    :return: the index of the segment, the number of frames written and the Profiler of the segment (None if
+             the export is not profiled)
+    """
+    source_filename, parts_dir, index, start, end, chain, signature, profile, encoder, extension, batch_size = args
+    video_path, marker_path = segment_paths(parts_dir, index, extension)
+    # A stale marker must never validate a segment that is being rewritten
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+    profiler = Profiler(keep_trace=True) if profile else None
+    count = render_serial(source_filename, video_path, chain, start_frame=start, end_frame=end, profiler=profiler,
+                          encoder=encoder, batch_size=batch_size)
+    if count != end - start:
+        raise RuntimeError("Segment %d: expected %d frames, got %d" % (index, end - start, count))
+    with open(marker_path, "w") as f:
+        json.dump({"signature": signature, "start": start, "end": end}, f)
+    return index, count, profiler
+
+
+def render_segments(source_filename, target_filename, chain, segments, processes=None, progress=None,
+                    profiler=None, start_frame=0, end_frame=None, encoder=None, batch_size=1):
+    """
+    Renders the video by splitting it into frame ranges, each of them being rendered in its own process
+    with its own reader and writer, and then joins the segments into the target without re-encoding.
+    Segments are kept in the directory target_filename + ".parts" until the end of the export, so that
+    running the same export again after a crash only renders the segments that are not complete yet.
+    Each segment starts with new instances of the filters: chains with stateful filters (see Filter.is_stateful()) must
+    not be split, see video_export.render_video().
+    :param source_filename: path of the source video
+    :param target_filename: path of the video to write (.avi)
+    :param chain: the filters to apply with their parameters (FilterChain)
+    :param segments: number of frame ranges
+    :param processes: number of segments rendered at the same time, defaults to the number of segments
+    :param progress: optional callable receiving the number of frames rendered so far
+    :param profiler: optional Profiler keeping its trace, which receives the durations recorded by all segments
+                     rendered by this call (see render_serial())
+    :param start_frame: index of the first frame to render
+    :param end_frame: index of the frame after the last one to render, None to render until the end of the video
+    :param encoder: the EncoderConfig to use, None for OpenCV's MJPG writer - segments are joined without re-encoding,
+                    and OpenCV's MJPG writer at its default quality may encode the first frames of every segment
+                    slightly differently than in a video saved in one go (see OpenCVEncoder)
+    :param batch_size: number of consecutive frames filtered together, see render_serial()
+    :return: the number of frames written
+    """
+    if encoder is None:
+        encoder = EncoderConfig()
+    # The index knows the exact number of frames, the container may only give an estimate
+    frame_index = FrameIndex.load(source_filename)
+    if frame_index is not None:
+        frame_count = frame_index.frame_count
+    else:
+        cap = cv2.VideoCapture(source_filename)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+    if end_frame is not None:
+        frame_count = min(frame_count, end_frame)
+    if frame_count <= start_frame:
+        raise ValueError("Cannot determine the number of frames of " + source_filename)
+    ranges = split_frames(frame_count - start_frame, segments, start_frame)
+    signature = chain_signature(source_filename, chain, encoder)
+    parts_dir = target_filename + ".parts"
+    extension = encoder.extension(target_filename)
+    os.makedirs(parts_dir, exist_ok=True)
+
+    done = 0
+    todo = []
+    for index, (start, end) in enumerate(ranges):
+        if is_segment_done(parts_dir, index, start, end, signature, extension):
+            done += end - start
+        else:
+            todo.append((source_filename, parts_dir, index, start, end, chain, signature, profiler is not None,
+                         encoder, extension, batch_size))
+    if done > 0:
+        print("Resuming export: " + str(len(ranges) - len(todo)) + " segments already rendered")
+        if progress is not None:
+            progress(done)
+
+    if todo:
+        # Spawned rather than forked, see render_pipeline.MP_CONTEXT
+        with MP_CONTEXT.Pool(processes or len(todo)) as pool:
+            for index, count, segment_profiler in pool.imap_unordered(_render_segment, todo):
+                if segment_profiler is not None:
+                    profiler.merge(segment_profiler)
+                done += count
+                print("Segment " + str(index) + " rendered")
+                if progress is not None:
+                    progress(done)
+
+    count = encoder.join([segment_paths(parts_dir, index, extension)[0] for index in range(len(ranges))],
+                         target_filename)
+    shutil.rmtree(parts_dir)
+    return count
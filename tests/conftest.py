@@ -0,0 +1,63 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import filter_loader  # noqa: E402
+from benchmark import synthetic_video  # noqa: E402
+from filter_chain import FilterChain  # noqa: E402
+
+# Size and length of the generated test video: small enough to render in a few seconds, long enough to be split
+VIDEO_SIZE = (160, 120)
+VIDEO_FRAMES = 24
+
+
+@pytest.fixture(scope="session")
+def all_filters(tmp_path_factory):
+    """
+    The filters of the filters directory {name => LazyFilter}, with a manifest written into a temporary directory
+    """
+    filter_loader.MANIFEST_DIR = str(tmp_path_factory.mktemp("manifest"))
+    return filter_loader.FilterLoader.discover(os.path.join(ROOT, "filters"))
+
+
+@pytest.fixture(scope="session")
+def video(tmp_path_factory):
+    """
+    Path of a short synthetic video (MJPG in AVI) whose content moves from frame to frame
+    """
+    filename = str(tmp_path_factory.mktemp("video") / "source.avi")
+    synthetic_video(filename, VIDEO_SIZE[0], VIDEO_SIZE[1], VIDEO_FRAMES)
+    return filename
+
+
+@pytest.fixture
+def make_chain(all_filters):
+    """
+    :return: a function building a FilterChain from filter names and optional parameters {name => {param => value}}
+    """
+    def make(*names, params=None):
+        params = params or {}
+        return FilterChain.from_dict({"filters": [{"name": name, "params": params.get(name, {})} for name in names]},
+                                     all_filters)
+    return make
+
+
+def read_frames(filename):
+    """
+    :return: all the decoded frames of a video as a single array
+    """
+    cap = cv2.VideoCapture(filename)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return np.stack(frames)
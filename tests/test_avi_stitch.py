@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+import pytest
+
+from avi_stitch import join_avi, read_avi
+from benchmark import synthetic_frame
+from conftest import VIDEO_SIZE, read_frames
+
+
+def write_segment(filename, first, count, size=VIDEO_SIZE):
+    """
+    Writes count synthetic frames starting with the frame of index first into an MJPG video
+    """
+    out = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*"MJPG"), 25, size)
+    for index in range(first, first + count):
+        out.write(synthetic_frame(size[0], size[1], index))
+    out.release()
+    return filename
+
+
+@pytest.mark.parametrize("max_riff_size", [1 << 30, 20000])
+def test_join_avi_keeps_every_frame(tmp_path, max_riff_size):
+    # The small RIFF size splits the result into several RIFF chunks, as with files over 1GB
+    segments = [write_segment(str(tmp_path / ("segment_%d.avi" % i)), first, count)
+                for i, (first, count) in enumerate([(0, 5), (5, 1), (6, 7)])]
+    target = str(tmp_path / "joined.avi")
+    assert join_avi(segments, target, max_riff_size) == 13
+    assert len(read_avi(target).frames) == 13
+    expected = np.concatenate([read_frames(segment) for segment in segments])
+    assert np.array_equal(read_frames(target), expected)
+
+
+def test_join_avi_refuses_different_formats(tmp_path):
+    first = write_segment(str(tmp_path / "a.avi"), 0, 2)
+    second = write_segment(str(tmp_path / "b.avi"), 2, 2, (VIDEO_SIZE[0] * 2, VIDEO_SIZE[1]))
+    with pytest.raises(ValueError):
+        join_avi([first, second], str(tmp_path / "joined.avi"))
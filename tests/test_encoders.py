@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from encoders import EncoderConfig, FFmpegEncoder
+
+
+def test_defaults():
+    config = EncoderConfig()
+    assert config.backend == "opencv" and config.options == {"codec": "MJPG", "quality": 0}
+    # Options that are not given get their default value
+    config = EncoderConfig("ffmpeg", {"quality": 30})
+    assert config.options == {"codec": "libx264", "quality": 30, "preset": "medium", "threads": 0}
+
+
+@pytest.mark.parametrize("backend, options", [
+    ("gstreamer", None),
+    ("opencv", {"bitrate": 1000}),
+    ("opencv", {"codec": "H264"}),
+    ("opencv", {"quality": 101}),
+    ("opencv", {"quality": -1}),
+    ("opencv", {"quality": 50.5}),
+    ("opencv", {"quality": "50"}),
+    ("opencv", {"quality": True}),
+    ("ffmpeg", {"preset": "fastest"}),
+    ("ffmpeg", {"threads": 65}),
+])
+def test_invalid_configurations(backend, options):
+    with pytest.raises(ValueError):
+        EncoderConfig(backend, options)
+
+
+@pytest.mark.parametrize("config", [
+    EncoderConfig(),
+    EncoderConfig("opencv", {"codec": "XVID"}),
+    EncoderConfig("ffmpeg", {"codec": "libvpx-vp9", "quality": 40, "preset": "slow", "threads": 4}),
+])
+def test_dict_round_trip(config):
+    # Through JSON, as in chain files
+    data = json.loads(json.dumps(config.to_dict()))
+    copy = EncoderConfig.from_dict(data)
+    assert copy.backend == config.backend and copy.options == config.options
+
+
+@pytest.mark.parametrize("data", ["ffmpeg", ["ffmpeg"], {"options": ["codec"]}, {"backend": None},
+                                  {"backend": "ffmpeg", "options": {"quality": 52}}])
+def test_invalid_dicts(data):
+    with pytest.raises(ValueError):
+        EncoderConfig.from_dict(data)
+
+
+def test_from_dict_defaults():
+    assert EncoderConfig.from_dict(None).to_dict() == EncoderConfig().to_dict()
+    assert EncoderConfig.from_dict({"options": {"quality": 75}}).to_dict() \
+        == {"backend": "opencv", "options": {"codec": "MJPG", "quality": 75}}
+
+
+@pytest.mark.parametrize("content, expected", [
+    ({"filters": []}, EncoderConfig()),
+    ({"filters": [], "encoder": {"backend": "ffmpeg", "options": {"codec": "mpeg4"}}},
+     EncoderConfig("ffmpeg", {"codec": "mpeg4"})),
+    # Not a chain file: the default configuration
+    ([], EncoderConfig()),
+])
+def test_load(tmp_path, content, expected):
+    filename = str(tmp_path / "chain.json")
+    with open(filename, "w") as f:
+        json.dump(content, f)
+    assert EncoderConfig.load(filename).to_dict() == expected.to_dict()
+
+
+def test_invalid_encoder_in_chain_file(tmp_path):
+    filename = str(tmp_path / "chain.json")
+    with open(filename, "w") as f:
+        json.dump({"filters": [], "encoder": {"backend": "opencv", "options": {"codec": "DIVX"}}}, f)
+    with pytest.raises(ValueError):
+        EncoderConfig.load(filename)
+
+
+@pytest.mark.parametrize("options, expected", [
+    ({"codec": "libx264", "quality": 18, "preset": "fast"},
+     ["-c:v", "libx264", "-threads", "0", "-preset", "fast", "-crf", "18", "-pix_fmt", "yuv420p"]),
+    # VP9's crf goes up to 63, the quantizer of mpeg4 and mjpeg from 2 to 31
+    ({"codec": "libvpx-vp9", "quality": 51}, ["-c:v", "libvpx-vp9", "-threads", "0", "-crf", "63", "-b:v", "0",
+                                              "-pix_fmt", "yuv420p"]),
+    ({"codec": "mjpeg", "quality": 0, "threads": 2}, ["-c:v", "mjpeg", "-threads", "2", "-q:v", "2"]),
+])
+def test_ffmpeg_arguments(options, expected):
+    assert FFmpegEncoder.codec_args(EncoderConfig("ffmpeg", options).options) == expected
+
+
+def test_can_join(monkeypatch):
+    monkeypatch.setattr(FFmpegEncoder, "binary", "no-such-ffmpeg")
+    # MJPG segments are joined directly, the other codecs need ffmpeg
+    assert EncoderConfig().can_join()
+    assert not EncoderConfig("opencv", {"codec": "XVID"}).can_join()
+    assert not EncoderConfig("ffmpeg").can_join()
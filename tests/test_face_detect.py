@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from benchmark import synthetic_frame
+from conftest import VIDEO_SIZE
+
+# A face as found by the classifier in the detection image (x, y, w, h)
+FACE = (20, 16, 24, 24)
+
+
+class Classifier:
+    """
+    Stands for the haar classifier: always finds FACE, and keeps the size of the images it was given
+    """
+    def __init__(self):
+        self.shapes = []
+
+    def detectMultiScale(self, image, scaleFactor, minNeighbors):
+        self.shapes.append(image.shape)
+        return [FACE]
+
+
+def make_filter(all_filters, **params):
+    filter = all_filters["Face Detection"].load()
+    instance = filter()
+    instance.configure(dict({param.name: param.default_val for param in filter.get_config()}, **params))
+    instance.haar_cascade_face = Classifier()
+    return instance
+
+
+@pytest.mark.parametrize("every", [1, 3, 5])
+def test_detect_every(all_filters, every):
+    instance = make_filter(all_filters, **{"Detect every": every, "Tracking": 0})
+    for index in range(10):
+        instance.process(synthetic_frame(*VIDEO_SIZE, index=index))
+        # Faces are held where they were found between detections
+        assert instance.faces == [FACE]
+    assert len(instance.haar_cascade_face.shapes) == len(range(0, 10, every))
+    assert instance.is_stateful(instance.params) == (every > 1)
+
+
+def test_detection_scale(all_filters):
+    instance = make_filter(all_filters, **{"Detection scale": 0.5})
+    frame = synthetic_frame(*VIDEO_SIZE)
+    out = np.zeros_like(frame)
+    assert instance.process(frame, out) is out
+    # Detection runs on the downscaled image, faces are drawn in frame coordinates
+    width, height = VIDEO_SIZE
+    assert instance.haar_cascade_face.shapes == [(height // 2, width // 2)]
+    assert instance.faces == [tuple(2 * v for v in FACE)]
+    x, y, w, h = instance.faces[0]
+    assert tuple(out[y, x + w // 2]) == (0, 255, 0) and np.array_equal(out[2:y - 8], frame[2:y - 8])
+
+
+@pytest.mark.parametrize("scale", [1, 0.5])
+def test_tracking_follows_the_faces(all_filters, scale):
+    previous = synthetic_frame(*VIDEO_SIZE)[:, :, 2]
+    # The whole image moves by (6, 4) pixels in the detection image
+    small = np.roll(previous, (4, 6), axis=(0, 1))
+    faces = [tuple(round(v / scale) for v in FACE)]
+    tracked = all_filters["Face Detection"].load().track(previous, small, scale, faces)
+    x, y, w, h = faces[0]
+    assert tracked == [(x + round(6 / scale), y + round(4 / scale), w, h)]
+
+
+def test_tracking_between_detections(all_filters):
+    instance = make_filter(all_filters, **{"Detect every": 4, "Tracking": 1})
+    frame = synthetic_frame(*VIDEO_SIZE)
+    instance.process(frame)
+    for step in range(1, 4):
+        instance.process(np.roll(frame, (0, 3 * step), axis=(0, 1)))
+        assert instance.faces == [(FACE[0] + 3 * step,) + FACE[1:]]
+    assert len(instance.haar_cascade_face.shapes) == 1
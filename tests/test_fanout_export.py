@@ -0,0 +1,46 @@
+import numpy as np
+
+from conftest import VIDEO_FRAMES, read_frames
+from fanout_export import ExportOutput, PrefixNode, render_fanout
+from render_pipeline import render_serial
+
+
+def names(node):
+    return [entry.filter.get_filter_name() for entry in node.entries]
+
+
+def test_build_shares_common_prefixes(make_chain):
+    chains = [make_chain("Luminosity", "Blur", "Sharpen"),
+              make_chain("Luminosity", "Blur", "Grayscale"),
+              make_chain("Luminosity", "Blur"),
+              make_chain("Luminosity", params={"Luminosity": {"Luminosity": 50}}),
+              make_chain()]
+    tree = PrefixNode.build(chains)
+    assert tree.entries == [] and tree.outputs == [4]
+    shared, other = tree.children
+    # Filters without branch in between are applied by a single node
+    assert names(shared) == ["Luminosity", "Blur"] and shared.outputs == [2]
+    assert [names(child) for child in shared.children] == [["Sharpen"], ["Grayscale"]]
+    assert [child.outputs for child in shared.children] == [[0], [1]]
+    # The same filter with other parameters is another branch
+    assert names(other) == ["Luminosity"] and other.outputs == [3] and other.children == []
+    assert shared.label() == "outputs 1+2+3: "
+
+
+def test_identical_chains_share_every_node(make_chain):
+    tree = PrefixNode.build([make_chain("Sharpen", "Blur"), make_chain("Sharpen", "Blur")])
+    assert len(tree.children) == 1
+    assert names(tree.children[0]) == ["Sharpen", "Blur"] and tree.children[0].outputs == [0, 1]
+
+
+def test_outputs_match_serial(video, tmp_path, make_chain):
+    chains = [make_chain("Luminosity", "Sharpen"), make_chain("Luminosity", "Grayscale"), make_chain("Luminosity")]
+    outputs = [ExportOutput(str(tmp_path / ("out%d.avi" % i)), chain) for i, chain in enumerate(chains)]
+    # A proxy copy at half the size
+    outputs[2].size = (80, 60)
+    assert render_fanout(video, outputs) == [VIDEO_FRAMES] * 3
+    for output in outputs[:2]:
+        serial = str(tmp_path / "serial.avi")
+        render_serial(video, serial, output.chain)
+        assert np.array_equal(read_frames(output.target_filename), read_frames(serial))
+    assert read_frames(outputs[2].target_filename).shape == (VIDEO_FRAMES, 60, 80, 3)
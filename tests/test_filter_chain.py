@@ -0,0 +1,36 @@
+import pytest
+
+from encoders import EncoderConfig
+from filter_chain import FilterChain
+
+
+def test_missing_parameters_get_their_default(all_filters):
+    chain = FilterChain.from_dict({"filters": [{"name": "Blur", "params": {"Horizontal": 4}}]}, all_filters)
+    assert [entry.vals for entry in chain] == [{"Horizontal": 4, "Vertical": 10.0}]
+
+
+def test_save_and_load(tmp_path, make_chain):
+    chain = make_chain("Luminosity", "Grayscale", params={"Luminosity": {"Contrast": 2}})
+    filename = str(tmp_path / "chain.json")
+    encoder = EncoderConfig("opencv", {"quality": 80})
+    chain.save(filename, encoder)
+    loaded = FilterChain.load(filename, {entry.filter.get_filter_name(): entry.filter for entry in chain})
+    assert loaded.to_dict() == chain.to_dict()
+    assert EncoderConfig.load(filename).to_dict() == encoder.to_dict()
+
+
+@pytest.mark.parametrize("data", [
+    None,
+    {"filters": {"name": "Blur"}},
+    {"version": 99, "filters": []},
+    {"filters": ["Blur"]},
+    {"filters": [{"name": "Unknown"}]},
+    {"filters": [{"name": "Blur", "params": {"Depth": 3}}]},
+    {"filters": [{"name": "Blur", "params": {"Horizontal": 1000}}]},
+    {"filters": [{"name": "Blur", "params": {"Horizontal": "5"}}]},
+    {"filters": [{"name": "Blur", "params": {"Horizontal": True}}]},
+    {"filters": [{"name": "Blur", "params": [5, 5]}]},
+])
+def test_invalid_chains(all_filters, data):
+    with pytest.raises(ValueError):
+        FilterChain.from_dict(data, all_filters)
@@ -0,0 +1,133 @@
+import itertools
+import json
+import os
+import sys
+
+import pytest
+
+import filter_loader
+from filter_loader import FilterLoader
+
+# A module defining a filter, formatted with the class name, the filter name and the default of its parameter
+MODULE = '''from abstract_filter import Filter, FilterParameter
+
+
+class {0}(Filter):
+    config = [FilterParameter("Strength", 0, 10, {2})]
+
+    @staticmethod
+    def get_filter_name():
+        return "{1}"
+
+    @staticmethod
+    def get_config():
+        return {0}.config
+
+    @staticmethod
+    def apply_filter(frame, params, out=None):
+        return frame
+'''
+
+_packages = itertools.count()
+
+
+@pytest.fixture
+def filters_dir(tmp_path, monkeypatch):
+    """
+    An empty directory of filters, importable under a name of its own, with its manifest in a temporary directory
+    """
+    monkeypatch.setattr(filter_loader, "MANIFEST_DIR", str(tmp_path / "manifest"))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    path = tmp_path / ("loader_filters_" + str(next(_packages)))
+    path.mkdir()
+    yield path
+    forget_modules(path)
+
+
+def write_filter(directory, class_name, name=None, default=5):
+    os.makedirs(str(directory), exist_ok=True)
+    (directory / (class_name + ".py")).write_text(MODULE.format(class_name, name or class_name, default))
+
+
+def forget_modules(filters_dir):
+    """
+    Removes the imported modules of the directory, as in a new run of the app
+    """
+    for name in list(sys.modules):
+        if name.startswith(filters_dir.name + "."):
+            del sys.modules[name]
+
+
+def test_manifest_avoids_imports(filters_dir):
+    write_filter(filters_dir, "Foo")
+    write_filter(filters_dir, "Bar", default=2)
+    filters = FilterLoader.discover(str(filters_dir))
+    # Described by importing them the first time
+    assert list(filters) == ["Bar", "Foo"] and filters["Foo"].loaded
+    with open(FilterLoader.manifest_path(str(filters_dir))) as f:
+        assert set(json.load(f)["modules"]) == {"Foo.py", "Bar.py"}
+    forget_modules(filters_dir)
+    filters = FilterLoader.discover(str(filters_dir))
+    assert not filters["Bar"].loaded and filters_dir.name + ".Bar" not in sys.modules
+    assert [(p.name, p.default_val) for p in filters["Bar"].get_config()] == [("Strength", 2)]
+    assert filters["Bar"].load().__name__ == "Bar" and filters["Bar"].loaded
+
+
+def test_changed_module_is_described_again(filters_dir):
+    write_filter(filters_dir, "Foo")
+    write_filter(filters_dir, "Bar")
+    FilterLoader.discover(str(filters_dir))
+    forget_modules(filters_dir)
+    write_filter(filters_dir, "Foo", default=7)
+    # The size is the same: only the modification time tells that the module changed
+    path = str(filters_dir / "Foo.py")
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    filters = FilterLoader.discover(str(filters_dir))
+    assert filters["Foo"].loaded and filters["Foo"].get_config()[0].default_val == 7
+    assert not filters["Bar"].loaded
+
+
+def test_removed_module_and_other_manifest_version(filters_dir):
+    write_filter(filters_dir, "Foo")
+    write_filter(filters_dir, "Bar")
+    FilterLoader.discover(str(filters_dir))
+    os.remove(str(filters_dir / "Bar.py"))
+    forget_modules(filters_dir)
+    assert list(FilterLoader.discover(str(filters_dir))) == ["Foo"]
+    with open(FilterLoader.manifest_path(str(filters_dir))) as f:
+        manifest = json.load(f)
+    assert list(manifest["modules"]) == ["Foo.py"]
+    # A manifest written by another version is ignored
+    manifest["version"] = filter_loader.MANIFEST_FORMAT_VERSION + 1
+    with open(FilterLoader.manifest_path(str(filters_dir)), "w") as f:
+        json.dump(manifest, f)
+    assert FilterLoader.discover(str(filters_dir))["Foo"].loaded
+
+
+def test_subdirectories(filters_dir):
+    write_filter(filters_dir, "Foo")
+    write_filter(filters_dir / "color", "Tint")
+    write_filter(filters_dir / "color" / "deep", "Shade")
+    # Private directories and modules are not searched
+    write_filter(filters_dir / "_private", "Hidden")
+    write_filter(filters_dir, "_Helper")
+    filters = FilterLoader.discover(str(filters_dir))
+    assert list(filters) == ["Foo", "Shade", "Tint"]
+    assert filters["Shade"].module_name == filters_dir.name + ".color.deep.Shade"
+    forget_modules(filters_dir)
+    assert FilterLoader.discover(str(filters_dir))["Shade"].load().__name__ == "Shade"
+
+
+def test_duplicate_names_and_bogus_modules(filters_dir, capsys):
+    write_filter(filters_dir, "Foo", default=1)
+    write_filter(filters_dir / "more", "Foo", default=2)
+    write_filter(filters_dir / "more", "Other", name="Foo", default=3)
+    (filters_dir / "Broken.py").write_text("raise RuntimeError('broken')\n")
+    filters = FilterLoader.discover(str(filters_dir))
+    # The first module found wins: the directory's own modules come before its subdirectories
+    assert list(filters) == ["Foo"] and filters["Foo"].module_name == filters_dir.name + ".Foo"
+    assert filters["Foo"].get_config()[0].default_val == 1
+    output = capsys.readouterr().out
+    assert "Skipping filter module Broken.py" in output
+    assert output.count("there is already a filter named Foo") == 2
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from benchmark import synthetic_frame
+from conftest import VIDEO_SIZE
+
+
+def make_filter(all_filters, frames):
+    instance = all_filters["Frame Average"].load()()
+    instance.configure({"Frames": frames})
+    return instance
+
+
+@pytest.mark.parametrize("count", [1, 3, 16])
+def test_blocks_match_frames(all_filters, count):
+    frames = np.stack([synthetic_frame(*VIDEO_SIZE, index=index) for index in range(20)])
+    one_by_one = make_filter(all_filters, count)
+    expected = np.stack([one_by_one.process(frame) for frame in frames])
+    # Blocks shorter and longer than the window
+    blocks = make_filter(all_filters, count)
+    out = np.empty_like(frames)
+    for start, end in [(0, 2), (2, 9), (9, 10), (10, 20)]:
+        blocks.process_batch(frames[start:end], out[start:end])
+    assert np.array_equal(out, expected)
+    # The average of the last frames, the first ones being averaged over the frames before them
+    for index in range(len(frames)):
+        mean = frames[max(0, index - count + 1):index + 1].mean(axis=0)
+        assert np.abs(expected[index] - mean).max() <= 0.5 + 1e-9
@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+import frame_cache
+from conftest import VIDEO_FRAMES, VIDEO_SIZE, read_frames
+from frame_cache import CachedReader, FrameCache
+
+WIDTH, HEIGHT = VIDEO_SIZE
+# Room for the smallest cache that can be opened
+CACHE_BYTES = FrameCache.MIN_SLOTS * WIDTH * HEIGHT * 3
+
+
+@pytest.fixture
+def source(video, tmp_path, monkeypatch):
+    """
+    A copy of the test video that can be modified, with its cache in a temporary directory
+    """
+    monkeypatch.setattr(frame_cache, "FRAME_CACHE_DIR", str(tmp_path / "cache"))
+    filename = str(tmp_path / "source.avi")
+    shutil.copy(video, filename)
+    return filename
+
+
+def frame_of(value):
+    return np.full((HEIGHT, WIDTH, 3), value, np.uint8)
+
+
+def test_slots_are_replaced(source):
+    cache = FrameCache.open(source, WIDTH, HEIGHT, CACHE_BYTES)
+    assert cache.slots == FrameCache.MIN_SLOTS
+    cache.put(3, frame_of(3))
+    assert np.array_equal(cache.get(3), frame_of(3))
+    assert cache.get(4) is None
+    cache.put(3 + cache.slots, frame_of(4))
+    assert cache.get(3) is None
+    # Frames of another size are not cached
+    assert cache.put(5, frame_of(5)[1:]) is not None and cache.get(5) is None
+    cache.close()
+
+
+def test_too_small(source):
+    assert FrameCache.open(source, WIDTH, HEIGHT, CACHE_BYTES - 1) is None
+
+
+def test_reopened_cache_keeps_its_frames(source):
+    FrameCache.open(source, WIDTH, HEIGHT, CACHE_BYTES).put(7, frame_of(7))
+    assert np.array_equal(FrameCache.load(source).get(7, copy=True), frame_of(7))
+    assert np.array_equal(FrameCache.open(source, WIDTH, HEIGHT, CACHE_BYTES).get(7), frame_of(7))
+    # Another size gives other slots
+    assert FrameCache.open(source, WIDTH, HEIGHT, CACHE_BYTES * 2).get(7) is None
+
+
+def test_modified_video_drops_the_cache(source):
+    FrameCache.open(source, WIDTH, HEIGHT, CACHE_BYTES).put(7, frame_of(7))
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert FrameCache.load(source) is None
+    assert FrameCache.open(source, WIDTH, HEIGHT, CACHE_BYTES).get(7) is None
+
+
+def test_cached_reader(source):
+    cache = FrameCache.open(source, WIDTH, HEIGHT, CACHE_BYTES)
+    decoded = read_frames(source)
+    # Every other frame is cached, with a marker that decoding would not give
+    for index in range(0, VIDEO_FRAMES, 2):
+        cache.put(index, decoded[index] ^ 1)
+    cap = cv2.VideoCapture(source)
+    reader = CachedReader(cap, FrameCache.load(source), start_index=3)
+    frames = []
+    while True:
+        ret, frame = reader.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    assert len(frames) == VIDEO_FRAMES - 3
+    for index, frame in enumerate(frames, 3):
+        assert np.array_equal(frame, decoded[index] ^ 1 if index % 2 == 0 else decoded[index])
+    assert reader.cache.hits == len(range(4, VIDEO_FRAMES, 2))
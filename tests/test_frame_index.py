@@ -0,0 +1,111 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import frame_index
+from benchmark import synthetic_frame
+from conftest import VIDEO_SIZE, read_frames
+from frame_index import FrameIndex, seek
+
+# Length of the video with groups of pictures
+GOP_FRAMES = 40
+
+
+@pytest.fixture(scope="module")
+def gop_video(tmp_path_factory):
+    """
+    Path of a synthetic MPEG-4 video, whose frames depend on the previous ones between keyframes
+    """
+    filename = str(tmp_path_factory.mktemp("gop") / "source.mp4")
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*"mp4v"), 24, VIDEO_SIZE)
+    if not writer.isOpened():
+        pytest.skip("No MPEG-4 encoder")
+    for index in range(GOP_FRAMES):
+        writer.write(synthetic_frame(*VIDEO_SIZE, index=index))
+    writer.release()
+    return filename
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    """
+    An empty INDEX_CACHE_DIR, so that no index is read from or written into the home directory
+    """
+    monkeypatch.setattr(frame_index, "INDEX_CACHE_DIR", str(tmp_path / "index"))
+    return frame_index.INDEX_CACHE_DIR
+
+
+def test_build(gop_video):
+    index = FrameIndex.build(gop_video)
+    if index is None:
+        pytest.skip("The video cannot be read packet by packet")
+    assert index.frame_count == len(index.timestamps) == GOP_FRAMES
+    assert index.fps == pytest.approx(24)
+    assert index.keyframes[0] == 0 and 1 < len(index.keyframes) < GOP_FRAMES
+    assert index.timestamps == sorted(index.timestamps)
+    second = index.keyframes[1]
+    assert index.keyframe_before(second - 1) == 0 and index.keyframe_before(second) == second
+
+
+def test_every_frame_of_mjpg_is_a_keyframe(video):
+    index = FrameIndex.build(video)
+    if index is None:
+        pytest.skip("The video cannot be read packet by packet")
+    assert index.keyframes == list(range(index.frame_count))
+
+
+def test_save_and_load(gop_video, tmp_path, index_dir):
+    index = FrameIndex.build(gop_video)
+    if index is None:
+        pytest.skip("The video cannot be read packet by packet")
+    assert FrameIndex.load(gop_video) is None
+    assert index.save(gop_video) == gop_video + ".index.json"
+    loaded = FrameIndex.load(gop_video)
+    assert (loaded.frame_count, loaded.fps, loaded.keyframes, loaded.timestamps) \
+        == (index.frame_count, index.fps, index.keyframes, index.timestamps)
+    # A modified video is indexed again
+    stat = os.stat(gop_video)
+    os.utime(gop_video, (stat.st_atime, stat.st_mtime + 10))
+    try:
+        assert FrameIndex.load(gop_video) is None
+        assert FrameIndex.load_or_build(gop_video).keyframes == index.keyframes
+        assert FrameIndex.load(gop_video) is not None
+    finally:
+        os.remove(gop_video + ".index.json")
+        os.utime(gop_video, (stat.st_atime, stat.st_mtime))
+    assert FrameIndex.load(str(tmp_path / "missing.mp4")) is None
+
+
+def test_saved_into_the_cache_directory(gop_video, index_dir, monkeypatch):
+    index = FrameIndex.build(gop_video)
+    if index is None:
+        pytest.skip("The video cannot be read packet by packet")
+    # The video's directory is not writable: its index goes into INDEX_CACHE_DIR
+    paths = FrameIndex.index_paths(gop_video)
+    unwritable = os.path.join(index_dir, "file", "index.json")
+    os.makedirs(index_dir)
+    open(os.path.join(index_dir, "file"), "w").close()
+    monkeypatch.setattr(FrameIndex, "index_paths", staticmethod(lambda filename: [unwritable, paths[1]]))
+    assert index.save(gop_video) == paths[1] and os.path.dirname(paths[1]) == index_dir
+    assert FrameIndex.load(gop_video).keyframes == index.keyframes
+
+
+@pytest.mark.parametrize("moves", [
+    # (position of the video, frame to seek to): forward within a group of pictures, across keyframes, backwards
+    [(None, 3), (4, 10), (11, 30), (31, 5), (6, 6)],
+    [(None, 39), (None, 0), (1, 13), (14, 25)],
+])
+def test_accurate_seek(gop_video, moves):
+    index = FrameIndex.build(gop_video)
+    if index is None:
+        pytest.skip("The video cannot be read packet by packet")
+    expected = read_frames(gop_video)
+    for frames in (index, None):
+        cap = cv2.VideoCapture(gop_video)
+        for position, target in moves:
+            seek(cap, target, frames, position)
+            ret, frame = cap.read()
+            assert ret and np.array_equal(frame, expected[target]), (position, target)
+        cap.release()
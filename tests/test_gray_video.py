@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import synthetic_frame
+from conftest import VIDEO_FRAMES, VIDEO_SIZE, read_frames
+from frame_format import BGR, GRAY, open_video, video_format
+from pipeline import ConvertStage, Pipeline
+from render_pipeline import render_serial
+
+
+def gray_frame(index):
+    return cv2.cvtColor(synthetic_frame(*VIDEO_SIZE, index=index), cv2.COLOR_BGR2GRAY)
+
+
+@pytest.fixture(scope="module")
+def gray_video(tmp_path_factory):
+    """
+    Path of a short uncompressed grayscale video (Y800 in AVI)
+    """
+    filename = str(tmp_path_factory.mktemp("gray") / "source.avi")
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*"Y800"), 24, VIDEO_SIZE, isColor=False)
+    for index in range(VIDEO_FRAMES):
+        writer.write(gray_frame(index))
+    writer.release()
+    cap = cv2.VideoCapture(filename)
+    try:
+        if video_format(cap) != GRAY:
+            pytest.skip("The pixel format of the video is not available")
+    finally:
+        cap.release()
+    return filename
+
+
+def test_open_video(gray_video, video):
+    cap = open_video(gray_video)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    # A single channel, decoded without loss
+    assert len(frames) == VIDEO_FRAMES and frames[0].shape == VIDEO_SIZE[::-1]
+    assert np.array_equal(frames[5], gray_frame(5))
+    # Color videos are not affected
+    cap = open_video(video)
+    assert video_format(cap) == BGR and cap.read()[1].shape == VIDEO_SIZE[::-1] + (3,)
+    cap.release()
+
+
+@pytest.mark.parametrize("names", [
+    ["Luminosity", "Blur"],
+    ["Luminosity", "Sharpen", "Frame Average", "Edge Detection (Canny)"],
+])
+def test_gray_native_chain(make_chain, names):
+    chain = make_chain(*names, params={"Luminosity": {"Contrast": 1.4, "Luminosity": 10}})
+    frame = gray_frame(3)
+    pipeline = Pipeline(chain, reuse_buffers=False)
+    result = pipeline.process(frame)
+    # No conversion: every filter works on the single channel, which gives the same result as on 3 identical ones
+    assert not any(isinstance(stage, ConvertStage) for stage in pipeline.stages)
+    assert pipeline.output_format == GRAY and result.shape == frame.shape
+    color = Pipeline(chain, reuse_buffers=False)
+    expected = color.process(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    assert np.array_equal(result, expected if expected.ndim == 2 else expected[:, :, 0])
+    pipeline.close()
+    color.close()
+
+
+def test_color_filter_in_gray_chain(make_chain):
+    chain = make_chain("Luminosity", "Face Detection", "Blur")
+    pipeline = Pipeline(chain)
+    pipeline.process(gray_frame(0))
+    # Frames are converted right before the filter that needs color, and stay in color afterwards
+    assert isinstance(pipeline.stages[1], ConvertStage) and pipeline.stages[1].format == BGR
+    assert pipeline.output_format == BGR
+    pipeline.close()
+
+
+def test_render_gray_video(gray_video, tmp_path, make_chain):
+    target = str(tmp_path / "target.avi")
+    assert render_serial(gray_video, target, make_chain("Luminosity", "Blur")) == VIDEO_FRAMES
+    # The encoder takes color frames
+    frames = read_frames(target)
+    assert frames.shape == (VIDEO_FRAMES,) + VIDEO_SIZE[::-1] + (3,)
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from benchmark import synthetic_frame
+from conftest import VIDEO_SIZE
+from filter_chain import FilterChain
+from frame_format import BGR, GRAY, shape_as
+from pipeline import FilterStage, FrameBuffers, LutStage, Pipeline, TilePool
+
+
+def apply_one_by_one(chain, frame):
+    """
+    :return: the frame filtered by each filter of the chain in turn, each one in its own pipeline (nothing merged)
+    """
+    for entry in chain:
+        pipeline = Pipeline(FilterChain([entry]), reuse_buffers=False)
+        frame = pipeline.process(frame)
+        pipeline.close()
+    return frame
+
+
+@pytest.fixture
+def frame():
+    return synthetic_frame(*VIDEO_SIZE, index=3)
+
+
+def test_point_wise_filters_are_merged(make_chain, frame):
+    chain = make_chain("Luminosity", "Luminosity", "Luminosity", "Grayscale", "Luminosity",
+                       params={"Luminosity": {"Contrast": 1.3, "Luminosity": 12}})
+    pipeline = Pipeline(chain)
+    assert len(pipeline.stages) == 1
+    stage = pipeline.stages[0]
+    assert isinstance(stage, LutStage) and stage.gray and len(stage.filters) == 5
+    result = pipeline.process(frame)
+    assert pipeline.output_format == GRAY
+    assert np.array_equal(result, apply_one_by_one(chain, frame))
+    # The tall image of a block goes through the same table
+    block = np.stack([frame, synthetic_frame(*VIDEO_SIZE, index=4)])
+    assert np.array_equal(pipeline.process_batch(block)[1], apply_one_by_one(chain, block[1]))
+    pipeline.close()
+
+
+def test_two_point_wise_filters_are_merged(make_chain, frame):
+    chain = make_chain("Luminosity", "Grayscale", params={"Luminosity": {"Contrast": 1.6, "Luminosity": 20}})
+    pipeline = Pipeline(chain)
+    assert [type(stage) for stage in pipeline.stages] == [LutStage]
+    expected = apply_one_by_one(chain, frame)
+    first = pipeline.process(frame)
+    assert np.array_equal(first, expected)
+    first = first.copy()
+    # The stage writes into the pipeline buffers instead of allocating a frame per call
+    outputs = [pipeline.process(frame) for _ in range(3)]
+    assert outputs[0] is outputs[1] is outputs[2]
+    assert np.array_equal(outputs[2], first)
+    pipeline.close()
+
+
+def test_other_filters_split_the_tables(make_chain, frame):
+    chain = make_chain("Luminosity", "Sharpen", "Luminosity", params={"Luminosity": {"Luminosity": 40}})
+    pipeline = Pipeline(chain)
+    # A single point-wise filter is applied as it is
+    assert [type(stage) for stage in pipeline.stages] == [FilterStage] * 3
+    assert np.array_equal(pipeline.process(frame), apply_one_by_one(chain, frame))
+    pipeline.close()
+
+
+def test_frame_buffers_ping_pong():
+    buffers = FrameBuffers()
+    frame = np.zeros((4, 6, 3), np.uint8)
+    first = buffers.get(frame)
+    assert first.shape == frame.shape and first.dtype == frame.dtype
+    # Never the buffer holding the input, so that a stage can read one while writing the other
+    second = buffers.get(first)
+    assert second is not first and buffers.get(second) is first and buffers.get(first[:]) is second
+    assert buffers.get(frame) is first
+    gray = buffers.get(frame, (4, 6))
+    assert gray.shape == (4, 6) and buffers.get(gray, (4, 6)) is not gray
+
+
+def test_filters_write_into_out(all_filters, frame):
+    for name, lazy in all_filters.items():
+        filter = lazy.load()
+        if not filter.supports_out:
+            continue
+        params = {param.name: param.default_val for param in filter.get_config()}
+        # Separate instances, so that stateful filters start from the same state
+        expected = filter()
+        expected.configure(params)
+        out = np.zeros(shape_as(frame, filter.output_format or BGR), np.uint8)
+        instance = filter()
+        instance.configure(params)
+        source = frame.copy()
+        result = instance.process(source, out)
+        assert np.shares_memory(result, out) and result.shape == out.shape, name
+        assert np.array_equal(out, expected.process(frame)), name
+        assert np.array_equal(source, frame), name + " modified its input"
+        instance.close()
+        expected.close()
+
+
+def test_stages_reuse_their_buffers(make_chain, frame):
+    chain = make_chain("Blur", "Sharpen", "Luminosity", params={"Luminosity": {"Luminosity": 30}})
+    pipeline = Pipeline(chain)
+    source = frame.copy()
+    result = pipeline.process(source)
+    assert np.array_equal(result, apply_one_by_one(chain, frame))
+    assert np.array_equal(source, frame)
+    # Every frame is written into the same buffers: the result of the previous frame is overwritten
+    assert pipeline.process(synthetic_frame(*VIDEO_SIZE, index=4)) is result
+    pipeline.close()
+
+
+def test_strips_cover_the_frame():
+    tiles = TilePool(4)
+    assert tiles.strips(1000, 0) == [(0, 250), (250, 500), (500, 750), (750, 1000)]
+    # Strips stay large compared to the halo
+    assert tiles.strips(1000, 100) == [(0, 500), (500, 1000)]
+    assert tiles.strips(TilePool.MIN_STRIP_ROWS, 0) == []
+
+
+@pytest.mark.parametrize("names, params", [
+    (["Blur"], {"Blur": {"Horizontal": 9, "Vertical": 15}}),
+    (["Sharpen", "Grayscale", "Sharpen"], {}),
+    (["Luminosity", "Luminosity", "Luminosity", "Blur"], {"Luminosity": {"Contrast": 1.2}}),
+    # Canny must see the whole frame, the stages around it are still split
+    (["Sharpen", "Edge Detection (Canny)", "Blur"], {}),
+])
+def test_tiles_match_the_whole_frame(make_chain, frame, monkeypatch, names, params):
+    # Strips of a few rows, so that the small test frames are split with many boundaries
+    monkeypatch.setattr(TilePool, "MIN_STRIP_ROWS", 8)
+    tiles = TilePool(5)
+    chain = make_chain(*names, params=params)
+    tiled = Pipeline(chain, tiles=tiles)
+    whole = Pipeline(chain)
+    assert any(stage.halo is not None and tiles.strips(frame.shape[0], stage.halo) for stage in tiled.stages)
+    assert np.array_equal(tiled.process(frame), whole.process(frame))
+    tiled.close()
+    whole.close()
+    tiles.close()
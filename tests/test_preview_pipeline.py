@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from benchmark import synthetic_frame
+from conftest import VIDEO_SIZE
+from pipeline import Pipeline, PrefixCache
+from profiler import Profiler
+from render_pipeline import PreviewPipeline
+
+
+@pytest.fixture
+def configured(all_filters, monkeypatch):
+    """
+    :return: the list of (filter name, parameters) given to configure(), by any instance of any filter
+    """
+    calls = []
+    for lazy in all_filters.values():
+        filter = lazy.load()
+
+        def configure(self, params, configure=filter.configure):
+            calls.append((self.get_filter_name(), params))
+            configure(self, params)
+        monkeypatch.setattr(filter, "configure", configure)
+    return calls
+
+
+def test_instances_are_only_configured_when_their_parameters_change(make_chain, configured):
+    chain = make_chain("Luminosity", "Sharpen", "Frame Average")
+    first = Pipeline(chain)
+    assert [name for name, _ in configured] == ["Luminosity", "Sharpen", "Frame Average"]
+    del configured[:]
+    luminosity = chain.entries[0].uid
+    changed = chain.with_value(luminosity, "Luminosity", 40)
+    second = Pipeline(changed, instances=first.instances)
+    assert configured == [("Luminosity", changed.entries[0].vals)]
+    assert all(second.instances[uid] is first.instances[uid] for uid in first.instances)
+    first.close(second.instances)
+    # The same values in another chain: nothing to configure
+    del configured[:]
+    third = Pipeline(changed.with_value(luminosity, "Luminosity", 40), instances=second.instances)
+    assert configured == []
+    second.close(third.instances)
+    third.close()
+
+
+def test_preview_keeps_the_instances(make_chain, configured):
+    preview = PreviewPipeline((80, 60))
+    chain = make_chain("Luminosity", "Frame Average", params={"Frame Average": {"Frames": 4}})
+    pipeline = preview.get_pipeline(chain, None)
+    instances = dict(pipeline.instances)
+    # Nothing is compiled nor configured again for the same chain
+    assert preview.get_pipeline(chain, None) is pipeline
+    del configured[:]
+    changed = chain.with_value(chain.entries[0].uid, "Contrast", 2)
+    pipeline = preview.get_pipeline(changed, None)
+    assert [name for name, _ in configured] == ["Luminosity"]
+    assert pipeline.instances == instances
+    # At another scale, the parameters are scaled, and stateful filters start again
+    del configured[:]
+    pipeline = preview.get_pipeline(changed, (0.5, 0.5))
+    uid = chain.entries[1].uid
+    assert pipeline.instances[uid] is not instances[uid]
+    assert ("Frame Average", pipeline.instances[uid].params) in configured
+    preview.close()
+
+
+def test_prefix_cache_drops_the_least_recently_used_frames():
+    frames = [np.full((4, 4, 3), value, np.uint8) for value in range(4)]
+    cache = PrefixCache(3 * frames[0].nbytes)
+    for key in "abc":
+        cache.put(key, frames["abc".index(key)])
+    assert cache.get("a") is not None
+    cache.put("d", frames[3])
+    # b was the least recently used
+    assert cache.get("b") is None and list(cache.frames) == ["c", "a", "d"]
+    assert cache.size == 3 * frames[0].nbytes
+    # The frames are copied: the buffers they come from can be reused
+    frames[3][:] = 9
+    assert cache.get("d").max() == 3
+    # Replacing a frame does not count it twice
+    cache.put("d", frames[3])
+    assert cache.size == 3 * frames[0].nbytes and cache.get("d").max() == 9
+
+
+def test_prefix_cache_keeps_its_memory_cap():
+    frame = np.zeros((10, 10, 3), np.uint8)
+    cache = PrefixCache(frame.nbytes + 10)
+    # Larger than the whole cache: not kept, and nothing else is dropped for it
+    cache.put("small", frame[:5])
+    cache.put("large", np.zeros((20, 20, 3), np.uint8))
+    assert cache.get("large") is None and cache.get("small") is not None
+    cache.put("frame", frame)
+    assert list(cache.frames) == ["frame"] and cache.size == frame.nbytes <= cache.max_bytes
+    cache.clear()
+    assert cache.size == 0 and cache.get("frame") is None
+
+
+def test_changed_filter_only_recomputes_the_stages_after_it(make_chain):
+    frame = synthetic_frame(*VIDEO_SIZE)
+    cache = PrefixCache(64 * frame.nbytes)
+    chain = make_chain("Luminosity", "Blur", "Edge Detection (Canny)", params={"Luminosity": {"Luminosity": 20}})
+    pipeline = Pipeline(chain)
+    pipeline.process(frame, cache=cache, frame_id=1)
+    blur = chain.entries[1].uid
+    changed = chain.with_value(blur, "Horizontal", 30)
+    second = Pipeline(changed)
+    profiler = Profiler()
+    result = second.process(frame, profiler, cache, 1)
+    assert list(profiler.summary()) == second.keys[second.stage_of(blur):]
+    assert np.array_equal(result, Pipeline(changed).process(frame))
+    # Keys describe the filters and their parameters, not the chain: the same filters in another chain also match
+    profiler = Profiler()
+    third = Pipeline(make_chain("Luminosity", "Blur", params={"Luminosity": {"Luminosity": 20}}))
+    third.process(frame, profiler, cache, 1)
+    assert list(profiler.summary()) == []
+    # ... but not for another frame
+    third.process(frame, profiler, cache, 2)
+    assert list(profiler.summary()) == third.keys
+    for item in (pipeline, second, third):
+        item.close()
+
+
+def test_no_prefix_after_a_stateful_filter(make_chain):
+    chain = make_chain("Luminosity", "Frame Average", "Blur", params={"Frame Average": {"Frames": 4}})
+    pipeline = Pipeline(chain)
+    average = pipeline.stage_of(chain.entries[1].uid)
+    assert all(key is not None for key in pipeline.prefix_keys[:average])
+    assert all(key is None for key in pipeline.prefix_keys[average:])
+    pipeline.close()
@@ -0,0 +1,83 @@
+import csv
+import json
+
+import pytest
+
+from conftest import VIDEO_FRAMES
+from profiler import Profiler
+from video_export import render_video
+
+# Durations recorded for the "filter" stage, in seconds
+DURATIONS = [0.004, 0.001, 0.003, 0.002]
+
+
+def filled_profiler(keep_trace):
+    profiler = Profiler(keep_trace)
+    for seconds in DURATIONS:
+        profiler.record("filter", seconds)
+    profiler.record("encode", 0.010)
+    return profiler
+
+
+def test_summary():
+    summary = filled_profiler(False).summary("filter")
+    assert summary["count"] == 4
+    assert summary["mean"] == pytest.approx(2.5)
+    assert summary["p50"] == pytest.approx(2) and summary["max"] == pytest.approx(4)
+    # The rolling percentiles only see the last durations
+    profiler = Profiler(window=2)
+    for seconds in DURATIONS:
+        profiler.record("filter", seconds)
+    assert profiler.summary("filter")["max"] == pytest.approx(3) and profiler.summary("filter")["count"] == 4
+    assert profiler.summary("unknown") is None
+
+
+def test_export_json(tmp_path):
+    filename = str(tmp_path / "trace.json")
+    filled_profiler(True).export(filename)
+    with open(filename) as f:
+        data = json.load(f)
+    assert list(data["summary"]) == ["filter", "encode"]
+    assert data["summary"]["encode"]["count"] == 1
+    assert data["trace_ms"]["filter"] == pytest.approx([1000 * seconds for seconds in DURATIONS])
+    # Without the trace, only the summary is written
+    filled_profiler(False).export(filename)
+    with open(filename) as f:
+        assert list(json.load(f)) == ["summary"]
+
+
+def test_export_csv(tmp_path):
+    filename = str(tmp_path / "trace.csv")
+    filled_profiler(True).export(filename)
+    with open(filename, newline="") as f:
+        rows = list(csv.reader(f))
+    # One line per execution of a stage
+    assert rows[0] == ["stage", "duration_ms"]
+    assert [row[0] for row in rows[1:]] == ["filter"] * 4 + ["encode"]
+    assert [float(row[1]) for row in rows[1:5]] == pytest.approx([1000 * seconds for seconds in DURATIONS])
+    # One line per stage without the trace
+    filled_profiler(False).export(filename)
+    with open(filename, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["stage"] for row in rows] == ["filter", "encode"]
+    assert int(rows[0]["count"]) == 4 and float(rows[0]["p95_ms"]) == pytest.approx(4)
+
+
+def test_merge():
+    profiler = filled_profiler(True)
+    profiler.merge(filled_profiler(True))
+    assert profiler.summary("filter")["count"] == 8 and profiler.summary("encode")["count"] == 2
+
+
+@pytest.mark.parametrize("segments", [1, 2])
+def test_export_records_every_frame(video, tmp_path, make_chain, segments):
+    profiler = Profiler(keep_trace=True)
+    chain = make_chain("Luminosity", "Sharpen")
+    assert render_video(video, str(tmp_path / "target.avi"), chain, segments=segments, profiler=profiler) \
+        == VIDEO_FRAMES
+    summary = profiler.summary()
+    assert summary["decode"]["count"] == summary["encode"]["count"] == VIDEO_FRAMES
+    filename = str(tmp_path / "trace.json")
+    profiler.export(filename)
+    with open(filename) as f:
+        assert len(json.load(f)["trace_ms"]["encode"]) == VIDEO_FRAMES
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import render_cli
+from conftest import VIDEO_FRAMES, read_frames
+
+
+@pytest.fixture
+def chain_file(tmp_path, all_filters):
+    # all_filters keeps the manifest of the filters out of the home directory
+    filename = tmp_path / "chain.json"
+    filename.write_text(json.dumps({"version": 1, "filters": [{"name": "Luminosity", "params": {"Luminosity": 10}}]}))
+    return str(filename)
+
+
+def test_render_single_video(video, tmp_path, chain_file):
+    target = str(tmp_path / "target.avi")
+    assert render_cli.main([video, target, "--chain", chain_file, "--workers", "1"]) == 0
+    assert len(read_frames(target)) == VIDEO_FRAMES
+
+
+def test_failed_job(video, tmp_path, chain_file):
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"jobs": [
+        {"source": video, "target": "ok.avi", "chain": "chain.json"},
+        {"source": "missing.avi", "target": "missing_out.avi", "chain": "chain.json"},
+    ]}))
+    assert render_cli.main(["--jobs", str(manifest), "--workers", "1", "--concurrency", "2"]) == 1
+    assert len(read_frames(str(tmp_path / "ok.avi"))) == VIDEO_FRAMES
+
+
+@pytest.mark.parametrize("content", [
+    '{"filters": [{"name": "Unknown filter"}]}',
+    '{"filters": [{"name": "Luminosity", "params": {"Luminosity": 1000}}]}',
+    '{"filters": [',
+    None,
+])
+def test_invalid_chain(video, tmp_path, all_filters, content):
+    chain = tmp_path / "chain.json"
+    if content is not None:
+        chain.write_text(content)
+    assert render_cli.main([video, str(tmp_path / "target.avi"), "--chain", str(chain)]) == 2
+
+
+@pytest.mark.parametrize("manifest", [
+    {"no jobs": []},
+    {"jobs": [{"source": "a.avi", "chain": "chain.json"}]},
+    {"jobs": [{"source": "a.avi", "target": "b.avi", "chain": "missing.json"}]},
+    [],
+    {"jobs": {"source": "a.avi"}},
+    {"jobs": ["a.avi"]},
+    {"jobs": [{"source": 1, "target": "b.avi", "chain": "chain.json"}]},
+    {"jobs": [{"source": "a.avi", "target": "b.avi", "chain": 3}]},
+    {"jobs": [{"source": "a.avi", "outputs": {"target": "b.avi"}}]},
+    {"jobs": [{"source": "a.avi", "outputs": ["b.avi"]}]},
+    {"jobs": [{"source": "a.avi", "outputs": [{"target": "b.avi", "chain": "chain.json", "size": 640}]}]},
+])
+def test_invalid_manifest(tmp_path, chain_file, manifest):
+    filename = tmp_path / "manifest.json"
+    filename.write_text(json.dumps(manifest))
+    assert render_cli.main(["--jobs", str(filename)]) == 2
+
+
+def test_invalid_arguments(video):
+    with pytest.raises(SystemExit) as e:
+        render_cli.main([video, "target.avi"])
+    assert e.value.code == 2
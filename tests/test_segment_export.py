@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import VIDEO_FRAMES, read_frames
+from encoders import EncoderConfig
+from render_pipeline import render_serial
+from segment_export import (_render_segment, chain_signature, is_segment_done, render_segments, segment_paths,
+                            split_frames)
+
+
+def test_split_frames_covers_the_range():
+    assert split_frames(10, 3, 5) == [(5, 8), (8, 12), (12, 15)]
+    # Never more segments than frames
+    assert split_frames(2, 5) == [(0, 1), (1, 2)]
+
+
+def render_first_segment(video, parts_dir, chain, encoder):
+    """
+    Renders the first of 3 segments like an export interrupted after it
+    :return: the range of the segment and the signature of the export
+    """
+    start, end = split_frames(VIDEO_FRAMES, 3)[0]
+    signature = chain_signature(video, chain, encoder)
+    os.makedirs(parts_dir, exist_ok=True)
+    _render_segment((video, parts_dir, 0, start, end, chain, signature, False, encoder, ".avi", 1))
+    return start, end, signature
+
+
+def test_is_segment_done(video, tmp_path, make_chain):
+    chain = make_chain("Luminosity")
+    parts_dir = str(tmp_path / "target.avi.parts")
+    encoder = EncoderConfig()
+    start, end, signature = render_first_segment(video, parts_dir, chain, encoder)
+    assert is_segment_done(parts_dir, 0, start, end, signature)
+    # Other filters, another range or another segment
+    assert not is_segment_done(parts_dir, 0, start, end, chain_signature(video, make_chain("Sharpen"), encoder))
+    assert not is_segment_done(parts_dir, 0, start, end + 1, signature)
+    assert not is_segment_done(parts_dir, 1, start, end, signature)
+    # A marker that was not completely written
+    _, marker_path = segment_paths(parts_dir, 0)
+    with open(marker_path, "w") as f:
+        f.write('{"signature": ')
+    assert not is_segment_done(parts_dir, 0, start, end, signature)
+    # A crash while rendering the segment, whose marker is only written at the end
+    os.remove(marker_path)
+    assert not is_segment_done(parts_dir, 0, start, end, signature)
+
+def test_resumed_export_matches_serial(video, tmp_path, make_chain, capsys):
+    chain = make_chain("Luminosity", "Sharpen", params={"Luminosity": {"Luminosity": 30}})
+    target = str(tmp_path / "target.avi")
+    encoder = EncoderConfig("opencv", {"quality": 90})
+    render_first_segment(video, target + ".parts", chain, encoder)
+    assert render_segments(video, target, chain, 3, encoder=encoder) == VIDEO_FRAMES
+    assert "1 segments already rendered" in capsys.readouterr().out
+    assert not os.path.exists(target + ".parts")
+    serial = str(tmp_path / "serial.avi")
+    render_serial(video, serial, chain, encoder=encoder)
+    assert np.array_equal(read_frames(target), read_frames(serial))
+
+
+def test_default_encoder_segments_match_serial(video, tmp_path, make_chain):
+    # The synthetic frames are smooth: even the first frames of the segments are encoded like in a serial render
+    chain = make_chain("Sharpen")
+    target = str(tmp_path / "target.avi")
+    render_segments(video, target, chain, 3, encoder=EncoderConfig())
+    serial = str(tmp_path / "serial.avi")
+    render_serial(video, serial, chain, encoder=EncoderConfig())
+    assert np.array_equal(read_frames(target), read_frames(serial))
+
+
+@pytest.mark.parametrize("options, first_frame_differs", [({}, True), ({"quality": 90}, False)])
+def test_mjpg_segments_of_detailed_frames(tmp_path, options, first_frame_differs):
+    # The default MJPG writer adapts its compression to the first frames of a file: on detailed frames, the first
+    # frame of a segment is not encoded like the same frame in a video written in one go - a fixed quality is
+    frames = np.random.default_rng(0).integers(0, 256, (20, 120, 160, 3), dtype=np.uint8)
+    encoder = EncoderConfig("opencv", options)
+    whole, segment = str(tmp_path / "whole.avi"), str(tmp_path / "segment.avi")
+    for filename, written in ((whole, frames), (segment, frames[10:])):
+        out = encoder.open(filename, 25, (160, 120))
+        for frame in written:
+            out.write(frame)
+        out.release()
+    whole, segment = read_frames(whole)[10:], read_frames(segment)
+    assert np.array_equal(whole[0], segment[0]) != first_frame_differs
+    # The compression has settled after a few frames
+    assert np.array_equal(whole[5:], segment[5:])
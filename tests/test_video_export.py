@@ -0,0 +1,82 @@
+"""
+Saved videos must not depend on how they are rendered: every strategy of render_video() is compared with
+render_serial() on a small generated video
+"""
+import numpy as np
+import pytest
+
+from conftest import read_frames
+from encoders import EncoderConfig
+from render_pipeline import render_parallel, render_serial
+from video_export import render_video
+
+# A chain of stateless filters of every kind: merged point-wise filters, a kernel, a change of format and a filter
+# needing the whole frame
+STATELESS = (["Luminosity", "Sharpen", "Grayscale", "Edge Detection (Canny)"],
+             {"Luminosity": {"Contrast": 1.5, "Luminosity": 20}})
+
+
+@pytest.fixture
+def serial(video, tmp_path):
+    """
+    :return: a function rendering a chain with render_serial() and returning the frames of the result
+    """
+    def render(chain, encoder=None):
+        target = str(tmp_path / "serial.avi")
+        render_serial(video, target, chain, encoder=encoder)
+        return read_frames(target)
+    return render
+
+
+@pytest.mark.parametrize("names, params", [
+    (["Frame Average"], {"Frame Average": {"Frames": 16}}),
+    (["Luminosity", "Face Detection"], {"Face Detection": {"Detect every": 5}}),
+])
+def test_segmented_stateful_chain_matches_serial(video, tmp_path, make_chain, serial, names, params):
+    # Each segment would start with a fresh state: stateful chains must be rendered in one piece
+    chain = make_chain(*names, params=params)
+    target = str(tmp_path / "segments.avi")
+    assert render_video(video, target, chain, workers=2, segments=3) > 0
+    assert np.array_equal(read_frames(target), serial(chain))
+
+
+@pytest.mark.parametrize("names, params", [
+    (["Frame Average"], {"Frame Average": {"Frames": 1}}),
+    (["Luminosity", "Face Detection"], {"Face Detection": {"Detect every": 1, "Detection scale": 0.5}}),
+])
+def test_filters_without_state_are_split(video, tmp_path, make_chain, serial, capsys, names, params):
+    # With these parameters, nothing is carried from one frame to the next (see Filter.is_stateful())
+    chain = make_chain(*names, params=params)
+    target = str(tmp_path / "segments.avi")
+    render_video(video, target, chain, workers=2, segments=3, encoder=EncoderConfig("opencv", {"quality": 90}))
+    output = capsys.readouterr().out
+    assert "single process" not in output and "Segment 2 rendered" in output
+    assert np.array_equal(read_frames(target), serial(chain, EncoderConfig("opencv", {"quality": 90})))
+
+
+@pytest.mark.parametrize("shared_frames", [True, False])
+def test_parallel_matches_serial(video, tmp_path, make_chain, serial, shared_frames):
+    names, params = STATELESS
+    chain = make_chain(*names, params=params)
+    target = str(tmp_path / "parallel.avi")
+    # A small queue, so that the reading thread has to wait for free slots
+    count = render_parallel(video, target, chain, 2, 2, shared_frames=shared_frames)
+    frames = read_frames(target)
+    assert count == len(frames)
+    assert np.array_equal(frames, serial(chain))
+
+
+@pytest.mark.parametrize("names, params", [
+    STATELESS,
+    (["Luminosity", "Frame Average", "Blur"], {"Frame Average": {"Frames": 4}}),
+])
+def test_batches_match_serial(video, tmp_path, make_chain, serial, names, params):
+    chain = make_chain(*names, params=params)
+    expected = serial(chain)
+    target = str(tmp_path / "batches.avi")
+    # Blocks of 5 frames: the last block of the video is shorter
+    render_serial(video, target, chain, batch_size=5)
+    assert np.array_equal(read_frames(target), expected)
+    if not any(entry.filter.stateful for entry in chain):
+        render_parallel(video, target, chain, 2, 8, batch_size=4)
+        assert np.array_equal(read_frames(target), expected)
@@ -0,0 +1,46 @@
+from encoders import EncoderConfig
+from render_pipeline import render_serial, render_parallel
+from segment_export import render_segments
+
+
+def render_video(source_filename, target_filename, chain, workers=1, queue_size=32, segments=1, progress=None,
+                 profiler=None, start_frame=0, end_frame=None, encoder=None, batch_size=1):
+    """
+    Saves a filtered video, choosing the rendering strategy from the settings.
+    This is what both the "Save Video" button and the command line renderer run.
+    :param source_filename: path of the source video
+    :param target_filename: path of the video to write
+    :param chain: the filters to apply with their parameters (FilterChain)
+    :param workers: number of processes applying the filters, 1 filters frames in the calling thread
+    :param queue_size: maximum number of decoded frames waiting to be filtered when using several workers
+    :param segments: when more than 1, the video is split into this number of frame ranges rendered by
+                     separate processes (workers at a time) and joined at the end - see segment_export.py
+    :param progress: optional callable receiving the number of frames written so far
+    :param profiler: optional Profiler recording the duration of decoding, encoding and of each filter,
+                     it must keep its trace when using segments
+    :param start_frame: index of the first frame to render
+    :param end_frame: index of the frame after the last one to render, None to render until the end of the video
+    :param encoder: the EncoderConfig to use (see encoders.py), None for OpenCV's MJPG writer
+    :param batch_size: number of consecutive frames filtered together (see Pipeline.process_batch()), with several
+                       workers the frames that are waiting in the queue
+    :return: the number of frames written
+    """
+    if (workers > 1 or segments > 1) and any(entry.filter.is_stateful(entry.vals) for entry in chain):
+        # Stateful filters need to see all frames in order, which is not the case when spreading frames over
+        # processes, nor with segments: each of them would start with a fresh state
+        print("Some filters keep a state from one frame to the next: filtering in a single process")
+        workers = 1
+        segments = 1
+    if segments > 1 and not (encoder or EncoderConfig()).can_join():
+        # Typically XVID or mp4v without ffmpeg: their frames depend on the previous ones, so that their segments
+        # cannot simply be concatenated
+        print("The segments of this encoder cannot be joined: saving in a single segment")
+        segments = 1
+    if segments > 1:
+        return render_segments(source_filename, target_filename, chain, segments, workers, progress, profiler,
+                               start_frame, end_frame, encoder, batch_size)
+    if workers > 1:
+        return render_parallel(source_filename, target_filename, chain, workers, queue_size, progress, profiler,
+                               start_frame, end_frame, encoder=encoder, batch_size=batch_size)
+    return render_serial(source_filename, target_filename, chain, progress, start_frame, end_frame, profiler, encoder,
+                         batch_size)